@@ -0,0 +1,173 @@
+"""
+Batch runner: many engine analyses from one job file, unattended.
+
+The job file is JSON, for example:
+
+    {
+      "cache": "primes.cache",
+      "jobs": [
+        {"primes": 1000000, "output_dir": "out/1m"},
+        {"primes": 10000000, "reports": ["filtered_results"], "moduli": [7, 210], "output_dir": "out/10m"},
+        {"primes": 1000000, "start": 1000000000, "offsets": [-1, 1, 3], "backend": "miller-rabin",
+         "output_dir": "out/shifted"}
+      ]
+    }
+
+Every job gives its 'output_dir' and optionally 'name', 'primes', 'start',
+'offsets', 'reports', 'moduli' and 'backend', with the defaults of engine.py.
+
+The prime cache (see prime_cache.py) is built once, up to the largest
+candidate of any job with the sieve backend, with the smallest-prime-factor
+table up to the largest candidate of those that select the failure report
+(new_failed_results_by_multiple), and every job reads it instead of sieving.
+Jobs with another backend test their candidates without it, so they leave
+its size alone. Without a 'cache' the cache is built in a temporary
+directory and removed at the end. Jobs with the same
+start, offsets and backend form a group that is analyzed in one pass: the
+smallest job runs first, and each larger one extends the counts of the
+previous job through a checkpoint, so every prime is processed once per
+group. Groups run one after the other, or concurrently with --concurrent.
+
+    python src/batch.py jobs.json --workers 8
+    python src/batch.py jobs.json --concurrent 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import tempfile
+import time
+
+from engine import REPORTS, run_analysis, save_results, select_reports
+from offsets import SEVEN_SISTERS
+from parallel import prime_span
+from prime_cache import build_cache
+
+# Settings of a job that are not given in the job file.
+JOB_DEFAULTS = {
+    'primes': 1_000_000,
+    'start': 2,
+    'offsets': list(SEVEN_SISTERS),
+    'reports': sorted(REPORTS),
+    'moduli': [],
+    'backend': 'sieve',
+}
+
+
+def load_jobs(path):
+    """
+    Reads a job file. Returns the cache path it names (or None) and the jobs
+    with every setting filled in.
+    """
+    with open(path) as f:
+        batch = json.load(f)
+    jobs = []
+    for i, job in enumerate(batch['jobs']):
+        unknown = set(job) - set(JOB_DEFAULTS) - {'name', 'output_dir'}
+        if unknown:
+            raise ValueError(f"Job {i} of '{path}' has unknown settings: {', '.join(sorted(unknown))}")
+        if 'output_dir' not in job:
+            raise ValueError(f"Job {i} of '{path}' has no output_dir")
+        jobs.append({**JOB_DEFAULTS, 'name': f'job-{i}', **job})
+    return batch.get('cache'), jobs
+
+
+def candidate_limit(job):
+    """
+    Returns the largest candidate 2p + k of a job, which the prime cache has to reach.
+    """
+    return 2 * (job['start'] + prime_span(job['start'], job['primes']) - 1) + max(job['offsets'])
+
+
+def plan_groups(jobs):
+    """
+    Groups the jobs that can share one pass over the primes, each group sorted
+    by the number of primes.
+    """
+    groups = {}
+    for job in jobs:
+        groups.setdefault((job['start'], tuple(job['offsets']), job['backend']), []).append(job)
+    return [sorted(group, key=lambda job: job['primes']) for group in groups.values()]
+
+
+def run_group(group, workers=1, cache_path=None, checkpoint_path='batch.ckpt'):
+    """
+    Runs the jobs of one group in a single pass and writes the outputs of every
+    job. Every job's counts cover all reports and moduli of the group; each job
+    only writes its own. The counts of each job are extended to the next job's
+    primes from 'checkpoint_path', which is removed at the end.
+    """
+    reports = select_reports(sorted({name for job in group for name in job['reports']}),
+                             list(dict.fromkeys(m for job in group for m in job['moduli'])))
+    for job in group:
+        print(f"\n{job['name']}: {job['primes']:,} primes from {job['start']:,} -> {job['output_dir']}")
+        results = run_analysis(job['primes'], reports, tuple(job['offsets']), workers, cache_path, job['start'],
+                               job['backend'], checkpoint_path=checkpoint_path)
+        job_reports = select_reports(job['reports'], job['moduli'])
+        results = {name: data for name, data in results.items() if name in job_reports}
+        if 'residue_classes' in results:
+            results['residue_classes'] = {m: results['residue_classes'][m] for m in job['moduli']}
+        save_results(results, job['output_dir'], job_reports)
+    os.remove(checkpoint_path)
+    return [job['name'] for job in group]
+
+
+def _run_group_task(task):
+    return run_group(*task)
+
+
+def run_batch(jobs, cache_path=None, workers=1, concurrent=1):
+    """
+    Runs every job, sharing one prime cache. With concurrent > 1 that many
+    groups run at the same time, each in a single process; otherwise the
+    groups run one after the other with 'workers' processes each.
+    """
+    start_time = time.time()
+    with tempfile.TemporaryDirectory() as work_dir:
+        if cache_path is None:
+            cache_path = os.path.join(work_dir, 'primes.cache')
+        sieve_jobs = [job for job in jobs if job['backend'] == 'sieve']
+        if sieve_jobs:
+            limit = max(candidate_limit(job) for job in sieve_jobs)
+            # Only the failure report reads smallest prime factors, so the table only covers its jobs.
+            spf_jobs = [job for job in sieve_jobs if 'new_failed_results_by_multiple' in job['reports']]
+            spf_limit = max((candidate_limit(job) for job in spf_jobs), default=0)
+            print(f"Preparing the prime cache up to {limit:,}"
+                  + (f", with smallest prime factors up to {spf_limit:,}" if spf_jobs else ""))
+            build_cache(cache_path, limit, spf=bool(spf_jobs), spf_limit=spf_limit)
+        elif not os.path.exists(cache_path):
+            # No job sieves, so there is no cache to share.
+            cache_path = None
+
+        groups = plan_groups(jobs)
+        print(f"{len(jobs)} jobs in {len(groups)} passes")
+        if concurrent > 1:
+            tasks = [(group, 1, cache_path, os.path.join(work_dir, f'pass-{i}.ckpt'))
+                     for i, group in enumerate(groups)]
+            with multiprocessing.Pool(concurrent) as pool:
+                for names in pool.imap_unordered(_run_group_task, tasks):
+                    print(f"Finished {', '.join(names)}")
+        else:
+            for i, group in enumerate(groups):
+                run_group(group, workers, cache_path, os.path.join(work_dir, f'pass-{i}.ckpt'))
+
+    end_time = time.time()
+    print(f"\nBatch complete. Time taken: {end_time - start_time:.2f} seconds.")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run every analysis of a job file without prompts, sharing "
+                                                 "one prime cache.")
+    parser.add_argument('jobs', help="JSON job file")
+    parser.add_argument('--cache', help="prime cache file to build or extend and reuse (overrides the job file)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes per analysis")
+    parser.add_argument('--concurrent', type=int, default=1,
+                        help="run this many passes at the same time, each in one process")
+    args = parser.parse_args()
+
+    cache_path, jobs = load_jobs(args.jobs)
+    run_batch(jobs, args.cache or cache_path, args.workers, args.concurrent)
+
+
+if __name__ == "__main__":
+    main()
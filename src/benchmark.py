@@ -0,0 +1,236 @@
+"""
+Benchmark suite for the sieve, the factor lookups and every analysis.
+
+Each benchmark runs at several scales (numbers of primes) and records its
+best wall time over a few repeats, its throughput and its peak traced memory.
+Results are compared with a saved JSON baseline, and benchmarks that got
+slower than the tolerance allows are flagged as regressions. The suite also
+checks that the engine still reproduces the CSV files in data/ exactly.
+
+    python src/benchmark.py                      # run and compare with the baseline
+    python src/benchmark.py --update-baseline    # run and save as the new baseline
+    python src/benchmark.py --scales 10000 10000000
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+
+import engine
+from ending_digit_results import analyze_prime_offsets_by_ending_digit
+from exact_and_cumulative_results import analyze_prime_offsets
+from filtered_results import analyze_prime_offsets_with_filtering
+from new_failed_results_by_multiple import analyze_failed_offsets, get_smallest_prime_factor
+from offsets import SEVEN_SISTERS
+from sieve import PrimeSieve, generate_primes_up_to, get_first_n_primes, nth_prime
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEFAULT_BASELINE = os.path.join(REPO_DIR, 'benchmarks', 'baseline.json')
+DATA_DIR = os.path.join(REPO_DIR, 'data')
+
+DEFAULT_SCALES = (10_000, 100_000, 1_000_000)
+
+# A benchmark is a regression if it takes this many times its baseline time,
+# and at least MIN_SLOWDOWN seconds longer (shorter runs are mostly noise).
+DEFAULT_TOLERANCE = 1.25
+MIN_SLOWDOWN = 0.01
+
+# Trial division is slow, so the reference factorization is timed on at most this many numbers.
+MAX_FACTORED = 20_000
+
+# The number of primes the files in data/ were produced from.
+DATA_PRIMES = 1_000_000
+
+
+def _composite_candidates(num_primes):
+    """
+    Returns (candidates, prime list) for timing get_smallest_prime_factor: the
+    failed 2p + k candidates of the first primes and the primes for trial division.
+    """
+    primes = get_first_n_primes(num_primes)
+    candidates = (2 * primes[:, None] + np.asarray(SEVEN_SISTERS)[None, :]).ravel()
+    sieve = PrimeSieve(int(candidates.max()))
+    failed = candidates[(candidates > 1) & ~sieve.is_prime_array(candidates)][:MAX_FACTORED]
+    return failed.tolist(), sieve.window(0, int(np.sqrt(candidates.max())) + 2).primes().tolist()
+
+
+def _benchmarks(scale):
+    """
+    Returns (name, function, items, candidates) for every benchmark at one scale.
+    'items' is the number of primes (or numbers) processed, 'candidates' the
+    number of 2p + k candidates tested.
+    """
+    limit = nth_prime(scale)
+    candidates = scale * len(SEVEN_SISTERS)
+    failed, prime_list = _composite_candidates(min(scale, MAX_FACTORED))
+    return [
+        ('generate_primes_up_to', lambda: generate_primes_up_to(limit), scale, 0),
+        ('get_first_n_primes', lambda: get_first_n_primes(scale), scale, 0),
+        ('get_smallest_prime_factor', lambda: [get_smallest_prime_factor(n, prime_list) for n in failed],
+         len(failed), 0),
+        ('analyze_prime_offsets', lambda: analyze_prime_offsets(scale), scale, candidates),
+        ('analyze_prime_offsets_by_ending_digit', lambda: analyze_prime_offsets_by_ending_digit(scale),
+         scale, candidates),
+        ('analyze_prime_offsets_with_filtering', lambda: analyze_prime_offsets_with_filtering(scale),
+         scale, candidates),
+        ('analyze_failed_offsets', lambda: analyze_failed_offsets(scale), scale, candidates),
+        ('engine.run_analysis', lambda: engine.run_analysis(scale), scale, candidates),
+    ]
+
+
+def _quietly(function):
+    # The analyses print their progress; keep the benchmark output readable.
+    with contextlib.redirect_stdout(io.StringIO()):
+        return function()
+
+
+def measure(function, repeat=3):
+    """
+    Returns (best wall time in seconds, peak traced memory in bytes) of function().
+    Time is measured without tracing; the memory in one extra traced run.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+        _quietly(function)
+        best = min(best, time.perf_counter() - start_time)
+
+    tracemalloc.start()
+    try:
+        _quietly(function)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak
+
+
+def run_benchmarks(scales=DEFAULT_SCALES, repeat=3, only=None):
+    """
+    Runs every benchmark (or those named in 'only') at every scale.
+    Returns a dictionary of records keyed by '<name>@<scale>'.
+    """
+    results = {}
+    for scale in scales:
+        for name, function, items, candidates in _benchmarks(scale):
+            if only and name not in only:
+                continue
+            seconds, peak = measure(function, repeat)
+            results[f"{name}@{scale}"] = {
+                'name': name,
+                'scale': scale,
+                'seconds': seconds,
+                'items': items,
+                'items_per_second': items / seconds if seconds else None,
+                'candidates_per_second': candidates / seconds if seconds and candidates else None,
+                'peak_memory_bytes': peak,
+            }
+            print(f"{name:<40} {scale:>12,} primes {seconds:>9.3f} s {items / seconds:>14,.0f} items/s "
+                  f"{peak / 2**20:>9.1f} MiB")
+    return results
+
+
+def compare(results, baseline, tolerance=DEFAULT_TOLERANCE):
+    """
+    Returns (key, baseline seconds, seconds) for every benchmark slower than
+    'tolerance' times its baseline, by more than MIN_SLOWDOWN seconds.
+    """
+    regressions = []
+    for key, record in results.items():
+        reference = baseline.get('results', {}).get(key)
+        if (reference and record['seconds'] > tolerance * reference['seconds']
+                and record['seconds'] - reference['seconds'] > MIN_SLOWDOWN):
+            regressions.append((key, reference['seconds'], record['seconds']))
+    return regressions
+
+
+def check_data(num_primes=DATA_PRIMES):
+    """
+    Runs the engine over the primes the data/ files were made from and returns
+    the names of the reports whose CSV differs from the one in data/.
+    """
+    with tempfile.TemporaryDirectory() as output_dir:
+        _quietly(lambda: engine.save_results(engine.run_analysis(num_primes), output_dir))
+        mismatches = []
+        for name in sorted(engine.REPORTS):
+            with open(os.path.join(output_dir, f"{name}.csv"), newline='') as f:
+                produced = f.read().replace('\r\n', '\n')
+            with open(os.path.join(DATA_DIR, f"{name}.csv"), newline='') as f:
+                expected = f.read().replace('\r\n', '\n')
+            if produced != expected:
+                mismatches.append(name)
+    return mismatches
+
+
+def environment():
+    """
+    Describes the machine the benchmarks ran on.
+    """
+    return {
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'platform': platform.platform(),
+        'processor': platform.processor(),
+        'cpu_count': os.cpu_count(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the sieve, factor lookups and analyses.")
+    parser.add_argument('--scales', type=int, nargs='+', default=DEFAULT_SCALES,
+                        help="numbers of primes to benchmark at")
+    parser.add_argument('--repeat', type=int, default=3, help="timed runs per benchmark; the best counts")
+    parser.add_argument('--only', nargs='+', help="run only these benchmarks")
+    parser.add_argument('--baseline', default=DEFAULT_BASELINE, help="baseline JSON file")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help="slowdown factor flagged as a regression (default: 1.25)")
+    parser.add_argument('--update-baseline', action='store_true', help="save the results as the new baseline")
+    parser.add_argument('--output', help="also write the results to this JSON file")
+    parser.add_argument('--no-check', action='store_true', help="skip the comparison with the files in data/")
+    args = parser.parse_args()
+
+    results = run_benchmarks(args.scales, args.repeat, args.only)
+    report = {'environment': environment(), 'results': results}
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if not args.no_check:
+        mismatches = check_data()
+        if mismatches:
+            failed = True
+            print(f"\nOutput differs from data/ for: {', '.join(mismatches)}")
+        else:
+            print("\nOutput matches every CSV file in data/.")
+
+    if args.update_baseline:
+        os.makedirs(os.path.dirname(args.baseline), exist_ok=True)
+        with open(args.baseline, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.tolerance)
+        for key, before, after in regressions:
+            print(f"REGRESSION {key}: {before:.3f} s -> {after:.3f} s ({after / before:.2f}x)")
+        if regressions:
+            failed = True
+        else:
+            print(f"No regressions against {args.baseline} (tolerance {args.tolerance:.2f}x).")
+    else:
+        print(f"No baseline at {args.baseline}; run with --update-baseline to create one.")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,328 @@
+"""
+Chain explorer: iterates the map p -> 2p + k over the Seven Sisters offsets.
+
+Every prime p has an edge to each prime 2p + k that is greater than p (the
+few candidates below p, like 2*7 - 9 = 5, would make cycles and are left
+out), so the primes form a directed acyclic graph. A chain is a path in it:
+p, then a prime candidate of p, then one of that prime, and so on. Unfolding
+the graph from p gives its tree of chains, whose size is the number of chains
+starting at p; a prime reachable along two paths is counted once per path.
+
+The explorer collects every prime reachable from the starting primes level
+by level, then resolves each prime exactly once, from the largest down, so
+that a shared suffix is computed a single time: its longest chain and tree
+size are reused by every prime leading into it. Candidates up to the sieve
+limit are looked up in one shared sieve (or prime cache); larger ones are
+sieved segment by segment where they are dense, and tested with Miller-Rabin
+where they are sparse.
+"""
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+
+from metrics import collecting, stage
+from offsets import SEVEN_SISTERS, offset_label
+from prime_cache import PrimeCache, build_cache
+from prime_count import prime_count
+from primality import is_prime_batch
+from sieve import BasePrimes, PrimeSieve, PrimeWindow, nth_prime, sieve_window
+
+# Without a prime cache, the sieve covers this many times the largest starting prime.
+# Chains roughly double at every step, so most of the graph lies below it.
+DEFAULT_SIEVE_FACTOR = 16
+
+# Candidates beyond the sieve are grouped into segments of this many integers. A
+# segment is sieved if it holds at least one candidate per MILLER_RABIN_COST
+# integers, which is about where sieving gets cheaper than Miller-Rabin tests.
+SEGMENT_WIDTH = 1 << 24
+MILLER_RABIN_COST = 1000
+
+
+def _is_prime_array(values, sieve, base):
+    """
+    Tests the sorted, distinct 'values': those up to the sieve limit are looked
+    up in it, dense segments beyond it are sieved and the rest are tested with
+    Miller-Rabin. 'base' is a BasePrimes for the segments.
+    """
+    inside = np.searchsorted(values, sieve.limit, side='right')
+    result = np.zeros(values.shape, dtype=bool)
+    result[:inside] = sieve.is_prime_array(values[:inside])
+
+    segments = values[inside:] // SEGMENT_WIDTH
+    bounds = inside + np.flatnonzero(np.diff(segments, prepend=-1, append=-1))
+    sparse = []
+    for lo, hi in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        if (hi - lo) * MILLER_RABIN_COST >= SEGMENT_WIDTH:
+            segment_lo = int(values[lo]) // SEGMENT_WIDTH * SEGMENT_WIDTH
+            segment_hi = segment_lo + SEGMENT_WIDTH
+            window = PrimeWindow(segment_lo, segment_hi, base.ensure(segment_hi))
+            result[lo:hi] = window.is_prime_array(values[lo:hi])
+        else:
+            sparse.append(np.arange(lo, hi))
+    if sparse:
+        sparse = np.concatenate(sparse)
+        result[sparse] = is_prime_batch(values[sparse])
+    return result
+
+
+def _is_new(values, levels):
+    # The sorted levels found so far hold distinct primes; keep the values in none of them.
+    new = np.ones(values.shape, dtype=bool)
+    for level in levels:
+        i = np.minimum(np.searchsorted(level, values), level.size - 1)
+        new &= level[i] != values
+    return new
+
+
+class ChainGraph:
+    """
+    The chain graph reachable from a range of starting primes, with the
+    longest chain and the tree size of every prime in it.
+
+    'nodes' holds the primes in ascending order; 'depth' the number of primes
+    in the longest chain from each, 'tree_size' its number of chains and
+    'next' the index of the next prime on its longest chain (-1 at the end).
+    """
+
+    def __init__(self, start_primes, nodes, sources, targets, offsets=SEVEN_SISTERS, multiplier=2):
+        self.offsets = offsets
+        self.multiplier = multiplier
+        self.nodes = nodes
+        self.start_primes = start_primes
+        self.starts = np.searchsorted(nodes, start_primes)
+
+        # Edges as node indices, sorted by source and then target; those of node i
+        # are first_edge[i]:first_edge[i + 1].
+        sources = np.searchsorted(nodes, sources)
+        targets = np.searchsorted(nodes, targets)
+        order = np.lexsort((targets, sources))
+        self.sources = sources[order]
+        self.targets = targets[order]
+        self.first_edge = np.searchsorted(self.sources, np.arange(nodes.size + 1))
+
+        self.depth = np.ones(nodes.size, dtype=np.int64)
+        self.tree_size = np.ones(nodes.size, dtype=np.int64)
+        self.next = np.full(nodes.size, -1, dtype=np.int64)
+        self._resolve()
+
+    def _resolve(self):
+        """
+        Computes depth, tree_size and next for every node, largest primes first.
+        """
+        nodes = self.nodes
+        min_offset = min(self.offsets)
+        hi = nodes.size
+        while hi > 0:
+            # Every successor of p is at least multiplier * p + min(k). The primes whose
+            # successors are all at or above the smallest resolved prime form the next
+            # chunk; a single prime is always safe, as its successors are larger.
+            if hi == nodes.size:
+                lo = hi - 1
+            else:
+                lowest = -((min_offset - int(nodes[hi])) // self.multiplier)
+                lo = min(int(np.searchsorted(nodes, lowest)), hi - 1)
+
+            e0, e1 = self.first_edge[lo], self.first_edge[hi]
+            if e1 > e0:
+                with stage('chain_resolve', hi - lo):
+                    sources = self.sources[e0:e1]
+                    targets = self.targets[e0:e1]
+                    starts = self.first_edge[lo:hi]
+                    has_edges = self.first_edge[lo + 1:hi + 1] > starts
+                    segments = starts[has_edges] - e0
+                    self.depth[lo:hi][has_edges] = 1 + np.maximum.reduceat(self.depth[targets], segments)
+                    self.tree_size[lo:hi][has_edges] = 1 + np.add.reduceat(self.tree_size[targets], segments)
+
+                    # The next prime on a longest chain: the smallest successor of greatest depth.
+                    best = self.depth[targets] == self.depth[sources] - 1
+                    best_sources, first = np.unique(sources[best], return_index=True)
+                    self.next[best_sources] = targets[best][first]
+            hi = lo
+
+    def chain(self, p):
+        """
+        Returns a longest chain starting at the prime p, as a list of primes.
+        """
+        i = int(np.searchsorted(self.nodes, p))
+        if i == self.nodes.size or self.nodes[i] != p:
+            raise ValueError(f"{p:,} is not a prime in the chain graph")
+        chain = [int(self.nodes[i])]
+        while self.next[i] >= 0:
+            i = self.next[i]
+            chain.append(int(self.nodes[i]))
+        return chain
+
+    def chain_offsets(self, chain):
+        """
+        Returns the offset label of every step of a chain, e.g. ['2p+1', '2p-3'].
+        """
+        return [offset_label(q - self.multiplier * p, self.multiplier) for p, q in zip(chain, chain[1:])]
+
+    def _top(self, values, count):
+        # The starting primes with the largest values, smaller primes first among ties.
+        order = np.lexsort((self.start_primes, -values[self.starts]))[:count]
+        return [(int(self.start_primes[i]), int(values[self.starts[i]])) for i in order]
+
+    def longest_chains(self, count=20):
+        """
+        Returns (starting prime, chain length) for the 'count' starting primes with the longest chains.
+        """
+        return self._top(self.depth, count)
+
+    def largest_trees(self, count=20):
+        """
+        Returns (starting prime, tree size) for the 'count' starting primes with the largest trees.
+        """
+        return self._top(self.tree_size, count)
+
+    def length_distribution(self):
+        """
+        Returns an array whose entry n counts the starting primes whose longest chain has n primes.
+        """
+        return np.bincount(self.depth[self.starts])
+
+    def tree_size_distribution(self):
+        """
+        Returns an array whose entry b counts the starting primes with a tree
+        size from 2^b to 2^(b + 1) - 1.
+        """
+        sizes = self.tree_size[self.starts]
+        return np.bincount(np.floor(np.log2(sizes)).astype(np.int64))
+
+
+def build_graph(start_primes, sieve, offsets=SEVEN_SISTERS, multiplier=2):
+    """
+    Collects every prime reachable from 'start_primes' and the edges between
+    them, level by level. Each prime's candidates are tested once, as it is
+    first reached. Returns a ChainGraph.
+    """
+    offsets_array = np.asarray(offsets, dtype=np.int64)
+    base = BasePrimes()
+    levels = [start_primes]
+    frontier = start_primes
+    sources, targets = [], []
+    while frontier.size:
+        if frontier[-1] > (np.iinfo(np.int64).max - max(offsets)) // multiplier:
+            raise OverflowError("Chains leave the 64-bit integer range")
+        with stage('chain_level', frontier.size):
+            candidates = multiplier * frontier[:, None] + offsets_array[None, :]
+            froms = np.broadcast_to(frontier[:, None], candidates.shape)
+            upward = candidates > froms
+            froms, candidates = froms[upward], candidates[upward]
+
+            # Test every distinct candidate once.
+            distinct, inverse = np.unique(candidates, return_inverse=True)
+            is_prime = _is_prime_array(distinct, sieve, base)
+            edges = is_prime[inverse]
+            sources.append(froms[edges])
+            targets.append(candidates[edges])
+
+            reached = distinct[is_prime]
+            frontier = reached[_is_new(reached, levels)]
+            levels.append(frontier)
+
+    nodes = np.sort(np.concatenate(levels))
+    return ChainGraph(start_primes, nodes, np.concatenate(sources), np.concatenate(targets), offsets, multiplier)
+
+
+def explore_chains(num_primes_to_check=1_000_000, start=2, offsets=SEVEN_SISTERS, multiplier=2, cache_path=None,
+                   sieve_limit=None, metrics=None):
+    """
+    Builds the chain graph of the first 'num_primes_to_check' primes from
+    'start' and resolves the longest chain and tree size of every prime in it.
+    'cache_path' names a prime cache (see prime_cache.py) to look candidates up
+    in; otherwise a sieve up to 'sieve_limit' is built, by default
+    DEFAULT_SIEVE_FACTOR times the largest starting prime.
+    'metrics' is a metrics.Metrics object that the time of every stage is recorded into.
+    Returns a ChainGraph.
+    """
+    print(f"\nExploring the chains of {num_primes_to_check:,} primes...")
+    start_time = time.time()
+    with collecting(metrics):
+        last = nth_prime(prime_count(start - 1) + num_primes_to_check)
+        with stage('sieve'):
+            if cache_path is not None:
+                sieve = PrimeCache(cache_path).sieve
+            else:
+                sieve = PrimeSieve(sieve_limit or DEFAULT_SIEVE_FACTOR * last)
+            window = sieve.window(start, last + 1) if last <= sieve.limit else sieve_window(start, last + 1)
+            start_primes = window.primes()
+        graph = build_graph(start_primes, sieve, tuple(offsets), multiplier)
+    end_time = time.time()
+    print(f"{graph.nodes.size:,} primes and {graph.sources.size:,} edges in the graph. "
+          f"Time taken: {end_time - start_time:.2f} seconds.")
+    return graph
+
+
+def save_to_csv(graph, filename, top=20):
+    """
+    Saves the longest chains, the largest trees and the distributions of chain
+    length and tree size over the starting primes, as four tables.
+    """
+    try:
+        with open(filename, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            num_starts = graph.start_primes.size
+
+            writer.writerow(['Rank', 'Start Prime', 'Chain Length', 'Tree Size', 'Chain', 'Offsets'])
+            for rank, (p, length) in enumerate(graph.longest_chains(top), 1):
+                chain = graph.chain(p)
+                tree_size = int(graph.tree_size[np.searchsorted(graph.nodes, p)])
+                writer.writerow([rank, p, length, tree_size, ' -> '.join(map(str, chain)),
+                                 ' '.join(graph.chain_offsets(chain))])
+
+            writer.writerow([])
+            writer.writerow(['Rank', 'Start Prime', 'Tree Size', 'Chain Length'])
+            for rank, (p, tree_size) in enumerate(graph.largest_trees(top), 1):
+                writer.writerow([rank, p, tree_size, int(graph.depth[np.searchsorted(graph.nodes, p)])])
+
+            writer.writerow([])
+            writer.writerow(['Chain Length', 'Starting Primes', 'Percentage (%)'])
+            for length, count in enumerate(graph.length_distribution()):
+                if count:
+                    writer.writerow([length, int(count), f"{count / num_starts * 100:.4f}"])
+
+            writer.writerow([])
+            writer.writerow(['Tree Size', 'Starting Primes', 'Percentage (%)'])
+            for b, count in enumerate(graph.tree_size_distribution()):
+                if count:
+                    sizes = f"{2 ** b}" if b == 0 else f"{2 ** b}-{2 ** (b + 1) - 1}"
+                    writer.writerow([sizes, int(count), f"{count / num_starts * 100:.4f}"])
+
+        print(f"\nResults successfully saved to {filename}")
+        print(f"File location: {os.path.abspath(filename)}")
+    except IOError as e:
+        print(f"An error occurred while writing the file: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Find the longest chains p -> 2p + k -> ... and largest trees.")
+    parser.add_argument('--primes', type=int, default=1_000_000, help="number of starting primes")
+    parser.add_argument('--start', type=int, default=2, help="start from the primes from this number on")
+    parser.add_argument('--offsets', type=int, nargs='+', default=SEVEN_SISTERS, help="offsets k to follow")
+    parser.add_argument('--multiplier', type=int, default=2, help="the multiplier a (default: 2)")
+    parser.add_argument('--cache', help="prime cache file, built or extended up to the sieve limit as needed")
+    parser.add_argument('--sieve-limit', type=int, help="sieve candidates up to this number; larger ones "
+                                                        "are tested with Miller-Rabin")
+    parser.add_argument('--top', type=int, default=20, help="number of longest chains and largest trees listed")
+    parser.add_argument('--output', default='chains.csv', help="CSV file for the tables")
+    args = parser.parse_args()
+
+    if args.cache:
+        last = nth_prime(prime_count(args.start - 1) + args.primes)
+        build_cache(args.cache, args.sieve_limit or DEFAULT_SIEVE_FACTOR * last)
+    graph = explore_chains(args.primes, args.start, sorted(args.offsets), args.multiplier, cache_path=args.cache,
+                           sieve_limit=args.sieve_limit)
+
+    print(f"\n{'Start Prime':>15} {'Length':>7} {'Tree Size':>10}  Chain")
+    for p, length in graph.longest_chains(min(args.top, 10)):
+        tree_size = int(graph.tree_size[np.searchsorted(graph.nodes, p)])
+        print(f"{p:>15,} {length:>7} {tree_size:>10,}  {' -> '.join(map(str, graph.chain(p)))}")
+    save_to_csv(graph, args.output, args.top)
+
+
+if __name__ == "__main__":
+    main()
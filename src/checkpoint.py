@@ -0,0 +1,89 @@
+"""
+Checkpoints for long analysis runs.
+
+A checkpoint holds the mergeable counts of an analysis together with the
+number of primes processed and the last of them. A run that stops can resume
+from its checkpoint, and a completed run can be extended to more primes by
+processing only the new ones and continuing from the saved counts.
+"""
+import os
+import pickle
+import time
+
+from metrics import stage
+
+FORMAT_VERSION = 3
+
+# Minimum number of seconds between two checkpoints written during a run.
+CHECKPOINT_INTERVAL = 60
+
+
+def checkpoint_key(counts, start=2, multiplier=2):
+    """
+    Describes the analysis a checkpoint belongs to. A checkpoint is only resumed
+    by an analysis with the same counts type (and reports, for the engine),
+    offsets, multiplier and start, and the same 'settings' of the counts, if they
+    have any (the windows of windowed statistics or the moduli of a residue breakdown).
+    """
+    key = {
+        'counts': type(counts).__qualname__,
+        'reports': sorted(getattr(counts, 'reports', ())),
+        'offsets': [int(k) for k in counts.offsets],
+        'multiplier': multiplier,
+        'start': start,
+    }
+    if hasattr(counts, 'settings'):
+        key['settings'] = counts.settings
+    return key
+
+
+class Checkpoint:
+    """
+    A checkpoint file for one analysis, saved at most every 'interval' seconds.
+    """
+
+    def __init__(self, path, key, interval=CHECKPOINT_INTERVAL):
+        self.path = path
+        self.key = key
+        self.interval = interval
+        self._last_save = time.time()
+
+    def load(self):
+        """
+        Returns (counts, num_primes, last_prime) from the checkpoint file, or None
+        if there is none yet.
+        """
+        if not os.path.exists(self.path):
+            return None
+        with open(self.path, 'rb') as f:
+            state = pickle.load(f)
+        if state.get('version') != FORMAT_VERSION:
+            raise ValueError(f"'{self.path}' has checkpoint version {state.get('version')}, "
+                             f"expected {FORMAT_VERSION}")
+        if state['key'] != self.key:
+            raise ValueError(f"'{self.path}' is a checkpoint of a different analysis: {state['key']}")
+        return state['counts'], state['num_primes'], state['last_prime']
+
+    def save(self, counts, num_primes, last_prime, force=False):
+        """
+        Writes the counts if the interval has passed (or if force is True).
+        The file is replaced atomically, so a crash never leaves it half written.
+        """
+        if not force and time.time() - self._last_save < self.interval:
+            return
+        with stage('checkpoint'):
+            self._write(counts, num_primes, last_prime)
+        self._last_save = time.time()
+
+    def _write(self, counts, num_primes, last_prime):
+        state = {
+            'version': FORMAT_VERSION,
+            'key': self.key,
+            'num_primes': num_primes,
+            'last_prime': last_prime,
+            'counts': counts,
+        }
+        temporary = self.path + '.tmp'
+        with open(temporary, 'wb') as f:
+            pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary, self.path)
@@ -0,0 +1,178 @@
+"""
+Which offsets succeed together: joint success and failure counts of every pair of offsets.
+
+The successes of each prime are packed into a bitmask with a bit per offset
+(see success_store.py), and one bincount over (last digit of p, mask) counts
+how many primes have each of the 2^7 = 128 success patterns, per ending
+digit. Every pairwise count is a sum over that histogram: the primes where
+offsets i and j both succeed are those whose mask has both bits set. So the
+full matrices cost a single extra bincount per block rather than a pass per
+pair, and the conditional rates follow from them.
+"""
+import argparse
+import csv
+import os
+import time
+
+import numpy as np
+
+from metrics import collecting
+from offsets import SEVEN_SISTERS, offset_label
+from parallel import run_sharded
+from primality import BACKENDS
+from success_store import success_masks
+
+# Histograms have 2^(number of offsets) bins per digit, which caps the offsets.
+MAX_OFFSETS = 16
+
+# The ending digits with tables of their own, after the tables over all primes.
+ENDING_DIGITS = (1, 3, 7, 9)
+
+
+class CoSuccessCounts:
+    """
+    Mergeable histogram of the success patterns of the primes, by last digit of
+    p, for one contiguous range of primes.
+    """
+
+    def __init__(self, offsets=SEVEN_SISTERS):
+        if len(offsets) > MAX_OFFSETS:
+            raise ValueError(f"Co-success counts hold at most {MAX_OFFSETS} offsets, not {len(offsets)}")
+        self.offsets = offsets
+        # pattern_counts[d, mask] counts the primes ending in d whose successful offsets are the bits of mask.
+        self.pattern_counts = np.zeros((10, 1 << len(offsets)), dtype=np.int64)
+
+    def update(self, block):
+        """
+        Adds one OffsetBlock of primes and the primality of their candidates.
+        """
+        num_patterns = self.pattern_counts.shape[1]
+        masks = success_masks(block.success).astype(np.int64)
+        bins = (block.primes % 10) * num_patterns + masks
+        self.pattern_counts += np.bincount(bins, minlength=self.pattern_counts.size).reshape(10, num_patterns)
+
+    def merge(self, other):
+        """
+        Adds the counts of another range.
+        """
+        self.pattern_counts += other.pattern_counts
+        return self
+
+    def joint_counts(self, patterns):
+        """
+        Returns (both succeed, both fail) as (offsets x offsets) matrices for a
+        histogram of success patterns. The diagonals hold the primes where each
+        offset succeeds and fails.
+        """
+        masks = np.arange(patterns.size)
+        bits = ((masks[:, None] >> np.arange(len(self.offsets))[None, :]) & 1).astype(np.int64)
+        weighted = patterns[:, None] * bits
+        both_succeed = bits.T @ weighted
+        both_fail = (1 - bits).T @ (patterns[:, None] - weighted)
+        return both_succeed, both_fail
+
+
+def analyze_offset_co_success(num_primes_to_check=1_000_000, workers=1, cache_path=None, start=2,
+                              backend='sieve', checkpoint_path=None, metrics=None):
+    """
+    Tests the seven specific offsets on the first 'num_primes_to_check' primes
+    and counts, for every pair of offsets, the primes where both succeed and
+    where both fail, overall and by ending digit. The other arguments are those
+    of the other analyses.
+    """
+    print("\nAnalyzing which prime offsets succeed together...")
+    start_time = time.time()
+    with collecting(metrics):
+        counts = run_sharded(CoSuccessCounts, num_primes_to_check, workers, cache_path, start, backend,
+                             checkpoint_path=checkpoint_path)
+    end_time = time.time()
+    print(f"Analysis complete. Time taken: {end_time - start_time:.2f} seconds.")
+    return results_from_counts(counts)
+
+
+def results_from_counts(counts):
+    """
+    Builds the nested result dictionary saved by save_to_csv from merged
+    CoSuccessCounts: {'all' or ending digit: {(offset, other offset): statistics}},
+    with the counts of both succeeding and both failing and the success rate of
+    the other offset given that the first succeeds, or fails.
+    """
+    results = {}
+    for group in ('all',) + ENDING_DIGITS:
+        patterns = counts.pattern_counts.sum(axis=0) if group == 'all' else counts.pattern_counts[group]
+        total = int(patterns.sum())
+        both_succeed, both_fail = counts.joint_counts(patterns)
+        successes = np.diag(both_succeed)
+        results[group] = {}
+        for i, k in enumerate(counts.offsets):
+            failures = total - int(successes[i])
+            for j, other in enumerate(counts.offsets):
+                # Primes where 'other' succeeds but k fails.
+                other_only = int(successes[j] - both_succeed[i, j])
+                results[group][k, other] = {
+                    'total': total,
+                    'both_succeed': int(both_succeed[i, j]),
+                    'both_fail': int(both_fail[i, j]),
+                    'rate_given_success': both_succeed[i, j] / successes[i] * 100 if successes[i] else 0.0,
+                    'rate_given_failure': other_only / failures * 100 if failures else 0.0,
+                }
+    return results
+
+
+def save_to_csv(data, filename, multiplier=2):
+    """
+    Saves the pairwise counts as one table per group of primes, with a row for
+    every ordered pair of offsets.
+    """
+    try:
+        with open(filename, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            for group, pairs in data.items():
+                writer.writerow([])
+                writer.writerow([
+                    'Prime Ending',
+                    'Offset',
+                    'Other Offset',
+                    'Total Primes',
+                    'Both Succeed',
+                    'Both Fail',
+                    'Other Success Rate Given Offset Succeeds (%)',
+                    'Other Success Rate Given Offset Fails (%)'
+                ])
+                for (offset, other), values in pairs.items():
+                    writer.writerow([
+                        'all' if group == 'all' else f'ending_{group}',
+                        offset_label(offset, multiplier),
+                        offset_label(other, multiplier),
+                        values['total'],
+                        values['both_succeed'],
+                        values['both_fail'],
+                        f"{values['rate_given_success']:.4f}",
+                        f"{values['rate_given_failure']:.4f}"
+                    ])
+
+        print(f"\nResults successfully saved to {filename}")
+        print(f"File location: {os.path.abspath(filename)}")
+    except IOError as e:
+        print(f"An error occurred while writing the file: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Count which offsets succeed together, per pair of offsets.")
+    parser.add_argument('--primes', type=int, default=1_000_000, help="number of primes to analyze")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--cache', help="prime cache file to read instead of sieving")
+    parser.add_argument('--start', type=int, default=2, help="analyze the primes from this number on")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='sieve',
+                        help="how candidates are tested for primality (default: sieve)")
+    parser.add_argument('--checkpoint', help="checkpoint file to save progress to, and to resume or extend from")
+    parser.add_argument('--output', default='co_success.csv', help="CSV file for the tables")
+    args = parser.parse_args()
+
+    results = analyze_offset_co_success(args.primes, workers=args.workers, cache_path=args.cache, start=args.start,
+                                        backend=args.backend, checkpoint_path=args.checkpoint)
+    save_to_csv(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
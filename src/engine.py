@@ -0,0 +1,201 @@
+"""
+Single-pass engine that produces every Seven Sisters report from one traversal.
+
+The primes are sieved and walked once. Each block's candidates and their
+primality are computed once and fed to the counts of every selected report,
+and each report's existing CSV format is still available as an output view.
+"""
+import argparse
+import functools
+import os
+import time
+from collections import namedtuple
+
+import co_success
+import ending_digit_results
+import exact_and_cumulative_results
+import filtered_results
+import new_failed_results_by_multiple
+import residue_classes
+import success_store
+from metrics import Metrics, collecting, stage
+from offsets import SEVEN_SISTERS
+from parallel import prime_span, run_sharded
+from prime_cache import build_cache
+from primality import BACKENDS
+
+# A report plugged into the engine: a factory for its mergeable counts, the
+# function turning merged counts into its results, and its CSV writer.
+Report = namedtuple('Report', ['make_counts', 'results_from_counts', 'save_to_csv'])
+
+# The four reports of the note, keyed by the name of their CSV file in data/.
+REPORTS = {
+    'exact_and_cumulative_results': Report(
+        exact_and_cumulative_results.OffsetCounts,
+        exact_and_cumulative_results.results_from_counts,
+        exact_and_cumulative_results.save_to_csv),
+    'ending_digit_results': Report(
+        ending_digit_results.EndingDigitCounts,
+        ending_digit_results.results_from_counts,
+        ending_digit_results.save_to_csv),
+    'filtered_results': Report(
+        filtered_results.FilteredCounts,
+        filtered_results.results_from_counts,
+        filtered_results.save_to_csv),
+    'new_failed_results_by_multiple': Report(
+        new_failed_results_by_multiple.FailureCounts,
+        new_failed_results_by_multiple.results_from_counts,
+        new_failed_results_by_multiple.save_to_csv),
+}
+
+# Reports produced only on request, keyed by the name of their CSV file.
+OPTIONAL_REPORTS = {
+    'co_success': Report(co_success.CoSuccessCounts, co_success.results_from_counts, co_success.save_to_csv),
+}
+
+
+def select_reports(names=None, moduli=None):
+    """
+    Returns the reports with the given names (all four by default; optional
+    reports by name too), plus the residue-class breakdown (see
+    residue_classes.py) if 'moduli' are given.
+    """
+    available = dict(REPORTS, **OPTIONAL_REPORTS)
+    reports = {name: available[name] for name in (sorted(REPORTS) if names is None else names)}
+    if moduli:
+        reports['residue_classes'] = Report(residue_classes.residue_report(moduli),
+                                            residue_classes.results_from_counts, residue_classes.save_to_csv)
+    return reports
+
+
+class CombinedCounts:
+    """
+    The counts of several reports, updated from the same blocks and merged
+    together, and the number of primes they cover.
+    """
+
+    def __init__(self, reports=None, offsets=SEVEN_SISTERS):
+        self.reports = REPORTS if reports is None else reports
+        self.offsets = offsets
+        self.counts = {name: report.make_counts(offsets) for name, report in self.reports.items()}
+        self.num_primes = 0
+
+    def update(self, block):
+        """
+        Feeds one OffsetBlock to every report.
+        """
+        self.num_primes += block.primes.size
+        for counts in self.counts.values():
+            counts.update(block)
+
+    def merge(self, other):
+        """
+        Merges the counts of the following range, report by report.
+        """
+        for name, counts in self.counts.items():
+            counts.merge(other.counts[name])
+        self.num_primes += other.num_primes
+        return self
+
+    @property
+    def settings(self):
+        """
+        The settings of the reports that have any, keyed by report name (see checkpoint.py).
+        """
+        return {name: counts.settings for name, counts in self.counts.items() if hasattr(counts, 'settings')}
+
+    def results(self):
+        """
+        Returns the results of every report, keyed by report name.
+        """
+        return {name: self.reports[name].results_from_counts(counts) for name, counts in self.counts.items()}
+
+
+def run_analysis(num_primes_to_check=1_000_000, reports=None, offsets=SEVEN_SISTERS, workers=1,
+                 cache_path=None, start=2, backend='sieve', checkpoint_path=None, store_path=None,
+                 metrics=None):
+    """
+    Runs the selected reports (all four by default) over the first
+    'num_primes_to_check' primes from 'start' in a single pass.
+    'cache_path' names a prime cache file (see prime_cache.py) to read instead of sieving,
+    and 'backend' the primality backend for the candidates outside it.
+    'checkpoint_path' names a file the counts are saved to as the run progresses;
+    a later call resumes from it, or extends it to more primes.
+    With a 'store_path' the success mask of every prime is also saved there as a SuccessStore.
+    'metrics' is a metrics.Metrics object that the time and memory of every stage are recorded into.
+    Returns a dictionary of results keyed by report name.
+    """
+    reports = REPORTS if reports is None else reports
+    if store_path is not None:
+        # The per-prime success store (see success_store.py), written to store_path as the run goes.
+        reports = dict(reports, success_store=Report(success_store.store_report(store_path),
+                                                     success_store.results_from_counts, success_store.save_store))
+
+    print(f"\nAnalyzing the first {num_primes_to_check:,} primes in a single pass...")
+    start_time = time.time()
+    with collecting(metrics):
+        counts = run_sharded(functools.partial(CombinedCounts, reports, offsets), num_primes_to_check, workers,
+                             cache_path, start, backend, checkpoint_path=checkpoint_path)
+        end_time = time.time()
+        print(f"Analysis complete. Time taken: {end_time - start_time:.2f} seconds.")
+        with stage('results'):
+            results = counts.results()
+        if store_path is not None:
+            store = results.pop('success_store')
+            print(f"\nSuccess store with {len(store):,} primes saved to {os.path.abspath(store_path)}")
+    return results
+
+
+def save_results(results, output_dir, reports=None):
+    """
+    Writes every report's results to '<report name>.csv' in output_dir.
+    """
+    reports = REPORTS if reports is None else reports
+    os.makedirs(output_dir, exist_ok=True)
+    for name, data in results.items():
+        with stage('csv_write'):
+            reports[name].save_to_csv(data, os.path.join(output_dir, f"{name}.csv"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Produce all Seven Sisters reports from one pass over the primes.")
+    parser.add_argument('--primes', type=int, default=1_000_000, help="number of primes to analyze")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--output-dir', default='.', help="directory for the CSV files")
+    parser.add_argument('--cache', help="prime cache file, built or extended as needed and reused across runs")
+    parser.add_argument('--start', type=int, default=2, help="analyze the primes from this number on")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='sieve',
+                        help="how candidates are tested for primality (default: sieve)")
+    parser.add_argument('--checkpoint', help="checkpoint file to save progress to, and to resume or extend from")
+    parser.add_argument('--store', help="directory to save the success mask of every prime to")
+    parser.add_argument('--metrics', help="write per-stage timings to this file (.prom: Prometheus text, "
+                                          "otherwise JSON lines)")
+    parser.add_argument('--trace-memory', action='store_true', help="also trace peak memory with tracemalloc")
+    parser.add_argument('--reports', nargs='+', choices=sorted(REPORTS) + sorted(OPTIONAL_REPORTS),
+                        default=sorted(REPORTS), help="reports to produce (default: the four of the note; "
+                                                      "co_success counts which offsets succeed together)")
+    parser.add_argument('--moduli', type=int, nargs='+',
+                        help="also break the statistics down by residue class of p modulo these "
+                             "(residue_classes.csv, see residue_classes.py)")
+    args = parser.parse_args()
+
+    reports = select_reports(args.reports, args.moduli)
+    if args.cache:
+        # Make sure the cache reaches the largest candidate; only the missing range is sieved.
+        limit = 2 * (args.start + prime_span(args.start, args.primes) - 1) + max(SEVEN_SISTERS)
+        build_cache(args.cache, limit, spf='new_failed_results_by_multiple' in reports)
+    metrics = Metrics(trace_memory=args.trace_memory) if args.metrics else None
+    results = run_analysis(args.primes, reports, workers=args.workers, cache_path=args.cache, start=args.start,
+                           backend=args.backend, checkpoint_path=args.checkpoint, store_path=args.store,
+                           metrics=metrics)
+    with collecting(metrics):
+        save_results(results, args.output_dir, reports)
+
+    if metrics is not None:
+        print("\n" + metrics.summary())
+        metrics.write(args.metrics, primes=args.primes, workers=args.workers, reports=sorted(reports))
+        print(f"Metrics written to {args.metrics}")
+
+
+if __name__ == "__main__":
+    main()
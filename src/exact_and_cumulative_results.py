@@ -2,89 +2,147 @@ import csv
 import time
 import os
 
-def generate_primes_up_to(n):
+import numpy as np
+
+from metrics import collecting
+from offsets import SEVEN_SISTERS
+from parallel import run_sharded
+
+class OffsetCounts:
     """
-    Generates a list of primes up to a given number n using the Sieve of Eratosthenes.
-    The list of primes is used for efficient lookup during the analysis.
+    Mergeable counters behind analyze_prime_offsets, for one contiguous range of primes.
+    Counts for consecutive ranges are combined by calling merge() in range order.
     """
-    # Create a boolean list where is_prime[i] is True if i is potentially prime.
-    is_prime = [True] * (n + 1)
-    is_prime[0] = is_prime[1] = False  # 0 and 1 are not prime numbers.
 
-    # Iterate from 2 up to the square root of n.
-    for i in range(2, int(n**0.5) + 1):
-        if is_prime[i]:
-            # Mark all multiples of i as not prime.
-            for multiple in range(i * i, n + 1, i):
-                is_prime[multiple] = False
+    def __init__(self, offsets=SEVEN_SISTERS):
+        self.offsets = offsets
+        self.num_primes = 0
+
+        # Count how many primes had exactly 0..7 successful offsets, and how often each offset succeeded.
+        self.exact_counts = np.zeros(len(offsets) + 1, dtype=np.int64)
+        self.offset_counts = np.zeros(len(offsets), dtype=np.int64)
+        self.total_produced = 0
+        self.unique_produced = 0
+
+        # A produced prime 2p + k can only be produced again by a prime within a few units
+        # of p, so produced primes are marked in a bitmap over the current window only:
+        # 'tail' covers [tail_lo, tail_lo + tail.size) and is carried into the next block,
+        # 'head' covers [head_lo, head_limit), the values an earlier range could also produce.
+        self.head = np.zeros(0, dtype=bool)
+        self.head_lo = None
+        self.head_limit = None
+        self.tail = np.zeros(0, dtype=bool)
+        self.tail_lo = 0
+
+    def update(self, block):
+        """
+        Adds one OffsetBlock of primes and the primality of their candidates.
+        """
+        primes, window, candidates, success = block.primes, block.window, block.candidates, block.success
+        if primes.size == 0:
+            return
+        
+        # Row sums give the number of successful offsets per prime, column sums the per-offset counts.
+        self.num_primes += primes.size
+        self.exact_counts += np.bincount(success.sum(axis=1), minlength=len(self.offsets) + 1)
+        self.offset_counts += success.sum(axis=0)
+        self.total_produced += int(success.sum())
+        
+        # Candidates below this window were produced by earlier blocks and cannot repeat,
+        # so their bits are retired and only the overlap with the last window is kept.
+        self.tail = _move_bits(self.tail_lo, self.tail, window.lo, window.hi)
+        self.tail_lo = window.lo
+        already_produced = np.count_nonzero(self.tail)
+        self.tail[candidates[success] - window.lo] = True
+        self.unique_produced += int(np.count_nonzero(self.tail)) - already_produced
+
+        # Anything an earlier prime could also produce belongs to the head.
+        if self.head_limit is None:
+            self.head_lo = window.lo
+            self.head_limit = 2 * int(primes[0]) + max(self.offsets)
+            self.head = np.zeros(max(self.head_limit - self.head_lo, 0), dtype=bool)
+        self.head |= _move_bits(self.tail_lo, self.tail, self.head_lo, self.head_limit)
+
+    def merge(self, other):
+        """
+        Appends the counts of the range that immediately follows this one.
+        """
+        if other.num_primes == 0:
+            return self
+        if self.num_primes == 0:
+            self.__dict__.update(other.__dict__)
+            return self
 
-    # Return a list of all prime numbers found.
-    return [i for i, is_p in enumerate(is_prime) if is_p]
+        self.num_primes += other.num_primes
+        self.exact_counts += other.exact_counts
+        self.offset_counts += other.offset_counts
+        self.total_produced += other.total_produced
+        # Primes produced on both sides of the boundary were counted once in each range.
+        overlap = _move_bits(self.tail_lo, self.tail, other.head_lo, other.head_limit) & other.head
+        self.unique_produced += other.unique_produced - int(np.count_nonzero(overlap))
 
-def analyze_prime_offsets(num_primes_to_check=1_000_000):
+        self.head |= _move_bits(other.head_lo, other.head, self.head_lo, self.head_limit)
+        tail_hi = max(self.tail_lo + self.tail.size, other.tail_lo + other.tail.size)
+        self.tail = (_move_bits(self.tail_lo, self.tail, other.tail_lo, tail_hi)
+                     | _move_bits(other.tail_lo, other.tail, other.tail_lo, tail_hi))
+        self.tail_lo = other.tail_lo
+        return self
+
+
+def _move_bits(lo, bits, new_lo, new_hi):
+    """
+    Returns the bits covering [lo, lo + bits.size) moved onto a fresh bitmap over
+    [new_lo, new_hi). Bits outside the new range are dropped.
+    """
+    moved = np.zeros(max(new_hi - new_lo, 0), dtype=bool)
+    start = max(lo, new_lo)
+    stop = min(lo + bits.size, new_hi)
+    if start < stop:
+        moved[start - new_lo:stop - new_lo] = bits[start - lo:stop - lo]
+    return moved
+
+
+def analyze_prime_offsets(num_primes_to_check=1_000_000, workers=1, cache_path=None, start=2,
+                          backend='sieve', checkpoint_path=None, metrics=None):
     """
     Tests the seven specific offsets on the first 'num_primes_to_check' primes.
     The offsets are defined by the formula 2p + k.
+    With workers > 1 the primes are split into shards processed in parallel.
+    'cache_path' names a prime cache file (see prime_cache.py) to read instead of sieving.
+    'start' begins the primes at the first prime >= start instead of 2, and 'backend'
+    selects how candidates are tested ('sieve' or 'miller-rabin', see primality.py).
+    'checkpoint_path' names a file the counts are saved to as the run progresses; a
+    later call resumes from it, or extends it to more primes.
+    'metrics' is a metrics.Metrics object that the time and memory of every stage are
+    recorded into.
     """
-    # Define the set of offsets to be tested.
-    offsets_k = {1, 3, -3, -5, 7, 9, -9}
-    
-    # The 1,000,000th prime is 15,485,863. We need to check candidates up to 2p + 9.
-    # The maximum value for p is 15,485,863, so the max candidate is 2 * 15,485,863 + 9 = 30,971,735.
-    # We will generate primes up to a safe upper bound to ensure all candidates are covered.
-    max_prime_needed = 31_000_000
-    
-    print(f"Generating primes up to {max_prime_needed:,}...")
-    start_time = time.time()
-    # Generate all primes up to the maximum needed value.
-    all_primes = generate_primes_up_to(max_prime_needed)
-    end_time = time.time()
-    print(f"Done. Time taken: {end_time - start_time:.2f} seconds.")
-
-    # Convert the list to a set for highly efficient O(1) lookups.
-    prime_set = set(all_primes)
-    
-    # Get the first one million primes to be used for the analysis.
-    primes_to_check = all_primes[:num_primes_to_check]
-    
-    # Initialize variables for the summary table.
-    total_primes_produced = 0
-    unique_primes_produced = set()
-    
-    # Initialize a dictionary to store the exact count of successful offsets.
-    exact_success_counts = {i: 0 for i in range(len(offsets_k) + 1)}
-    
-    # Initialize a new dictionary to store counts for each individual offset.
-    individual_offset_counts = {k: 0 for k in offsets_k}
-    
     print("\nAnalyzing prime offsets...")
     start_time = time.time()
     
-    # Iterate through the first one million primes.
-    for p in primes_to_check:
-        successful_offsets_count = 0
-        produced_primes_for_p = set()
-        
-        # Check each of the seven offsets for the current prime p.
-        for k in offsets_k:
-            candidate = 2 * p + k
-            # Check if the candidate is a positive number and is in our prime set.
-            if candidate > 1 and candidate in prime_set:
-                successful_offsets_count += 1
-                produced_primes_for_p.add(candidate)
-                # Increment the count for this specific individual offset.
-                individual_offset_counts[k] += 1
-        
-        # Increment the counter for the number of successful offsets found for this prime.
-        exact_success_counts[successful_offsets_count] += 1
-        
-        # Add to the total and unique counts for the summary table.
-        total_primes_produced += len(produced_primes_for_p)
-        unique_primes_produced.update(produced_primes_for_p)
+    # Stream the first one million primes in cache-sized blocks. Each block comes with
+    # a sieved window covering all of its 2p + k candidates, so memory stays constant.
+    with collecting(metrics):
+        counts = run_sharded(OffsetCounts, num_primes_to_check, workers, cache_path, start, backend,
+                             checkpoint_path=checkpoint_path)
 
     end_time = time.time()
     print(f"Analysis complete. Time taken: {end_time - start_time:.2f} seconds.")
 
+    return results_from_counts(counts)
+
+def results_from_counts(counts):
+    """
+    Builds the result tables saved by save_to_csv from merged OffsetCounts.
+    """
+    offsets_k = counts.offsets
+    num_primes_to_check = counts.num_primes
+    total_primes_produced = counts.total_produced
+    unique_primes_produced = counts.unique_produced
+
+    # Convert the counters into the dictionaries used by the result tables.
+    exact_success_counts = {i: int(count) for i, count in enumerate(counts.exact_counts)}
+    individual_offset_counts = {k: int(count) for k, count in zip(offsets_k, counts.offset_counts)}
+
     # Calculate the cumulative success counts for the third table.
     cumulative_success_counts = {}
     total_sum = 0
@@ -111,7 +169,7 @@ def analyze_prime_offsets(num_primes_to_check=1_000_000):
         'Summary': {
             'Total primes considered': num_primes_to_check,
             'Total primes produced by offsets': total_primes_produced,
-            'Unique primes produced by offsets': len(unique_primes_produced)
+            'Unique primes produced by offsets': unique_primes_produced
         },
         'Exact success count distribution': exact_success_counts,
         'Cumulative success count distribution': cumulative_success_counts,
@@ -169,8 +227,8 @@ def save_to_csv(data, filename):
         print(f"An error occurred while writing the file: {e}")
 
 if __name__ == "__main__":
-    # Run the main analysis function.
-    results = analyze_prime_offsets()
+    # Run the main analysis function on every available core.
+    results = analyze_prime_offsets(workers=os.cpu_count())
     
     print("\n" + "="*50)
     
@@ -2,97 +2,76 @@ import csv
 import time
 import os
 
-def generate_primes_up_to(n):
+from metrics import collecting
+from offsets import SEVEN_SISTERS
+from parallel import run_sharded
+from residue_classes import ResidueCounts, coprime_classes
+
+class FilteredCounts(ResidueCounts):
     """
-    Generates a list of primes up to a given number n using the Sieve of Eratosthenes.
-    This list is used for efficient lookup during the analysis.
+    Mergeable counters behind analyze_prime_offsets_with_filtering, for one
+    contiguous range of primes: the residue classes of p mod 10, with the
+    candidates that are multiples of 3 and 5 (see residue_classes.py).
+    Counts for separate ranges are added with merge().
     """
-    # Create a boolean list where is_prime[i] is True if i is potentially prime.
-    is_prime = [True] * (n + 1)
-    is_prime[0] = is_prime[1] = False
-    
-    # Iterate from 2 up to the square root of n.
-    for i in range(2, int(n**0.5) + 1):
-        if is_prime[i]:
-            # Mark all multiples of i as not prime.
-            for multiple in range(i * i, n + 1, i):
-                is_prime[multiple] = False
-                
-    # Return a list of all prime numbers found.
-    return [i for i, is_p in enumerate(is_prime) if is_p]
 
-def analyze_prime_offsets_with_filtering(num_primes_to_check=1_000_000):
+    def __init__(self, offsets=SEVEN_SISTERS):
+        super().__init__(offsets, moduli=(10,), divisors=(3, 5))
+
+
+def analyze_prime_offsets_with_filtering(num_primes_to_check=1_000_000, workers=1, cache_path=None, start=2,
+                                         backend='sieve', checkpoint_path=None, metrics=None):
     """
     Tests the seven specific offsets on the first 'num_primes_to_check' primes,
     grouping the analysis by the ending digit of the prime and filtering out
     multiples of 3 and 5.
+    With workers > 1 the primes are split into shards processed in parallel.
+    'cache_path' names a prime cache file (see prime_cache.py) to read instead of sieving.
+    'start' begins the primes at the first prime >= start instead of 2, and 'backend'
+    selects how candidates are tested ('sieve' or 'miller-rabin', see primality.py).
+    'checkpoint_path' names a file the counts are saved to as the run progresses; a
+    later call resumes from it, or extends it to more primes.
+    'metrics' is a metrics.Metrics object that the time and memory of every stage are
+    recorded into.
     """
-    # Define the set of offsets to be tested.
-    offsets_k = {1, 3, -3, -5, 7, 9, -9}
+    print("\nAnalyzing prime offsets with filtering...")
+    start_time = time.time()
     
-    # The 1,000,000th prime is 15,485,863. The max candidate is 2*15485863 + 9 = 30971735.
-    max_prime_needed = 31_000_000
+    # Stream the first one million primes in cache-sized blocks. Each block comes with
+    # a sieved window covering all of its 2p + k candidates, so memory stays constant.
+    with collecting(metrics):
+        filtered_counts = run_sharded(FilteredCounts, num_primes_to_check, workers, cache_path, start, backend,
+                                      checkpoint_path=checkpoint_path)
     
-    print(f"Generating primes up to {max_prime_needed:,}...")
-    start_time = time.time()
-    all_primes = generate_primes_up_to(max_prime_needed)
     end_time = time.time()
-    print(f"Done. Time taken: {end_time - start_time:.2f} seconds.")
+    print(f"Analysis complete. Time taken: {end_time - start_time:.2f} seconds.")
 
-    # Convert the list to a set for highly efficient O(1) lookups.
-    prime_set = set(all_primes)
-    
-    # Get the first one million primes to be used for the analysis.
-    primes_to_check = all_primes[:num_primes_to_check]
-    
-    # Initialize a nested dictionary to store results for each ending digit and offset.
-    # New keys for filtering: 'multiples_of_3', 'multiples_of_5', 'not_multiples_of_3_or_5'
-    results = {
-        1: {k: {'total': 0, 'successful': 0, 'composites': 0, 'multiples_of_3': 0, 'multiples_of_5': 0, 'not_multiples_of_3_or_5': 0} for k in offsets_k},
-        3: {k: {'total': 0, 'successful': 0, 'composites': 0, 'multiples_of_3': 0, 'multiples_of_5': 0, 'not_multiples_of_3_or_5': 0} for k in offsets_k},
-        7: {k: {'total': 0, 'successful': 0, 'composites': 0, 'multiples_of_3': 0, 'multiples_of_5': 0, 'not_multiples_of_3_or_5': 0} for k in offsets_k},
-        9: {k: {'total': 0, 'successful': 0, 'composites': 0, 'multiples_of_3': 0, 'multiples_of_5': 0, 'not_multiples_of_3_or_5': 0} for k in offsets_k}
-    }
+    return results_from_counts(filtered_counts)
 
-    print("\nAnalyzing prime offsets with filtering...")
-    start_time = time.time()
-    
-    for p in primes_to_check:
-        # We only consider primes ending in 1, 3, 7, or 9.
-        # Primes 2 and 5 are not included in this analysis.
-        if p == 2 or p == 5:
-            continue
-            
-        ending_digit = p % 10
-        
-        # We check each offset for the prime p and increment the correct counts.
-        for k in offsets_k:
-            candidate = 2 * p + k
-            
-            # Update the total count for this specific prime ending and offset.
-            results[ending_digit][k]['total'] += 1
-            
-            # Check for divisibility by 3 and 5
-            is_multiple_of_3 = (candidate % 3 == 0) and (candidate != 3)
-            is_multiple_of_5 = (candidate % 5 == 0) and (candidate != 5)
+def results_from_counts(filtered_counts):
+    """
+    Builds the nested result dictionary saved by save_to_csv from merged FilteredCounts.
+    """
+    offsets_k = filtered_counts.offsets
+    class_counts = filtered_counts.class_counts(10)
+    class_counts['not_multiples_of_3_or_5'] = class_counts.pop('not_multiples')
 
-            if is_multiple_of_3:
-                results[ending_digit][k]['multiples_of_3'] += 1
-            if is_multiple_of_5:
-                results[ending_digit][k]['multiples_of_5'] += 1
+    # Initialize a nested dictionary to store results for each ending digit and offset.
+    # New keys for filtering: 'multiples_of_3', 'multiples_of_5', 'not_multiples_of_3_or_5'
+    # We only consider primes ending in 1, 3, 7, or 9, the digits coprime to 10.
+    results = {digit: {k: {'total': 0, 'successful': 0, 'composites': 0, 'multiples_of_3': 0, 'multiples_of_5': 0,
+                           'not_multiples_of_3_or_5': 0} for k in offsets_k}
+               for digit in coprime_classes(10)}
 
-            # If the candidate is not a multiple of 3 or 5, check for primality.
-            if not is_multiple_of_3 and not is_multiple_of_5:
-                results[ending_digit][k]['not_multiples_of_3_or_5'] += 1
-                
-                # Check if the candidate is prime and update the successful/composite counts.
-                if candidate > 1 and candidate in prime_set:
-                    results[ending_digit][k]['successful'] += 1
-                else:
-                    results[ending_digit][k]['composites'] += 1
-    
-    end_time = time.time()
-    print(f"Analysis complete. Time taken: {end_time - start_time:.2f} seconds.")
+    # Fill in the nested dictionary from the counters.
+    # Only candidates that are not multiples of 3 or 5 count towards the success
+    # rate, and every prime candidate is one of them.
+    for ending_digit, offset_data in results.items():
+        for j, k in enumerate(offsets_k):
+            offset_data[k]['total'] = int(class_counts['total'][ending_digit])
+            for key in ('successful', 'multiples_of_3', 'multiples_of_5', 'not_multiples_of_3_or_5'):
+                offset_data[k][key] = int(class_counts[key][ending_digit, j])
+            offset_data[k]['composites'] = offset_data[k]['not_multiples_of_3_or_5'] - offset_data[k]['successful']
 
     # Calculate success rates for each entry based on the filtered data.
     for ending_digit, offset_data in results.items():
@@ -153,7 +132,7 @@ def save_to_csv(data, filename):
         print(f"An error occurred while writing the file: {e}")
 
 if __name__ == "__main__":
-    results = analyze_prime_offsets_with_filtering()
+    results = analyze_prime_offsets_with_filtering(workers=os.cpu_count())
     
     print("\n" + "="*50)
     
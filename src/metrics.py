@@ -0,0 +1,236 @@
+"""
+Per-stage timing and memory instrumentation for the analyses.
+
+Code marks its stages with 'with stage(name, items):'. While a Metrics object
+is being collected into (see collecting()), every stage adds its wall time,
+CPU time, call count and number of items to it; otherwise stage() returns a
+shared do-nothing context manager, so instrumentation costs next to nothing
+when it is off. Stages may nest, and their times include the nested stages.
+
+Collected metrics can be merged across worker processes and exported as
+JSON lines or in the Prometheus text format.
+"""
+import contextlib
+import json
+import sys
+import time
+import tracemalloc
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows; peak RSS is then reported as 0.
+    resource = None
+
+# The metrics currently collected into, or None when instrumentation is off.
+_active = None
+
+
+class _NullStage:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+def _peak_rss_bytes():
+    if resource is None:
+        return 0
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS.
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak if sys.platform == 'darwin' else peak * 1024
+
+
+class StageStats:
+    """
+    Totals for one stage: wall and CPU seconds, calls, items and peak RSS.
+    """
+
+    def __init__(self):
+        self.wall_seconds = 0.0
+        self.cpu_seconds = 0.0
+        self.calls = 0
+        self.items = 0
+        self.peak_rss_bytes = 0
+
+    def merge(self, other):
+        self.wall_seconds += other.wall_seconds
+        self.cpu_seconds += other.cpu_seconds
+        self.calls += other.calls
+        self.items += other.items
+        self.peak_rss_bytes = max(self.peak_rss_bytes, other.peak_rss_bytes)
+
+    def as_dict(self):
+        return {
+            'wall_seconds': self.wall_seconds,
+            'cpu_seconds': self.cpu_seconds,
+            'calls': self.calls,
+            'items': self.items,
+            'items_per_second': self.items / self.wall_seconds if self.wall_seconds else None,
+            'peak_rss_bytes': self.peak_rss_bytes,
+        }
+
+
+class _Stage:
+    def __init__(self, stats, items):
+        self.stats = stats
+        self.items = items
+
+    def __enter__(self):
+        self.wall = time.perf_counter()
+        self.cpu = time.process_time()
+        return self
+
+    def __exit__(self, *exc_info):
+        stats = self.stats
+        stats.wall_seconds += time.perf_counter() - self.wall
+        stats.cpu_seconds += time.process_time() - self.cpu
+        stats.calls += 1
+        stats.items += self.items
+        stats.peak_rss_bytes = max(stats.peak_rss_bytes, _peak_rss_bytes())
+        return False
+
+
+class Metrics:
+    """
+    Per-stage statistics of one run. With trace_memory=True the peak memory
+    allocated while collecting is also traced with tracemalloc, which slows
+    the run down noticeably.
+    """
+
+    def __init__(self, trace_memory=False):
+        self.trace_memory = trace_memory
+        self.stages = {}
+        self.peak_traced_bytes = 0
+
+    def stage(self, name, items=0):
+        """
+        Returns a context manager adding one call of the stage 'name' with 'items' items.
+        """
+        stats = self.stages.get(name)
+        if stats is None:
+            stats = self.stages[name] = StageStats()
+        return _Stage(stats, items)
+
+    def merge(self, other):
+        """
+        Adds the statistics of another Metrics, e.g. from a worker process.
+        """
+        for name, stats in other.stages.items():
+            self.stages.setdefault(name, StageStats()).merge(stats)
+        self.peak_traced_bytes = max(self.peak_traced_bytes, other.peak_traced_bytes)
+        return self
+
+    def as_dict(self):
+        return {
+            'stages': {name: stats.as_dict() for name, stats in self.stages.items()},
+            'peak_traced_bytes': self.peak_traced_bytes if self.trace_memory else None,
+        }
+
+    def summary(self):
+        """
+        Returns a printable table of the stages.
+        """
+        lines = [f"{'Stage':<16} {'Wall (s)':>10} {'CPU (s)':>10} {'Calls':>8} {'Items':>14} {'Items/s':>14}"]
+        for name, stats in self.stages.items():
+            rate = stats.items / stats.wall_seconds if stats.wall_seconds else 0
+            lines.append(f"{name:<16} {stats.wall_seconds:>10.3f} {stats.cpu_seconds:>10.3f} {stats.calls:>8,} "
+                         f"{stats.items:>14,} {rate:>14,.0f}")
+        if self.trace_memory:
+            lines.append(f"Peak traced memory: {self.peak_traced_bytes / 2**20:.1f} MiB")
+        return '\n'.join(lines)
+
+    def write_jsonl(self, path, **labels):
+        """
+        Appends one JSON line per stage to 'path', each tagged with 'labels'
+        and the time of writing.
+        """
+        timestamp = time.time()
+        with open(path, 'a') as f:
+            for name, stats in self.stages.items():
+                record = dict(labels, timestamp=timestamp, stage=name, **stats.as_dict())
+                f.write(json.dumps(record) + '\n')
+
+    def prometheus_text(self, prefix='seven_sisters'):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        metrics = [
+            ('stage_wall_seconds', 'counter', 'Wall time spent in each stage.', 'wall_seconds'),
+            ('stage_cpu_seconds', 'counter', 'CPU time spent in each stage.', 'cpu_seconds'),
+            ('stage_calls', 'counter', 'Number of times each stage ran.', 'calls'),
+            ('stage_items', 'counter', 'Items processed by each stage.', 'items'),
+            ('stage_peak_rss_bytes', 'gauge', 'Peak resident set size seen by each stage.', 'peak_rss_bytes'),
+        ]
+        lines = []
+        for metric, kind, description, field in metrics:
+            lines.append(f"# HELP {prefix}_{metric} {description}")
+            lines.append(f"# TYPE {prefix}_{metric} {kind}")
+            for name, stats in self.stages.items():
+                lines.append(f'{prefix}_{metric}{{stage="{name}"}} {getattr(stats, field)}')
+        if self.trace_memory:
+            lines.append(f"# HELP {prefix}_peak_traced_bytes Peak memory traced by tracemalloc.")
+            lines.append(f"# TYPE {prefix}_peak_traced_bytes gauge")
+            lines.append(f"{prefix}_peak_traced_bytes {self.peak_traced_bytes}")
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path, prefix='seven_sisters'):
+        """
+        Writes the Prometheus text format to 'path', e.g. for the node exporter's textfile collector.
+        """
+        with open(path, 'w') as f:
+            f.write(self.prometheus_text(prefix))
+
+    def write(self, path, **labels):
+        """
+        Writes the metrics to 'path': Prometheus text for a '.prom' file, JSON lines otherwise.
+        """
+        if path.endswith('.prom'):
+            self.write_prometheus(path)
+        else:
+            self.write_jsonl(path, **labels)
+
+
+def active():
+    """
+    Returns the Metrics currently collected into, or None.
+    """
+    return _active
+
+
+def stage(name, items=0):
+    """
+    Times one run of the stage 'name' in the active Metrics, if any.
+    """
+    if _active is None:
+        return _NULL_STAGE
+    return _active.stage(name, items)
+
+
+@contextlib.contextmanager
+def collecting(metrics):
+    """
+    Makes 'metrics' the active Metrics inside the with block. Does nothing if metrics is None.
+    """
+    global _active
+    if metrics is None:
+        yield None
+        return
+
+    previous = _active
+    started_tracing = metrics.trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+    _active = metrics
+    try:
+        yield metrics
+    finally:
+        _active = previous
+        if metrics.trace_memory and tracemalloc.is_tracing():
+            metrics.peak_traced_bytes = max(metrics.peak_traced_bytes, tracemalloc.get_traced_memory()[1])
+            if started_tracing:
+                tracemalloc.stop()
@@ -1,53 +1,20 @@
 import time
-import math
 import csv
+import os
 from collections import defaultdict
 
-def generate_primes_up_to(n):
-    """
-    Generates all prime numbers up to a given number n using the Sieve of Eratosthenes.
-    Returns a list of primes.
-    """
-    sieve = [True] * (n + 1)
-    sieve[0] = sieve[1] = False
-    for i in range(2, int(math.sqrt(n)) + 1):
-        if sieve[i]:
-            for multiple in range(i * i, n + 1, i):
-                sieve[multiple] = False
-    
-    primes = []
-    for i in range(2, n + 1):
-        if sieve[i]:
-            primes.append(i)
-    return primes
-
-def get_first_n_primes(n):
-    """
-    Generates the first n prime numbers.
-    This is more efficient than generating all primes up to a number
-    and then slicing the list.
-    """
-    primes = []
-    # Start with a reasonable upper bound based on the Prime Number Theorem.
-    # The nth prime is approximately n * ln(n)
-    limit = int(n * (math.log(n) + math.log(math.log(n))))
-    sieve = [True] * (limit + 1)
-    sieve[0] = sieve[1] = False
-    
-    for i in range(2, limit + 1):
-        if sieve[i]:
-            primes.append(i)
-            if len(primes) >= n:
-                break
-            for multiple in range(i*i, limit + 1, i):
-                sieve[multiple] = False
-                
-    return primes[:n]
+import numpy as np
+
+from metrics import collecting, stage
+from offsets import SEVEN_SISTERS, offset_label
+from parallel import run_sharded
 
 def get_smallest_prime_factor(n, prime_list):
     """
     Finds the smallest prime factor of a composite number using the pre-generated
     list of primes for efficient trial division.
+    The analysis itself looks factors up in the sieve's smallest-prime-factor
+    table; this function is kept as the reference for single numbers.
     """
     for p in prime_list:
         if p * p > n:
@@ -59,82 +26,133 @@ def get_smallest_prime_factor(n, prime_list):
     # For this script's purpose, we can assume it's prime if not found.
     return None
 
-# --- Main script execution ---
-
 # 1. Define the number of primes to test.
 NUM_PRIMES_TO_CHECK = 1_000_000
 
 # 2. Define the offsets to test.
-OFFSETS = [1, 3, -3, -5, 7, 9, -9]
-OFFSET_LABELS = {1: "2p+1", 3: "2p+3", -3: "2p-3", -5: "2p-5", 7: "2p+7", 9: "2p+9", -9: "2p-9"}
-
-print(f"Generating the first {NUM_PRIMES_TO_CHECK:,} primes...")
-start_time = time.time()
-primes_to_check = get_first_n_primes(NUM_PRIMES_TO_CHECK)
-end_time = time.time()
-print(f"Done. Time taken: {end_time - start_time:.2f} seconds.")
-
-# Find the maximum possible candidate value to create an efficient prime set for lookup
-max_prime_to_check = primes_to_check[-1]
-max_candidate = 2 * max_prime_to_check + max(OFFSETS)
-print(f"Largest prime considered: {max_prime_to_check:,}")
-print(f"Generating primes up to {max_candidate:,} for efficient lookup...")
-start_time = time.time()
-all_primes_for_lookup = generate_primes_up_to(max_candidate)
-prime_set = set(all_primes_for_lookup)
-end_time = time.time()
-print(f"Done. Time taken: {end_time - start_time:.2f} seconds.")
-print("-" * 50)
+OFFSETS = list(SEVEN_SISTERS)
+OFFSET_LABELS = {k: offset_label(k) for k in OFFSETS}
 
-# 3. Analyze each prime and its offset results.
-smallest_prime_factor_counts = defaultdict(int)
-prime_success_counts = defaultdict(int)
-total_tests = 0
-
-print("Analyzing prime offsets...")
-start_time = time.time()
-for p in primes_to_check:
-    for offset in OFFSETS:
-        total_tests += 1
-        q = 2 * p + offset
+class FailureCounts:
+    """
+    Mergeable counters for the failure analysis, for one contiguous range of primes.
+    Counts for separate ranges are added with merge().
+    """
+
+    def __init__(self, offsets=OFFSETS):
+        self.offsets = offsets
+        self.total_tests = 0
+        self.prime_success_counts = defaultdict(int)
+        self.smallest_prime_factor_counts = defaultdict(int)
+        self.max_prime = None
+
+    def update(self, block):
+        """
+        Adds one OffsetBlock of primes and the primality of their candidates.
+        """
+        primes, window, candidates, success = block.primes, block.window, block.candidates, block.success
+        self.total_tests += candidates.size
+        for offset, count in zip(self.offsets, success.sum(axis=0).tolist()):
+            self.prime_success_counts[offset] += count
         
-        # We need to make sure the candidate is within our prime set range
-        if q > max_candidate or q <= 1:
-            continue
-            
-        if q in prime_set:
-            prime_success_counts[offset] += 1
-        else:
-            factor = get_smallest_prime_factor(q, all_primes_for_lookup)
-            if factor:
-                smallest_prime_factor_counts[factor] += 1
-end_time = time.time()
-print(f"Analysis complete. Time taken: {end_time - start_time:.2f} seconds.")
-print("-" * 50)
+        # Candidates below 2 are neither prime nor composite, so they are not factored.
+        # Every other failure is looked up in the window's smallest-prime-factor table
+        # and the factors are histogrammed in one pass; with np.unique rather than a
+        # bincount, as the factors reach the square root of the candidates.
+        failed = candidates[~success & (candidates > 1)]
+        with stage('factorization', failed.size):
+            factors, factor_counts = np.unique(window.smallest_prime_factor_array(failed), return_counts=True)
+        for factor, count in zip(factors.tolist(), factor_counts.tolist()):
+            self.smallest_prime_factor_counts[factor] += count
+        self.max_prime = int(primes[-1])
+
+    def merge(self, other):
+        """
+        Adds the counts of another range.
+        """
+        self.total_tests += other.total_tests
+        for offset, count in other.prime_success_counts.items():
+            self.prime_success_counts[offset] += count
+        for factor, count in other.smallest_prime_factor_counts.items():
+            self.smallest_prime_factor_counts[factor] += count
+        if other.max_prime is not None:
+            self.max_prime = max(self.max_prime or 0, other.max_prime)
+        return self
+
+# 3. Analyze each prime and its offset results.
+def analyze_failed_offsets(num_primes_to_check=NUM_PRIMES_TO_CHECK, workers=1, cache_path=None, start=2,
+                           backend='sieve', checkpoint_path=None, metrics=None):
+    """
+    Tests the offsets on the first 'num_primes_to_check' primes and records the
+    smallest prime factor of every candidate that is not prime.
+    With workers > 1 the primes are split into shards processed in parallel.
+    'cache_path' names a prime cache file (see prime_cache.py) to read instead of sieving.
+    'start' begins the primes at the first prime >= start instead of 2, and 'backend'
+    selects how candidates are tested ('sieve' or 'miller-rabin', see primality.py).
+    'checkpoint_path' names a file the counts are saved to as the run progresses; a
+    later call resumes from it, or extends it to more primes.
+    'metrics' is a metrics.Metrics object that the time and memory of every stage are
+    recorded into.
+    """
+    print(f"Analyzing prime offsets for the first {num_primes_to_check:,} primes...")
+    start_time = time.time()
+    # Stream the primes in cache-sized blocks. Each block comes with a sieved window
+    # covering all of its candidates, which also provides their smallest prime factors.
+    with collecting(metrics):
+        counts = run_sharded(FailureCounts, num_primes_to_check, workers, cache_path, start, backend,
+                             checkpoint_path=checkpoint_path)
+    print(f"Largest prime considered: {counts.max_prime:,}")
+    end_time = time.time()
+    print(f"Analysis complete. Time taken: {end_time - start_time:.2f} seconds.")
+    print("-" * 50)
+
+    return results_from_counts(counts)
+
+def results_from_counts(counts):
+    """
+    Builds the result dictionary saved by save_to_csv from merged FailureCounts.
+    """
+    return {
+        'total_tests': counts.total_tests,
+        'prime_success_counts': dict(counts.prime_success_counts),
+        'smallest_prime_factor_counts': dict(counts.smallest_prime_factor_counts),
+    }
 
 # 4. Write the final report to a CSV file.
-file_name = input("Please enter a name for the CSV file (e.g., 'analysis_results.csv'): ")
-if not file_name.endswith(".csv"):
-    file_name += ".csv"
-print(f"Writing results to '{file_name}'...")
-
-with open(file_name, 'w', newline='') as csvfile:
-    writer = csv.writer(csvfile)
-    
-    writer.writerow(["Analysis of Smallest Prime Factors of Failed Tests", "Value"])
-    writer.writerow(["Total tests performed", total_tests])
-    writer.writerow(["Total successful prime generations", sum(prime_success_counts.values())])
-    writer.writerow([])
-    
-    writer.writerow(["Smallest Prime Factors Causing Failure", "Count", "Percentage of Failures"])
-    total_failures = total_tests - sum(prime_success_counts.values())
-    
-    # Sort the factors to present the data clearly
-    sorted_factors = sorted(smallest_prime_factor_counts.keys())
-    
-    for factor in sorted_factors:
-        count = smallest_prime_factor_counts[factor]
-        percentage = (count / total_failures) * 100 if total_failures > 0 else 0
-        writer.writerow([factor, count, f"{percentage:.2f}%"])
-    
-print("Analysis CSV file has been created successfully.")
+def save_to_csv(data, filename):
+    """
+    Saves the smallest prime factor analysis to a CSV file.
+    """
+    print(f"Writing results to '{filename}'...")
+    total_tests = data['total_tests']
+    prime_success_counts = data['prime_success_counts']
+    smallest_prime_factor_counts = data['smallest_prime_factor_counts']
+
+    with open(filename, 'w', newline='') as csvfile:
+        writer = csv.writer(csvfile)
+        
+        writer.writerow(["Analysis of Smallest Prime Factors of Failed Tests", "Value"])
+        writer.writerow(["Total tests performed", total_tests])
+        writer.writerow(["Total successful prime generations", sum(prime_success_counts.values())])
+        writer.writerow([])
+        
+        writer.writerow(["Smallest Prime Factors Causing Failure", "Count", "Percentage of Failures"])
+        total_failures = total_tests - sum(prime_success_counts.values())
+        
+        # Sort the factors to present the data clearly
+        sorted_factors = sorted(smallest_prime_factor_counts.keys())
+        
+        for factor in sorted_factors:
+            count = smallest_prime_factor_counts[factor]
+            percentage = (count / total_failures) * 100 if total_failures > 0 else 0
+            writer.writerow([factor, count, f"{percentage:.2f}%"])
+        
+    print("Analysis CSV file has been created successfully.")
+
+if __name__ == "__main__":
+    results = analyze_failed_offsets(workers=os.cpu_count())
+
+    file_name = input("Please enter a name for the CSV file (e.g., 'analysis_results.csv'): ")
+    if not file_name.endswith(".csv"):
+        file_name += ".csv"
+    save_to_csv(results, file_name)
@@ -0,0 +1,79 @@
+"""
+The Seven Sisters offsets and vectorized evaluation of their 2p + k candidates.
+"""
+import numpy as np
+
+from metrics import stage
+
+# The seven offsets k tested in the note, in ascending order.
+SEVEN_SISTERS = (-9, -5, -3, 1, 3, 7, 9)
+
+
+def offset_label(k, multiplier=2):
+    """
+    Returns the display label for an offset, e.g. '2p+7' or '2p-5'.
+    """
+    return f"{multiplier}p{k:+d}"
+
+
+def candidate_matrix(primes, offsets, multiplier=2):
+    """
+    Computes every candidate multiplier * p + k in one broadcast.
+    Returns an int64 array with one row per prime and one column per offset.
+    """
+    primes = np.asarray(primes, dtype=np.int64)
+    return multiplier * primes[:, None] + np.asarray(offsets, dtype=np.int64)[None, :]
+
+
+def success_matrix(candidates, window):
+    """
+    Gathers the primality of every candidate from a sieve or sieve window.
+    Returns a boolean array with the same shape as 'candidates'.
+    """
+    return window.is_prime_array(candidates)
+
+
+def count_by_class(classes, mask, num_classes):
+    """
+    Counts the True entries of a (primes x offsets) mask, grouped by the class
+    id of each prime. Returns an int64 array of shape (num_classes, offsets).
+    """
+    num_offsets = mask.shape[1]
+    ids = np.asarray(classes, dtype=np.int64)[:, None] * num_offsets + np.arange(num_offsets)
+    return np.bincount(ids[mask], minlength=num_classes * num_offsets).reshape(num_classes, num_offsets)
+
+
+def residue_divisibility(modulus, divisor, offsets, multiplier=2):
+    """
+    For every residue r of p modulo 'modulus', tells whether multiplier * p + k
+    is divisible by 'divisor', which must divide the modulus.
+    Returns a boolean array of shape (modulus, offsets).
+    """
+    if modulus % divisor:
+        raise ValueError(f"{divisor} does not divide the modulus {modulus}")
+    residues = np.arange(modulus, dtype=np.int64)[:, None]
+    return (multiplier * residues + np.asarray(offsets, dtype=np.int64)[None, :]) % divisor == 0
+
+
+class OffsetBlock:
+    """
+    One block of primes together with its candidates and their primality.
+    Computed once per block and shared by every set of counts fed from it.
+    """
+
+    def __init__(self, primes, window, offsets=SEVEN_SISTERS, multiplier=2):
+        self.primes = primes
+        self.window = window
+        self.offsets = offsets
+        self.multiplier = multiplier
+        # Evaluate all offsets for the whole block at once: one row per prime.
+        with stage('candidates', primes.size * len(offsets)):
+            self.candidates = candidate_matrix(primes, offsets, multiplier)
+        with stage('primality', self.candidates.size):
+            self.success = success_matrix(self.candidates, window)
+
+    def rows(self, mask):
+        """
+        Returns (primes, candidates, success) restricted to the rows where mask is True.
+        """
+        return self.primes[mask], self.candidates[mask], self.success[mask]
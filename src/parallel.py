@@ -0,0 +1,296 @@
+"""
+Sharded, multi-process execution of the streaming analyses.
+
+The prime range is split into shards by value. Each worker sieves its own
+shards segment by segment and returns a mergeable counts object; the counts
+are merged in shard order, so the result is identical to a serial run. The
+sieving primes are shared with the workers through shared memory instead of
+being pickled into every task, and a prime cache file, if given, is
+memory-mapped by every worker so they share its page cache. The candidates
+can instead be tested by another primality backend (see primality.py).
+"""
+import math
+import multiprocessing
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from checkpoint import Checkpoint, checkpoint_key
+from metrics import Metrics, active, collecting, stage
+from offsets import OffsetBlock
+from prime_cache import PrimeCache
+from primality import get_backend
+from prime_count import prime_count
+from sieve import PrimeSieve, iter_prime_blocks, nth_prime
+
+# Shards per worker, so that a slow shard does not leave the other cores idle.
+SHARDS_PER_WORKER = 4
+
+# Ranges ending below this are sized exactly with prime counting, which takes
+# under a second there; beyond, counting would take minutes and they are estimated.
+EXACT_SPAN_LIMIT = 10 ** 10
+
+# An estimated range is shortened by this many times the square root of
+# num_primes * ln(start), several times the deviation of the prime count.
+SPAN_MARGIN = 2
+
+# Sieving primes attached from shared memory, the optional prime cache and
+# the candidate backend inside each worker process.
+_shared_memory = None
+_base_primes = None
+_source = None
+_backend = None
+
+
+def _open_cache(cache_path):
+    return PrimeCache(cache_path) if cache_path is not None else None
+
+
+def _attach_base_primes(name, size, cache_path=None, backend='sieve'):
+    """
+    Pool initializer: maps the shared sieving primes and the prime cache into
+    the worker process and selects the candidate backend.
+    """
+    global _shared_memory, _base_primes, _source, _backend
+    _shared_memory = shared_memory.SharedMemory(name=name)
+    _base_primes = np.ndarray((size,), dtype=np.int64, buffer=_shared_memory.buf)
+    _source = _open_cache(cache_path)
+    _backend = get_backend(backend)
+
+
+def _run_shard(make_counts, lo, hi, num_primes=None, multiplier=2, collect_metrics=False):
+    """
+    Feeds the primes in [lo, hi) into a fresh counts object, or only the first
+    'num_primes' of them; hi may be None when num_primes is given. Returns the
+    counts, the number of primes, the last prime processed and the shard's
+    Metrics (None unless collect_metrics is True).
+    """
+    counts = make_counts()
+    count = 0
+    last_prime = None
+    shard_metrics = Metrics() if collect_metrics else None
+    with collecting(shard_metrics):
+        for primes, window in iter_prime_blocks(num_primes, min(counts.offsets), max(counts.offsets), multiplier,
+                                                start=lo, stop=hi, base_primes=_base_primes, source=_source,
+                                                backend=_backend):
+            block = OffsetBlock(primes, window, counts.offsets, multiplier)
+            with stage('counting', primes.size):
+                counts.update(block)
+            count += primes.size
+            last_prime = int(primes[-1])
+    return counts, count, last_prime, shard_metrics
+
+
+def _run_task(task):
+    return _run_shard(*task)
+
+
+def _prime_density_integral(lo, hi, panels=16):
+    """
+    Returns the integral of dt / ln t over [lo, hi], by Simpson's rule in u = ln t.
+    """
+    a, b = math.log(lo), math.log(hi)
+    step = (b - a) / panels
+    total = 0.0
+    for i in range(panels + 1):
+        u = a + i * step
+        weight = 1 if i in (0, panels) else 4 if i % 2 else 2
+        # dt / ln t = e^u / u du.
+        total += weight * math.exp(u) / u
+    return total * step / 3
+
+
+def estimate_span(start, num_primes):
+    """
+    Estimates the width of the range from 'start' that holds 'num_primes'
+    primes: the w where the integral of dt / ln t over [start, start + w)
+    reaches num_primes. Beyond small ranges the actual count differs by about
+    the square root of num_primes.
+    """
+    lo = max(start, 3)
+    width = num_primes * math.log(lo + num_primes * math.log(lo + num_primes))
+    for _ in range(6):
+        hi = lo + width
+        width = max(width + (num_primes - _prime_density_integral(lo, hi)) * math.log(hi), width / 2)
+    return int(width) + 1
+
+
+def prime_span(start, num_primes):
+    """
+    Returns the width of the range from 'start' up to and including the
+    'num_primes'-th prime >= start. It is exact, by prime counting, while the
+    range stays below EXACT_SPAN_LIMIT, and estimated beyond (see estimate_span).
+    """
+    if start + estimate_span(start, num_primes) > EXACT_SPAN_LIMIT:
+        return estimate_span(start, num_primes)
+    return nth_prime(prime_count(start - 1) + num_primes) + 1 - start
+
+
+def split_range(lo, hi, num_shards):
+    """
+    Splits [lo, hi) into 'num_shards' ranges of equal width (fewer if it is narrow).
+    """
+    width = max(1, math.ceil((hi - lo) / num_shards))
+    return [(a, min(a + width, hi)) for a in range(lo, hi, width)]
+
+
+def plan_shards(num_primes, num_shards, start=2):
+    """
+    Splits the values from 'start' into equal shards holding together at most
+    'num_primes' primes. Returns (lo, hi) for every shard. Below
+    EXACT_SPAN_LIMIT they hold exactly 'num_primes' primes. Beyond, the range
+    is estimated short by a few times the expected deviation, so that it
+    almost surely holds fewer; the primes after the last shard are then left
+    to be counted out from its end. No shards are returned when that leaves none.
+    """
+    if start + estimate_span(start, num_primes) <= EXACT_SPAN_LIMIT:
+        return split_range(start, start + prime_span(start, num_primes), num_shards)
+    margin = math.ceil(SPAN_MARGIN * math.sqrt(num_primes * math.log(start)))
+    if num_primes <= margin:
+        return []
+    return split_range(start, start + estimate_span(start, num_primes - margin), num_shards)
+
+
+def run_sharded(make_counts, num_primes, workers=1, cache_path=None, start=2, backend='sieve', multiplier=2,
+                checkpoint_path=None, on_progress=None, stop=None):
+    """
+    Runs a streaming analysis over the first 'num_primes' primes from 'start',
+    or with a 'stop' and num_primes None over every prime in [start, stop).
+
+    'make_counts' creates an empty counts object with an 'offsets' attribute,
+    an update(block) method taking one OffsetBlock of primes, and a
+    merge(other) method that appends the counts of the following range.
+    The candidates are multiplier * p + k for every offset k.
+    With workers > 1 the range is processed in a pool of worker processes;
+    counts whose memory grows with the primes of a shard until it is merged
+    can cap them with a 'max_shard_primes' attribute.
+    'cache_path' names a prime cache to read windows from instead of sieving,
+    and 'backend' the primality backend for candidates outside it.
+
+    With a 'checkpoint_path' the counts are saved there periodically and at the
+    end. A later call resumes from the checkpoint, or extends a completed run
+    to a larger 'num_primes', by processing only the primes after the last one saved.
+
+    'on_progress', if given, is called with the counts in the main process
+    after every block (or merged shard), in range order and before the
+    checkpoint is saved; e.g. to write out and drop the finished part of the counts.
+
+    Stages are timed into the active Metrics, if any (see metrics.py); the
+    workers collect their own and send them back to be merged.
+    """
+    counts = make_counts()
+    done = 0
+    last_prime = None
+    checkpoint = None
+    if checkpoint_path is not None:
+        checkpoint = Checkpoint(checkpoint_path, checkpoint_key(counts, start, multiplier))
+        state = checkpoint.load()
+        if state is not None:
+            counts, done, last_prime = state
+            if num_primes is not None and done > num_primes:
+                raise ValueError(f"Checkpoint '{checkpoint_path}' already covers {done:,} primes, "
+                                 f"more than the {num_primes:,} requested")
+            print(f"Resuming from checkpoint: {done:,} primes done, last prime {last_prime:,}")
+
+    remaining = None if num_primes is None else num_primes - done
+    if last_prime is not None:
+        start = last_prime + 1
+    more = start < stop if num_primes is None else remaining > 0
+
+    if more and workers <= 1:
+        source = _open_cache(cache_path)
+        for primes, window in iter_prime_blocks(remaining, min(counts.offsets), max(counts.offsets), multiplier,
+                                                start=start, stop=stop, source=source,
+                                                backend=get_backend(backend)):
+            block = OffsetBlock(primes, window, counts.offsets, multiplier)
+            with stage('counting', primes.size):
+                counts.update(block)
+            done += primes.size
+            last_prime = int(primes[-1])
+            if on_progress is not None:
+                on_progress(counts)
+            if checkpoint is not None:
+                checkpoint.save(counts, done, last_prime)
+    elif more:
+        counts, done, last_prime = _run_pool(counts, done, last_prime, make_counts, remaining, workers,
+                                             cache_path, start, backend, multiplier, checkpoint, on_progress, stop)
+
+    if checkpoint is not None:
+        checkpoint.save(counts, done, last_prime, force=True)
+    return counts
+
+
+def _pool_results(pool, make_counts, shards, num_primes, start, multiplier, collect_metrics):
+    """
+    Yields the results of _run_shard for the first 'num_primes' primes from
+    'start', in order. The shards are run in the pool; where they were planned
+    from an estimate (see plan_shards), a shard that runs past the last prime
+    is run again up to it, and the primes left after the last shard are
+    counted out from its end in one more task. With num_primes None, every
+    prime of the shards is processed.
+    """
+    remaining = num_primes
+    tasks = [(make_counts, lo, hi, None, multiplier, collect_metrics) for lo, hi in shards]
+    # Shards come back in order, so the counts can be merged and checkpointed as they arrive.
+    for task, result in zip(tasks, pool.imap(_run_task, tasks)):
+        if remaining is None:
+            yield result
+            continue
+        if result[1] > remaining:
+            result = pool.apply(_run_shard, task[:3] + (remaining,) + task[4:])
+        yield result
+        remaining -= result[1]
+        if remaining == 0:
+            return
+    if remaining is None:
+        return
+    lo = shards[-1][1] if shards else start
+    yield pool.apply(_run_shard, (make_counts, lo, None, remaining, multiplier, collect_metrics))
+
+
+def _run_pool(counts, done, last_prime, make_counts, num_primes, workers, cache_path, start, backend, multiplier,
+              checkpoint, on_progress=None, stop=None):
+    """
+    Processes 'num_primes' primes from 'start' (or with num_primes None, the
+    primes in [start, stop)) in a pool of worker processes, merging every
+    shard into 'counts' in order. Returns the updated (counts, primes done, last prime).
+    """
+    with stage('planning'):
+        num_shards = workers * SHARDS_PER_WORKER
+        max_shard_primes = getattr(counts, 'max_shard_primes', None)
+        if max_shard_primes is not None:
+            expected = num_primes if num_primes is not None else _prime_density_integral(max(start, 3), stop)
+            num_shards = max(num_shards, math.ceil(expected / max_shard_primes))
+        if num_primes is None:
+            shards = split_range(start, stop, num_shards)
+        else:
+            shards = plan_shards(num_primes, num_shards, start)
+
+    # Every candidate stays below about multiplier * upper + max(k), so sieving primes up to its
+    # square root suffice; the workers sieve more of them if the range runs further.
+    upper = shards[-1][1] if shards else start + estimate_span(start, num_primes)
+    base_primes = PrimeSieve(math.isqrt(multiplier * upper + max(counts.offsets)) + 1).primes()
+
+    shared = shared_memory.SharedMemory(create=True, size=base_primes.nbytes)
+    try:
+        np.ndarray(base_primes.shape, dtype=np.int64, buffer=shared.buf)[:] = base_primes
+        with multiprocessing.Pool(workers, initializer=_attach_base_primes,
+                                  initargs=(shared.name, base_primes.size, cache_path, backend)) as pool:
+            run_metrics = active()
+            results = _pool_results(pool, make_counts, shards, num_primes, start, multiplier, run_metrics is not None)
+            for shard_counts, count, shard_last_prime, shard_metrics in results:
+                with stage('merge', count):
+                    counts.merge(shard_counts)
+                if shard_metrics is not None:
+                    run_metrics.merge(shard_metrics)
+                done += count
+                if shard_last_prime is not None:
+                    last_prime = shard_last_prime
+                if on_progress is not None:
+                    on_progress(counts)
+                if checkpoint is not None:
+                    checkpoint.save(counts, done, last_prime)
+    finally:
+        shared.close()
+        shared.unlink()
+    return counts, done, last_prime
@@ -0,0 +1,328 @@
+"""
+Hardy-Littlewood predictions of the offset success counts, for any bound in milliseconds.
+
+By the Hardy-Littlewood conjecture for the pair (p, 2p + k), the number of
+primes p <= x with 2p + k prime is about
+
+    S(k) * integral from 2 to x of dt / (log t * log(2t + k)),
+
+where the singular series S(k) is the product over all primes q of
+(1 - nu(q)/q) / (1 - 1/q)^2, nu(q) being the number of residues n mod q with
+n * (2n + k) = 0 (mod q). That is 2 at q = 2, q / (q - 1) for q dividing k,
+and (1 - 2/q) / (1 - 1/q)^2 otherwise, so S(k) = 2 * C2 * prod (q - 1)/(q - 2)
+over the odd primes q dividing k, with C2 the twin prime constant. This is the
+modular argument of the note made quantitative: k = -9 and k = 3 gain a factor
+2 from 3 | k, k = -5 a factor 4/3 from 5 | k and k = 7 a factor 6/5.
+
+The primes of every residue class r mod 30 coprime to 30 are equally common,
+and the expected successes of an offset are split evenly over the classes
+where 2r + k is coprime to 30, the rest having none. Summing the classes by
+the last digit of r gives the ending-digit breakdown, and the classes where
+2r + k is not a multiple of 3 or 5 give the filtered one. The integrals are
+evaluated by Gauss-Legendre quadrature in log t.
+
+    python src/prediction.py --bound 1000000000000
+    python src/prediction.py --primes 1000000 --observe
+"""
+import argparse
+import csv
+import functools
+import math
+import os
+import time
+
+import numpy as np
+
+from metrics import collecting
+from offsets import SEVEN_SISTERS, offset_label
+from parallel import run_sharded
+from primality import BACKENDS
+from prime_count import prime_count
+from residue_classes import ResidueCounts
+from sieve import nth_prime
+
+# prod over odd primes q of (1 - 2/q) / (1 - 1/q)^2.
+TWIN_PRIME_CONSTANT = 0.66016181584686957392781211
+
+# Primes are split into their residue classes mod 30, which fix both the last
+# digit of p and whether 2p + k is a multiple of 3 or 5.
+RESIDUE_MODULUS = 30
+
+# Gauss-Legendre nodes per quadrature panel, and panels per unit of log t.
+QUADRATURE_NODES = 20
+PANELS_PER_LOG_UNIT = 4
+
+# The ending digits with a row of their own, after the row over all primes.
+ENDING_DIGITS = (1, 3, 7, 9)
+
+
+def prime_factors(n):
+    """
+    Returns the distinct prime factors of n > 0 in increasing order.
+    """
+    factors = []
+    q = 2
+    while q * q <= n:
+        if n % q == 0:
+            factors.append(q)
+            while n % q == 0:
+                n //= q
+        q += 1
+    if n > 1:
+        factors.append(n)
+    return factors
+
+
+def local_factor(q, k, multiplier=2):
+    """
+    Returns (1 - nu/q) / (1 - 1/q)^2 for the prime q, where nu is the number of
+    residues n mod q with n * (multiplier * n + k) = 0 (mod q).
+    """
+    nu = sum(1 for n in range(q) if n * (multiplier * n + k) % q == 0)
+    return (1 - nu / q) / (1 - 1 / q) ** 2
+
+
+def singular_series(k, multiplier=2):
+    """
+    Returns the Hardy-Littlewood singular series of the pair (p, multiplier * p + k).
+    Only the primes dividing 2 * multiplier * k differ from the twin prime
+    constant's factors; it is 0 when the candidates always have a common factor.
+    """
+    if k == 0:
+        return 0.0
+    series = TWIN_PRIME_CONSTANT
+    for q in prime_factors(2 * multiplier * abs(k)):
+        series *= local_factor(q, k, multiplier)
+        if q > 2:
+            series /= (1 - 2 / q) / (1 - 1 / q) ** 2
+    return series
+
+
+@functools.lru_cache(maxsize=1)
+def _quadrature_rule():
+    return np.polynomial.legendre.leggauss(QUADRATURE_NODES)
+
+
+def log_quadrature(integrand, lo, hi):
+    """
+    Integrates integrand(t) over [lo, hi] with Gauss-Legendre quadrature in
+    u = log t, where the logarithmic integrands are smooth. 'integrand' takes
+    an array of t values.
+    """
+    if hi <= lo:
+        return 0.0
+    u_lo, u_hi = math.log(lo), math.log(hi)
+    num_panels = max(1, math.ceil((u_hi - u_lo) * PANELS_PER_LOG_UNIT))
+    nodes, weights = _quadrature_rule()
+    edges = np.linspace(u_lo, u_hi, num_panels + 1)
+    half_widths = np.diff(edges)[:, None] / 2
+    u = (edges[:-1, None] + edges[1:, None]) / 2 + half_widths * nodes[None, :]
+    t = np.exp(u)
+    # dt = t du.
+    return float(np.sum(half_widths * weights[None, :] * integrand(t) * t))
+
+
+def prime_integral(lo, hi):
+    """
+    Returns the integral of dt / log t over [lo, hi]: the expected number of primes in it.
+    """
+    return log_quadrature(lambda t: 1 / np.log(t), max(lo, 2), hi)
+
+
+def pair_integral(lo, hi, k, multiplier=2):
+    """
+    Returns the integral of dt / (log t * log(multiplier * t + k)) over [lo, hi],
+    starting where multiplier * t + k >= 3.
+    """
+    lo = max(lo, 2, (3 - k) / multiplier)
+    return log_quadrature(lambda t: 1 / (np.log(t) * np.log(multiplier * t + k)), lo, hi)
+
+
+def bound_for_primes(num_primes, start=2):
+    """
+    Returns the x at which the expected number of primes in [start, x] reaches
+    'num_primes', by Newton's method on prime_integral.
+    """
+    x = start + num_primes * math.log(start + num_primes * math.log(num_primes + 2) + 2)
+    for _ in range(100):
+        step = (prime_integral(start, x) - num_primes) * math.log(x)
+        x = max(x - step, start + 1)
+        if abs(step) < 0.5:
+            break
+    return x
+
+
+def predict_offsets(bound, start=2, offsets=SEVEN_SISTERS, multiplier=2):
+    """
+    Predicts the statistics of every offset for the primes in [start, bound].
+    Returns {'all' or ending digit: {offset: statistics}} with expected totals,
+    successes, non-multiples of 3 and 5 and the success rates, as floats.
+    """
+    residues = [r for r in range(RESIDUE_MODULUS) if math.gcd(r, RESIDUE_MODULUS) == 1]
+    primes_per_class = prime_integral(start, bound) / len(residues)
+
+    results = {group: {} for group in ('all',) + ENDING_DIGITS}
+    for k in offsets:
+        candidates = [multiplier * r + k for r in residues]
+        admissible = [math.gcd(c, RESIDUE_MODULUS) == 1 for c in candidates]
+        not_multiples = [c % 3 != 0 and c % 5 != 0 for c in candidates]
+        series = singular_series(k, multiplier)
+        successes = series * pair_integral(start, bound, k, multiplier)
+        # The successes are shared equally by the classes where the candidate is coprime to 30.
+        per_class = successes / sum(admissible) if any(admissible) else 0.0
+
+        for group in results:
+            members = [i for i, r in enumerate(residues) if group == 'all' or r % 10 == group]
+            total = primes_per_class * len(members)
+            successful = per_class * sum(admissible[i] for i in members)
+            filtered = primes_per_class * sum(not_multiples[i] for i in members)
+            results[group][k] = {
+                'singular_series': series,
+                'total': total,
+                'successful': successful,
+                'success_rate': successful / total * 100 if total else 0.0,
+                'not_multiples_of_3_or_5': filtered,
+                'filtered_success_rate': successful / filtered * 100 if filtered else 0.0,
+            }
+    return results
+
+
+def observe_offsets(num_primes, start=2, offsets=SEVEN_SISTERS, multiplier=2, workers=1, cache_path=None,
+                    backend='sieve', metrics=None):
+    """
+    Counts the same statistics as predict_offsets on the actual primes, with the
+    residue-class engine (see residue_classes.py). Returns results of the same shape.
+    """
+    with collecting(metrics):
+        counts = run_sharded(functools.partial(ResidueCounts, offsets, moduli=(10,), multiplier=multiplier),
+                             num_primes, workers, cache_path, start, backend, multiplier)
+    class_counts = counts.class_counts(10)
+
+    results = {}
+    for group in ('all',) + ENDING_DIGITS:
+        rows = slice(None) if group == 'all' else [group]
+        total = int(class_counts['total'][rows].sum())
+        results[group] = {}
+        for j, k in enumerate(offsets):
+            successful = int(class_counts['successful'][rows, j].sum())
+            filtered = int(class_counts['not_multiples'][rows, j].sum())
+            results[group][k] = {
+                'total': total,
+                'successful': successful,
+                'success_rate': successful / total * 100 if total else 0.0,
+                'not_multiples_of_3_or_5': filtered,
+                'filtered_success_rate': successful / filtered * 100 if filtered else 0.0,
+            }
+    return results
+
+
+def compare_offsets(num_primes=None, bound=None, start=2, offsets=SEVEN_SISTERS, multiplier=2, observe=False,
+                    workers=1, cache_path=None, backend='sieve', metrics=None):
+    """
+    Predicts the offset statistics for the primes from 'start' up to 'bound', or
+    for the first 'num_primes' of them. With observe=True the primes are also
+    counted, over exactly the same range. Returns (expected, observed or None).
+    """
+    observed = None
+    if observe:
+        if num_primes is None:
+            num_primes = prime_count(bound) - prime_count(start - 1)
+        # Predict over the range the observed primes actually span.
+        bound = nth_prime(prime_count(start - 1) + num_primes)
+        print(f"\nCounting the offsets on {num_primes:,} primes up to {bound:,}...")
+        start_time = time.time()
+        observed = observe_offsets(num_primes, start, offsets, multiplier, workers, cache_path, backend, metrics)
+        print(f"Counting complete. Time taken: {time.time() - start_time:.2f} seconds.")
+    elif bound is None:
+        bound = bound_for_primes(num_primes, start)
+
+    start_time = time.time()
+    expected = predict_offsets(bound, start, offsets, multiplier)
+    print(f"Prediction up to {bound:,.0f} complete. Time taken: {(time.time() - start_time) * 1000:.1f} ms.")
+    return expected, observed
+
+
+def save_to_csv(expected, filename, observed=None, multiplier=2):
+    """
+    Saves the predictions, and the observed statistics next to them if given,
+    as one table per group of primes.
+    """
+    header = [
+        'Prime Ending',
+        'Offset',
+        'Singular Series',
+        'Expected Primes',
+        'Expected Successful',
+        'Expected Success Rate (%)',
+        'Expected Not a Multiple of 3 and/or 5',
+        'Expected Success Rate Excluding Multiples of 3 and 5 (%)'
+    ]
+    if observed is not None:
+        header += [
+            'Observed Primes',
+            'Observed Successful',
+            'Observed Success Rate (%)',
+            'Observed Success Rate Excluding Multiples of 3 and 5 (%)',
+            'Observed / Expected'
+        ]
+    try:
+        with open(filename, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            for group, offset_data in expected.items():
+                writer.writerow([])
+                writer.writerow(header)
+                for offset, values in offset_data.items():
+                    row = [
+                        'all' if group == 'all' else f'ending_{group}',
+                        offset_label(offset, multiplier),
+                        f"{values['singular_series']:.6f}",
+                        f"{values['total']:.1f}",
+                        f"{values['successful']:.1f}",
+                        f"{values['success_rate']:.4f}",
+                        f"{values['not_multiples_of_3_or_5']:.1f}",
+                        f"{values['filtered_success_rate']:.4f}"
+                    ]
+                    if observed is not None:
+                        seen = observed[group][offset]
+                        # Offsets a class can never satisfy have no ratio.
+                        ratio = f"{seen['successful'] / values['successful']:.4f}" if values['successful'] else ''
+                        row += [
+                            seen['total'],
+                            seen['successful'],
+                            f"{seen['success_rate']:.4f}",
+                            f"{seen['filtered_success_rate']:.4f}",
+                            ratio
+                        ]
+                    writer.writerow(row)
+
+        print(f"\nResults successfully saved to {filename}")
+        print(f"File location: {os.path.abspath(filename)}")
+    except IOError as e:
+        print(f"An error occurred while writing the file: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Predict the offset success counts from the Hardy-Littlewood "
+                                                 "conjecture, optionally next to the observed counts.")
+    scale = parser.add_mutually_exclusive_group()
+    scale.add_argument('--primes', type=int, help="predict for this many primes (default: 1,000,000)")
+    scale.add_argument('--bound', type=float, help="predict for the primes up to this bound")
+    parser.add_argument('--start', type=int, default=2, help="predict for the primes from this number on")
+    parser.add_argument('--offsets', type=int, nargs='+', default=list(SEVEN_SISTERS), help="offsets k of 2p + k")
+    parser.add_argument('--observe', action='store_true', help="also count the offsets on the actual primes")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes for --observe")
+    parser.add_argument('--cache', help="prime cache file to read instead of sieving, for --observe")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='sieve',
+                        help="how candidates are tested for primality with --observe (default: sieve)")
+    parser.add_argument('--output', default='predicted_results.csv', help="CSV file for the tables")
+    args = parser.parse_args()
+
+    num_primes = args.primes if args.primes is not None or args.bound is not None else 1_000_000
+    bound = int(args.bound) if args.bound is not None and args.observe else args.bound
+    expected, observed = compare_offsets(num_primes, bound, args.start, tuple(args.offsets), observe=args.observe,
+                                         workers=args.workers, cache_path=args.cache, backend=args.backend)
+    save_to_csv(expected, args.output, observed)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,271 @@
+"""
+Primality backends for candidates beyond the reach of a sieve.
+
+The default backend looks candidates up in a sieved window. The Miller-Rabin
+backend tests batches of candidates directly: a vectorized trial division by
+small primes removes most composites, and the survivors get a deterministic
+Miller-Rabin test with a fixed witness set, so windows of primes starting at
+an arbitrary p0 can be analyzed without sieving up to 2p. Below 2^51 the
+Miller-Rabin test itself runs on whole arrays at once.
+"""
+import numpy as np
+
+from sieve import BasePrimes, PrimeSieve, _segment_smallest_factors
+
+# Small primes used to pre-filter candidates before the Miller-Rabin test.
+SMALL_PRIMES = PrimeSieve(1000).primes()
+_SMALL_PRIME_LIST = SMALL_PRIMES.tolist()
+
+# Sieving primes for factoring the candidates left after trial division, grown as needed.
+_base_primes = BasePrimes()
+
+# Witnesses that make Miller-Rabin deterministic for every n < 2^64 (Sinclair),
+# and the first thirteen primes, which are deterministic for n < 3.3 * 10^24 (psi_13).
+WITNESSES_64 = (2, 325, 9375, 28178, 450775, 9780504, 1795265022)
+WITNESSES_LARGE = (2, 3, 5, 7, 11, 13, 17, 19, 23, 29, 31, 37, 41)
+_LARGE_LIMIT = 3_317_044_064_679_887_385_961_981
+
+# Smaller witness sets that are deterministic below the given bounds (Jaeschke).
+WITNESS_TIERS = (
+    (4_759_123_141, (2, 7, 61)),
+    (1_122_004_669_633, (2, 13, 23, 1662803)),
+    (1 << 64, WITNESSES_64),
+)
+
+# Below this bound products mod n are reduced exactly in int64 arithmetic: the
+# quotient is estimated in float64, which is then off by at most one.
+VECTOR_LIMIT = 1 << 51
+
+
+def _miller_rabin(n, witnesses):
+    """
+    Returns False if any witness proves the odd number n > 2 composite.
+    """
+    d = n - 1
+    s = 0
+    while d % 2 == 0:
+        d //= 2
+        s += 1
+    for a in witnesses:
+        a %= n
+        if a == 0:
+            continue
+        x = pow(a, d, n)
+        if x == 1 or x == n - 1:
+            continue
+        for _ in range(s - 1):
+            x = x * x % n
+            if x == n - 1:
+                break
+        else:
+            return False
+    return True
+
+
+def _mulmod(a, b, n, n_float):
+    """
+    Returns a * b mod n elementwise, for int64 arrays with 0 <= a, b < n < VECTOR_LIMIT.
+    """
+    q = (a.astype(np.float64) * b.astype(np.float64) / n_float).astype(np.int64)
+    # The products wrap around mod 2^64, but their difference is exact and within [-n, 2n).
+    r = a * b - q * n
+    r += (r >> 63) & n
+    r -= n
+    r += (r >> 63) & n
+    return r
+
+
+def _miller_rabin_array(n, witnesses):
+    """
+    Vectorized _miller_rabin for an int64 array of odd numbers 2 < n < VECTOR_LIMIT.
+    Returns a boolean array, False where a witness proves n composite.
+    """
+    n_float = n.astype(np.float64)
+    d = n - 1
+    s = np.zeros_like(n)
+    while True:
+        even = (d & 1) == 0
+        if not even.any():
+            break
+        d[even] >>= 1
+        s += even
+
+    result = np.ones(n.size, dtype=bool)
+    # Indices still probably prime; composites are dropped after every witness.
+    active = np.arange(n.size)
+    for a in witnesses:
+        if not active.size:
+            break
+        m, m_float, e, rounds = n[active], n_float[active], d[active], s[active]
+        base = a % m
+        x = np.ones_like(m)
+        power = base.copy()
+        for bit in range(int(e.max()).bit_length()):
+            x = np.where((e >> bit) & 1 == 1, _mulmod(x, power, m, m_float), x)
+            power = _mulmod(power, power, m, m_float)
+        passed = (x == 1) | (x == m - 1) | (base == 0)
+        for r in range(1, int(rounds.max())):
+            x = _mulmod(x, x, m, m_float)
+            passed |= (r < rounds) & (x == m - 1)
+        result[active[~passed]] = False
+        active = active[passed]
+    return result
+
+
+def miller_rabin_batch(values):
+    """
+    Deterministic Miller-Rabin test of an int64 array of odd numbers > 2 without
+    small factors. Values below VECTOR_LIMIT are tested together, with the
+    smallest witness set that is deterministic for them; larger ones one by one.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    result = np.ones(values.size, dtype=bool)
+    lower = 0
+    for bound, witnesses in WITNESS_TIERS:
+        tier = np.flatnonzero((values >= lower) & (values < min(bound, VECTOR_LIMIT)))
+        if tier.size:
+            result[tier] = _miller_rabin_array(values[tier], witnesses)
+        lower = bound
+    for i in np.flatnonzero(values >= VECTOR_LIMIT).tolist():
+        result[i] = _miller_rabin(int(values[i]), WITNESSES_64)
+    return result
+
+
+def is_prime(n):
+    """
+    Deterministic primality test for a single integer below 3.3 * 10^24.
+    """
+    n = int(n)
+    if n < 2:
+        return False
+    for q in _SMALL_PRIME_LIST:
+        if n % q == 0:
+            return n == q
+    if n < _SMALL_PRIME_LIST[-1] ** 2:
+        return True
+    if n >= _LARGE_LIMIT:
+        raise ValueError(f"{n} is beyond the range of the deterministic Miller-Rabin test")
+    return _miller_rabin(n, WITNESSES_64 if n < 1 << 64 else WITNESSES_LARGE)
+
+
+def is_prime_batch(values):
+    """
+    Vectorized primality test: returns a boolean array with the same shape as 'values'.
+    Candidates with a small prime factor are removed in bulk before the
+    remaining ones are tested with Miller-Rabin.
+    """
+    values = np.asarray(values, dtype=np.int64)
+    flat = values.ravel()
+    result = flat >= 2
+
+    # Trial division by the small primes, one pass over the whole batch per prime.
+    for q in _SMALL_PRIME_LIST:
+        result &= (flat % q != 0) | (flat == q)
+
+    # Anything below the square of the largest small prime that survived is prime.
+    survivors = np.flatnonzero(result & (flat >= _SMALL_PRIME_LIST[-1] ** 2))
+    result[survivors] = miller_rabin_batch(flat[survivors])
+    return result.reshape(values.shape)
+
+
+class MillerRabinWindow:
+    """
+    Primality of every integer in [lo, hi), tested on demand instead of sieved.
+    Offers the same lookups as PrimeWindow.
+    """
+
+    def __init__(self, lo, hi):
+        self.lo = max(lo, 0)
+        self.hi = max(hi, self.lo)
+
+    def __contains__(self, n):
+        return self.is_prime(n)
+
+    def _check_range(self, lowest, highest):
+        if highest >= self.hi or (lowest < self.lo and highest >= 2):
+            raise ValueError(f"Values outside the window [{self.lo:,}, {self.hi:,})")
+
+    def is_prime(self, n):
+        """
+        Returns True if n is prime.
+        """
+        n = int(n)
+        if n >= 2:
+            self._check_range(n, n)
+        return is_prime(n)
+
+    def is_prime_array(self, values):
+        """
+        Vectorized is_prime: returns a boolean array with the same shape as 'values'.
+        """
+        values = np.asarray(values, dtype=np.int64)
+        if values.size:
+            self._check_range(int(values[values >= 2].min(initial=self.hi - 1)), int(values.max()))
+        return is_prime_batch(values)
+
+    def primes(self):
+        """
+        Returns every prime in the window as a sorted int64 array.
+        """
+        values = np.arange(self.lo, self.hi, dtype=np.int64)
+        return values[is_prime_batch(values)]
+
+    def smallest_prime_factor_array(self, values):
+        """
+        Returns the smallest prime factor of every value, or the value itself
+        for primes. Values below 2 have no prime factor and get 0. Only the
+        given values are factored, not the window: by trial division with
+        SMALL_PRIMES, and the composites left by a sieve of smallest factors
+        over the span they cover.
+        """
+        values = np.asarray(values, dtype=np.int64)
+        if values.size:
+            self._check_range(int(values[values >= 2].min(initial=self.hi - 1)), int(values.max()))
+        flat = values.ravel()
+        result = np.zeros(flat.shape, dtype=np.int64)
+
+        # Each prime removes the values it divides, so the later passes are over few values.
+        rest = np.flatnonzero(flat >= 2)
+        for q in _SMALL_PRIME_LIST:
+            divisible = flat[rest] % q == 0
+            result[rest[divisible]] = q
+            rest = rest[~divisible]
+            if rest.size == 0:
+                break
+
+        prime = is_prime_batch(flat[rest])
+        result[rest[prime]] = flat[rest[prime]]
+        composite = rest[~prime]
+        if composite.size:
+            # The composites left are odd, with every factor above the small primes.
+            first = int(flat[composite].min())
+            hi = int(flat[composite].max()) + 1
+            factors = _segment_smallest_factors(first, (hi - first + 1) // 2, hi, _base_primes.ensure(hi))
+            result[composite] = factors[(flat[composite] - first) // 2]
+        return result.reshape(values.shape)
+
+
+class MillerRabinBackend:
+    """
+    Candidate windows tested with batched Miller-Rabin rather than sieved.
+    """
+
+    def window(self, lo, hi):
+        return MillerRabinWindow(lo, hi)
+
+
+# Primality backends for the candidate windows, by name. 'sieve' uses the
+# segmented sieve (or a prime cache), which is the default.
+BACKENDS = {
+    'sieve': None,
+    'miller-rabin': MillerRabinBackend(),
+}
+
+
+def get_backend(name):
+    """
+    Returns the candidate backend registered under 'name'.
+    """
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown primality backend '{name}', expected one of {sorted(BACKENDS)}")
+    return BACKENDS[name]
@@ -0,0 +1,202 @@
+"""
+Persistent, memory-mapped prime bitmap cache shared across runs.
+
+A cache file starts with a 64-byte header (magic, format version, layout,
+limit, number of entries and a CRC-32 of the payload) followed by the payload:
+
+* 'PATH'      - the packed odd-only prime bitmap of PrimeSieve (layout 'odd-bits')
+* 'PATH.spf'  - an optional odd-only smallest-prime-factor table
+                (layout 'odd-spf16' or 'odd-spf32', 0 for primes and 1)
+
+Readers memory-map the payload read-only, so startup takes milliseconds and
+concurrent processes share the same page cache. Growing a cache only sieves
+the new range and appends it; the header is rewritten last, so readers of the
+old file keep seeing valid data.
+"""
+import argparse
+import math
+import os
+import struct
+import zlib
+
+import numpy as np
+
+from sieve import DEFAULT_SEGMENT_SIZE, BasePrimes, PrimeSieve, PrimeWindow
+
+MAGIC = b'SSPRIME\0'
+FORMAT_VERSION = 1
+HEADER_SIZE = 64
+_HEADER = struct.Struct('<8sIIQQI')
+
+# Layout codes stored in the header, with the payload dtype of each.
+LAYOUTS = {1: 'odd-bits', 2: 'odd-spf16', 3: 'odd-spf32'}
+_LAYOUT_CODES = {name: code for code, name in LAYOUTS.items()}
+_SPF_DTYPES = {'odd-spf16': np.uint16, 'odd-spf32': np.uint32}
+
+
+def _spf_path(path):
+    return path + '.spf'
+
+
+def read_header(path):
+    """
+    Reads and validates a cache header. Returns a dictionary with the layout,
+    limit, entry count and checksum.
+    """
+    with open(path, 'rb') as f:
+        raw = f.read(HEADER_SIZE)
+    if len(raw) < HEADER_SIZE:
+        raise ValueError(f"'{path}' is too short to be a prime cache")
+    magic, version, layout, limit, entries, checksum = _HEADER.unpack_from(raw)
+    if magic != MAGIC:
+        raise ValueError(f"'{path}' is not a prime cache")
+    if version != FORMAT_VERSION:
+        raise ValueError(f"'{path}' has cache format version {version}, expected {FORMAT_VERSION}")
+    if layout not in LAYOUTS:
+        raise ValueError(f"'{path}' has unknown layout code {layout}")
+    return {'layout': LAYOUTS[layout], 'limit': limit, 'entries': entries, 'checksum': checksum}
+
+
+def _write_header(f, layout, limit, entries, checksum):
+    f.seek(0)
+    f.write(_HEADER.pack(MAGIC, FORMAT_VERSION, _LAYOUT_CODES[layout], limit, entries, checksum)
+            .ljust(HEADER_SIZE, b'\0'))
+
+
+def _payload_checksum(f, length):
+    """
+    Computes the CRC-32 of the first 'length' payload bytes, in chunks.
+    """
+    f.seek(HEADER_SIZE)
+    checksum = 0
+    while length > 0:
+        chunk = f.read(min(length, 1 << 24))
+        if not chunk:
+            break
+        checksum = zlib.crc32(chunk, checksum)
+        length -= len(chunk)
+    return checksum
+
+
+def _spf_layout(limit):
+    # Every smallest factor is at most the square root of the limit.
+    return 'odd-spf16' if math.isqrt(limit) <= np.iinfo(np.uint16).max else 'odd-spf32'
+
+
+def _extend(path, layout, limit, start_index, start_offset, segment_values):
+    """
+    Writes entries for the odd numbers from 2*start_index + 1 up to 'limit' at
+    payload byte 'start_offset', sieving one segment at a time, then rewrites
+    the header.
+    """
+    total = (limit + 1) // 2
+    mode = 'r+b' if os.path.exists(path) else 'w+b'
+    with open(path, mode) as f:
+        if mode == 'w+b':
+            _write_header(f, layout, 0, 0, 0)
+        f.seek(HEADER_SIZE + start_offset)
+        base = BasePrimes()
+        i = start_index
+        while i < total:
+            j = min(i + DEFAULT_SEGMENT_SIZE, total)
+            # Odd numbers 2*i + 1 .. 2*j - 1.
+            window = PrimeWindow(2 * i + 1, 2 * j, base.ensure(2 * j))
+            f.write(segment_values(window).tobytes())
+            i = j
+        f.truncate()
+        length = f.tell() - HEADER_SIZE
+        _write_header(f, layout, limit, total, _payload_checksum(f, length))
+
+
+def build_cache(path, limit, spf=False, spf_limit=None):
+    """
+    Creates the cache at 'path' covering every integer up to 'limit', or extends
+    an existing smaller cache by sieving only the missing range. With spf=True
+    the smallest-prime-factor table is built or extended as well, up to
+    'spf_limit' if given (at most 'limit'), or to 'limit'.
+    """
+    old_limit = read_header(path)['limit'] if os.path.exists(path) else 0
+    if limit > old_limit:
+        # The last byte may be partially filled, so re-sieve from the last byte boundary.
+        start_index = ((old_limit + 1) // 2 // 8) * 8
+        _extend(path, 'odd-bits', limit, start_index, start_index // 8,
+                lambda window: np.packbits(window.flags, bitorder='little'))
+
+    if spf:
+        limit = limit if spf_limit is None else min(spf_limit, limit)
+        spf_path = _spf_path(path)
+        old = read_header(spf_path) if os.path.exists(spf_path) else None
+        # A larger table is kept as it is; it covers every smaller limit.
+        layout = _spf_layout(limit if old is None else max(limit, old['limit']))
+        if old is not None and limit > old['limit'] and old['layout'] != layout:
+            # The factors outgrew 16 bits: the table has to be rewritten with wider entries.
+            os.remove(spf_path)
+            old = None
+        if old is None or limit > old['limit']:
+            start_index = 0 if old is None else old['entries']
+            dtype = _SPF_DTYPES[layout]
+            _extend(spf_path, layout, limit, start_index, start_index * np.dtype(dtype).itemsize,
+                    lambda window: window.smallest_factors().astype(dtype))
+    return PrimeCache(path)
+
+
+class PrimeCache:
+    """
+    Read-only, memory-mapped view of a prime bitmap cache and, if present, its
+    smallest-prime-factor table. Provides windows for the streaming sieve.
+    """
+
+    def __init__(self, path, verify=False):
+        header = read_header(path)
+        if header['layout'] != 'odd-bits':
+            raise ValueError(f"'{path}' holds a '{header['layout']}' table, not a prime bitmap")
+        self.path = path
+        self.limit = header['limit']
+        num_bytes = (header['entries'] + 7) // 8
+        bits = np.memmap(path, dtype=np.uint8, mode='r', offset=HEADER_SIZE, shape=(num_bytes,))
+        if verify and zlib.crc32(bits) != header['checksum']:
+            raise ValueError(f"'{path}' failed its checksum")
+        self.sieve = PrimeSieve.from_bits(self.limit, bits)
+
+        # The optional factor table may cover less than the bitmap.
+        self.smallest_factors = None
+        self.spf_limit = 0
+        spf_path = _spf_path(path)
+        if os.path.exists(spf_path):
+            spf_header = read_header(spf_path)
+            dtype = _SPF_DTYPES[spf_header['layout']]
+            self.smallest_factors = np.memmap(spf_path, dtype=dtype, mode='r', offset=HEADER_SIZE,
+                                              shape=(spf_header['entries'],))
+            if verify and zlib.crc32(self.smallest_factors) != spf_header['checksum']:
+                raise ValueError(f"'{spf_path}' failed its checksum")
+            self.spf_limit = spf_header['limit']
+
+        # Sieving primes for windows whose factors are not in the table.
+        self.base_primes = self.sieve.window(0, min(math.isqrt(self.limit) + 2, self.limit + 1)).primes()
+
+    def window(self, lo, hi):
+        """
+        Returns a PrimeWindow for [lo, hi) read from the cache.
+        """
+        smallest_factors = self.smallest_factors if hi - 1 <= self.spf_limit else None
+        return self.sieve.window(lo, hi, self.base_primes, smallest_factors)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build, extend or inspect a prime bitmap cache.")
+    parser.add_argument('path', help="cache file")
+    parser.add_argument('--limit', type=int, help="build or extend the cache up to this number")
+    parser.add_argument('--spf', action='store_true', help="also build the smallest-prime-factor table")
+    parser.add_argument('--verify', action='store_true', help="check the payload checksums")
+    args = parser.parse_args()
+
+    if args.limit is not None:
+        build_cache(args.path, args.limit, spf=args.spf)
+    cache = PrimeCache(args.path, verify=args.verify)
+    print(f"Prime cache '{args.path}': limit {cache.limit:,}, {cache.sieve.bits.nbytes:,} bytes")
+    if cache.smallest_factors is not None:
+        print(f"Smallest-prime-factor table: limit {cache.spf_limit:,}, {cache.smallest_factors.nbytes:,} bytes")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+A stream of new primes produced by the offsets, usable as a prime source.
+
+Every prime p yields the candidates 2p + k, and the prime ones are new primes,
+which yield candidates in turn. Starting from seed primes, given as a list or
+taken from a range, the stream produces batch after batch of primes that were
+neither seeds nor produced before. Candidates are tested together with the
+vectorized Miller-Rabin test of primality.py, and the primes already seen are
+remembered in a Bloom filter of fixed size (or exactly, in a sparse bitmap)
+rather than a Python set, so memory stays bounded as the stream goes on. The
+candidates of a prime are only explored up to 'max_value'.
+
+    python src/prime_stream.py --start 1000000000000000 --count 1000000
+    python src/prime_stream.py --seeds 3 5 7 11 13 --max-value 1000000000000 --output primes.txt
+"""
+import argparse
+import collections
+import math
+import os
+import time
+
+import numpy as np
+
+from metrics import stage
+from offsets import SEVEN_SISTERS
+from primality import VECTOR_LIMIT, is_prime_batch
+from sieve import iter_primes
+
+DEFAULT_BATCH_SIZE = 1 << 16
+
+# Candidates are kept below this by default, where they are tested fastest.
+DEFAULT_MAX_VALUE = VECTOR_LIMIT - 1
+
+# Odd numbers per block of a SparseBitmap.
+BITMAP_BLOCK_BITS = 1 << 20
+
+# Multipliers of the splitmix64 finalizer, which hashes values for the Bloom filter.
+_MIX_1 = np.uint64(0xBF58476D1CE4E5B9)
+_MIX_2 = np.uint64(0x94D049BB133111EB)
+_GOLDEN = np.uint64(0x9E3779B97F4A7C15)
+
+
+def _mix(h):
+    h = (h ^ (h >> np.uint64(30))) * _MIX_1
+    h = (h ^ (h >> np.uint64(27))) * _MIX_2
+    return h ^ (h >> np.uint64(31))
+
+
+class BloomFilter:
+    """
+    Approximate set of integers in a fixed bit array. A value that was added is
+    always found; one that was not is reported with probability about
+    'error_rate' as long as at most 'capacity' values have been added.
+    """
+
+    def __init__(self, capacity=10_000_000, error_rate=1e-4):
+        self.capacity = capacity
+        self.num_bits = math.ceil(-capacity * math.log(error_rate) / math.log(2) ** 2)
+        self.num_hashes = max(1, round(self.num_bits / capacity * math.log(2)))
+        self.bits = np.zeros((self.num_bits + 7) // 8, dtype=np.uint8)
+        self.count = 0
+
+    def _positions(self, values):
+        # Double hashing: position i is h1 + i * h2 mod the number of bits.
+        h = np.asarray(values, dtype=np.int64).astype(np.uint64)
+        h1 = _mix(h)
+        h2 = _mix(h ^ _GOLDEN) | np.uint64(1)
+        steps = np.arange(self.num_hashes, dtype=np.uint64)
+        return (h1[:, None] + steps[None, :] * h2[:, None]) % np.uint64(self.num_bits)
+
+    def add(self, values):
+        """
+        Adds every value of an integer array.
+        """
+        positions = self._positions(values).ravel()
+        np.bitwise_or.at(self.bits, positions >> np.uint64(3),
+                         np.left_shift(1, positions & np.uint64(7)).astype(np.uint8))
+        self.count += len(values)
+
+    def contains(self, values):
+        """
+        Returns a boolean array telling which values were (probably) added.
+        """
+        positions = self._positions(values)
+        found = (self.bits[positions >> np.uint64(3)] >> (positions & np.uint64(7)).astype(np.uint8)) & 1
+        return found.all(axis=1)
+
+
+class SparseBitmap:
+    """
+    Exact set of odd integers: a bitmap per block of BITMAP_BLOCK_BITS odd
+    numbers, allocated for the blocks that hold a value.
+    """
+
+    def __init__(self):
+        self.blocks = {}
+        self.count = 0
+
+    def _split(self, values):
+        index = np.asarray(values, dtype=np.int64) >> 1
+        return index // BITMAP_BLOCK_BITS, index % BITMAP_BLOCK_BITS
+
+    def add(self, values):
+        """
+        Adds every value of an array of odd integers.
+        """
+        blocks, offsets = self._split(values)
+        for block in np.unique(blocks).tolist():
+            bits = self.blocks.get(block)
+            if bits is None:
+                bits = self.blocks[block] = np.zeros(BITMAP_BLOCK_BITS // 8, dtype=np.uint8)
+            members = offsets[blocks == block]
+            np.bitwise_or.at(bits, members >> 3, np.left_shift(1, members & 7).astype(np.uint8))
+        self.count += len(values)
+
+    def contains(self, values):
+        """
+        Returns a boolean array telling which values were added.
+        """
+        blocks, offsets = self._split(values)
+        found = np.zeros(len(offsets), dtype=bool)
+        for block in np.unique(blocks).tolist():
+            bits = self.blocks.get(block)
+            if bits is not None:
+                members = np.flatnonzero(blocks == block)
+                found[members] = (bits[offsets[members] >> 3] >> (offsets[members] & 7)) & 1 == 1
+        return found
+
+
+class ProductionStats:
+    """
+    Running totals of a prime stream: seeds used, candidates tested and primes produced.
+    """
+
+    def __init__(self):
+        self.start_time = time.time()
+        self.seeds = 0
+        self.candidates = 0
+        self.primes = 0
+
+    def elapsed(self):
+        return time.time() - self.start_time
+
+    def primes_per_second(self):
+        elapsed = self.elapsed()
+        return self.primes / elapsed if elapsed > 0 else 0.0
+
+    def summary(self):
+        return (f"{self.primes:,} primes from {self.seeds:,} seeds, {self.candidates:,} candidates tested "
+                f"in {self.elapsed():.2f} s: {self.primes_per_second():,.0f} primes/s")
+
+
+def range_seeds(lo, hi=None):
+    """
+    Yields the primes in [lo, hi) as seed arrays, one sieve segment at a time.
+    """
+    yield from iter_primes(lo, hi)
+
+
+def produce_primes(seeds, offsets=SEVEN_SISTERS, multiplier=2, max_value=DEFAULT_MAX_VALUE,
+                   batch_size=DEFAULT_BATCH_SIZE, seen=None, stats=None):
+    """
+    Yields arrays of new primes multiplier * p + k, produced from the seed
+    primes and from every prime produced before. 'seeds' is an iterable of
+    prime arrays, taken one at a time when the produced primes run out.
+    Candidates above 'max_value' are not explored, and the stream ends at a
+    seed array with no prime small enough to explore; raises ValueError if
+    that is the first one. 'seen' is the set of primes already seen (a
+    BloomFilter by default); 'stats' an optional ProductionStats to update.
+    """
+    offsets = np.asarray(offsets, dtype=np.int64)
+    if max_value >= VECTOR_LIMIT:
+        print(f"Note: candidates above {VECTOR_LIMIT:,} are tested one at a time")
+    seen = BloomFilter() if seen is None else seen
+    # Primes whose candidates are still to be tested.
+    pending = collections.deque()
+    # The largest prime whose candidates all stay within max_value.
+    largest_parent = (max_value - int(offsets.max())) // multiplier
+    seeds = iter(seeds)
+    first_batch = True
+
+    while True:
+        if not pending:
+            batch = next(seeds, None)
+            if batch is None:
+                return
+            batch = np.asarray(batch, dtype=np.int64)
+            parents = batch[batch <= largest_parent]
+            if parents.size == 0 and batch.size:
+                if first_batch:
+                    raise ValueError(f"Every seed is above {largest_parent:,}, so its candidates exceed the "
+                                     f"largest value explored, {max_value:,}")
+                # Seeds taken from a range only grow from here on.
+                return
+            first_batch = False
+            seen.add(batch[batch % 2 == 1])
+            pending.append(parents)
+            if stats is not None:
+                stats.seeds += batch.size
+            continue
+
+        primes = pending.popleft()
+        if primes.size > batch_size:
+            pending.appendleft(primes[batch_size:])
+            primes = primes[:batch_size]
+
+        candidates = (multiplier * primes[:, None] + offsets[None, :]).ravel()
+        candidates = np.unique(candidates[candidates > 1])
+        candidates = candidates[~seen.contains(candidates)]
+        with stage('primality', candidates.size):
+            new = candidates[is_prime_batch(candidates)]
+        if stats is not None:
+            stats.candidates += candidates.size
+            stats.primes += new.size
+        if new.size:
+            seen.add(new)
+            pending.append(new[new <= largest_parent])
+            yield new
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Produce new primes from seed primes with the offsets 2p + k.")
+    parser.add_argument('--seeds', type=int, nargs='+', help="seed primes (default: the primes from --start on)")
+    parser.add_argument('--start', type=int, default=10 ** 12, help="take the seeds from the primes from this number on")
+    parser.add_argument('--stop', type=int, help="take no seeds from this number on")
+    parser.add_argument('--count', type=int, help="stop after producing this many primes")
+    parser.add_argument('--max-value', type=int, default=DEFAULT_MAX_VALUE, help="largest candidate explored")
+    parser.add_argument('--dedup', choices=('bloom', 'bitmap'), default='bloom',
+                        help="remember the primes seen in a Bloom filter of fixed size or an exact sparse bitmap")
+    parser.add_argument('--capacity', type=int, default=10_000_000, help="primes the Bloom filter is sized for")
+    parser.add_argument('--error-rate', type=float, default=1e-4,
+                        help="Bloom filter false positive rate, at which new primes are skipped")
+    parser.add_argument('--output', help="text file to write the primes to, one per line")
+    args = parser.parse_args()
+
+    seeds = [args.seeds] if args.seeds else range_seeds(args.start, args.stop)
+    seen = BloomFilter(args.capacity, args.error_rate) if args.dedup == 'bloom' else SparseBitmap()
+    stats = ProductionStats()
+    output = open(args.output, 'w') if args.output else None
+    last_report = time.time()
+    try:
+        for primes in produce_primes(seeds, max_value=args.max_value, seen=seen, stats=stats):
+            if args.count is not None and stats.primes >= args.count:
+                primes = primes[:primes.size - (stats.primes - args.count)]
+            if output is not None:
+                np.savetxt(output, primes, fmt='%d')
+            if time.time() - last_report >= 1:
+                print(stats.summary())
+                last_report = time.time()
+            if args.count is not None and stats.primes >= args.count:
+                stats.primes = args.count
+                break
+    except ValueError as e:
+        parser.error(str(e))
+    finally:
+        if output is not None:
+            output.close()
+
+    print("\n" + stats.summary())
+    if output is not None:
+        print(f"File location: {os.path.abspath(args.output)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,265 @@
+"""
+Breakdown of the offset statistics by residue class of p, for any set of moduli in one pass.
+
+The primes of each block are reduced once modulo the least common multiple L
+of the moduli (and of the filter divisors 3 and 5), and the primes and their
+successful candidates are counted per residue mod L with a single bincount
+over (residue, offset). The counts for a modulus m are folded out of those by
+summing the residues that agree mod m. Whether a candidate multiplier * p + k is
+a multiple of 3 or 5 only depends on p mod 15, so the filtered counts come
+from the residue totals without looking at the primes again. A breakdown by
+several moduli thus costs about as much as the ending-digit table alone.
+Moduli whose common multiple would make the residue tables too large are
+counted in separate groups.
+"""
+import argparse
+import csv
+import functools
+import math
+import os
+import time
+
+import numpy as np
+
+from metrics import collecting
+from offsets import SEVEN_SISTERS, count_by_class, offset_label, residue_divisibility
+from parallel import run_sharded
+from primality import BACKENDS, is_prime
+
+# Largest number of residues counted for one group of moduli.
+MAX_RESIDUES = 1 << 16
+
+# Candidates divisible by these primes are left out of the filtered success rate,
+# as in filtered_results.py.
+FILTER_DIVISORS = (3, 5)
+
+
+def group_moduli(moduli, divisors=FILTER_DIVISORS, max_residues=MAX_RESIDUES):
+    """
+    Splits the moduli into groups counted together: each group is reduced modulo
+    the least common multiple of its moduli and the divisors, which stays at
+    most max_residues. Returns a list of (residue modulus, moduli of the group).
+    """
+    groups = []
+    for m in moduli:
+        if m < 1:
+            raise ValueError(f"Moduli must be positive, got {m}")
+        for i, (residues, members) in enumerate(groups):
+            if math.lcm(residues, m) <= max_residues:
+                groups[i] = (math.lcm(residues, m), members + (m,))
+                break
+        else:
+            residues = math.lcm(m, *divisors)
+            if residues > max_residues:
+                raise ValueError(f"Modulus {m} needs {residues:,} residues, more than the {max_residues:,} allowed")
+            groups.append((residues, (m,)))
+    return groups
+
+
+class ResidueCounts:
+    """
+    Mergeable counters of the primes and successful candidates by residue class
+    of p modulo each of 'moduli', for one contiguous range of primes, together
+    with the candidates that are multiples of the (prime) 'divisors'.
+    """
+
+    def __init__(self, offsets=SEVEN_SISTERS, moduli=(10,), divisors=FILTER_DIVISORS, multiplier=2):
+        for q in divisors:
+            if not is_prime(q):
+                raise ValueError(f"Filter divisors must be prime, got {q}")
+        self.offsets = offsets
+        self.moduli = tuple(dict.fromkeys(moduli))
+        self.divisors = tuple(divisors)
+        self.multiplier = multiplier
+        self.settings = {'moduli': list(self.moduli), 'divisors': list(self.divisors)}
+        self.groups = group_moduli(self.moduli, self.divisors)
+
+        # Per group, indexed by residue mod the group's modulus: the primes, the successful
+        # candidates per offset and, per divisor q, the candidates equal to q itself, which
+        # are prime rather than multiples of q.
+        num_offsets = len(offsets)
+        self.residue_totals = [np.zeros(residues, dtype=np.int64) for residues, _ in self.groups]
+        self.residue_successes = [np.zeros((residues, num_offsets), dtype=np.int64) for residues, _ in self.groups]
+        self.residue_equal = [np.zeros((len(self.divisors), residues, num_offsets), dtype=np.int64)
+                              for residues, _ in self.groups]
+
+    def update(self, block):
+        """
+        Adds one OffsetBlock of primes and the primality of their candidates.
+        """
+        primes = block.primes
+        # Only the smallest primes can have a candidate equal to a divisor.
+        num_small = 0
+        if self.divisors:
+            num_small = np.searchsorted(primes, (max(self.divisors) - min(self.offsets)) // self.multiplier,
+                                        side='right')
+
+        for g, (residues, _) in enumerate(self.groups):
+            classes = primes % residues
+            self.residue_totals[g] += np.bincount(classes, minlength=residues)
+            self.residue_successes[g] += count_by_class(classes, block.success, residues)
+            if num_small:
+                for i, q in enumerate(self.divisors):
+                    self.residue_equal[g][i] += count_by_class(classes[:num_small],
+                                                               block.candidates[:num_small] == q, residues)
+
+    def merge(self, other):
+        """
+        Adds the counts of another range.
+        """
+        for g in range(len(self.groups)):
+            self.residue_totals[g] += other.residue_totals[g]
+            self.residue_successes[g] += other.residue_successes[g]
+            self.residue_equal[g] += other.residue_equal[g]
+        return self
+
+    def class_counts(self, modulus):
+        """
+        Returns the counts by residue class c of p modulo one of the moduli, as a
+        dictionary of arrays: 'total' (indexed by c), and 'successful',
+        'multiples_of_<q>' for every divisor q and 'not_multiples' (candidates
+        divisible by none of them), indexed by c and offset.
+        """
+        g = next((g for g, (_, members) in enumerate(self.groups) if modulus in members), None)
+        if g is None:
+            raise ValueError(f"Modulus {modulus} was not counted; the moduli are {list(self.moduli)}")
+        residues = self.groups[g][0]
+        totals = self.residue_totals[g]
+        equal = self.residue_equal[g]
+
+        # Divisibility of the candidates by each divisor, for every residue of p.
+        divisible = np.zeros((len(self.divisors), residues, len(self.offsets)), dtype=bool)
+        for i, q in enumerate(self.divisors):
+            divisible[i] = residue_divisibility(residues, q, self.offsets, self.multiplier)
+        counts = {
+            'total': totals,
+            'successful': self.residue_successes[g],
+        }
+        for i, q in enumerate(self.divisors):
+            counts[f'multiples_of_{q}'] = totals[:, None] * divisible[i] - equal[i]
+        counts['not_multiples'] = totals[:, None] * ~divisible.any(axis=0) + equal.sum(axis=0)
+
+        # Residues that agree modulo the modulus make up one class.
+        return {key: value.reshape(residues // modulus, modulus, *value.shape[1:]).sum(axis=0)
+                for key, value in counts.items()}
+
+
+def coprime_classes(modulus):
+    """
+    Returns the residue classes mod 'modulus' coprime to it. Every other class
+    holds at most one prime, a prime factor of the modulus.
+    """
+    return [c for c in range(modulus) if math.gcd(c, modulus) == 1]
+
+
+def residue_report(moduli, divisors=FILTER_DIVISORS):
+    """
+    Returns the counts factory for a residue breakdown by 'moduli', e.g. for the engine.
+    """
+    return functools.partial(ResidueCounts, moduli=tuple(moduli), divisors=tuple(divisors))
+
+
+def analyze_prime_offsets_by_residue(num_primes_to_check=1_000_000, moduli=(10,), workers=1, cache_path=None,
+                                     start=2, backend='sieve', checkpoint_path=None, metrics=None):
+    """
+    Tests the seven specific offsets on the first 'num_primes_to_check' primes,
+    grouping the analysis by the residue class of the prime modulo each of 'moduli',
+    all in a single pass. The other arguments are those of the other analyses.
+    """
+    print(f"\nAnalyzing prime offsets by residue class modulo {', '.join(map(str, moduli))}...")
+    start_time = time.time()
+    with collecting(metrics):
+        counts = run_sharded(residue_report(moduli), num_primes_to_check, workers, cache_path, start, backend,
+                             checkpoint_path=checkpoint_path)
+    end_time = time.time()
+    print(f"Analysis complete. Time taken: {end_time - start_time:.2f} seconds.")
+    return results_from_counts(counts)
+
+
+def results_from_counts(counts):
+    """
+    Builds the nested result dictionary saved by save_to_csv from merged ResidueCounts:
+    {modulus: {residue class: {offset: statistics}}} over the classes coprime to each modulus.
+    """
+    results = {}
+    for modulus in counts.moduli:
+        class_counts = counts.class_counts(modulus)
+        results[modulus] = {}
+        for c in coprime_classes(modulus):
+            total = int(class_counts['total'][c])
+            results[modulus][c] = {}
+            for j, k in enumerate(counts.offsets):
+                successful = int(class_counts['successful'][c, j])
+                not_multiples = int(class_counts['not_multiples'][c, j])
+                results[modulus][c][k] = {
+                    'total': total,
+                    'successful': successful,
+                    'composites': total - successful,
+                    'success_rate': successful / total * 100 if total else 0.0,
+                    'not_multiples': not_multiples,
+                    'filtered_success_rate': successful / not_multiples * 100 if not_multiples else 0.0,
+                }
+    return results
+
+
+def save_to_csv(data, filename, divisors=FILTER_DIVISORS, multiplier=2):
+    """
+    Saves the breakdown as one table per modulus, with a row per residue class and offset.
+    """
+    try:
+        with open(filename, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            for modulus, classes in data.items():
+                writer.writerow([])
+                writer.writerow([
+                    'Modulus',
+                    'Residue',
+                    'Offset',
+                    'Total Primes',
+                    'Successful Primes',
+                    'Other Composites',
+                    'Success Rate (%)',
+                    f"Not a Multiple of {' and/or '.join(map(str, divisors))}",
+                    f"Success Rate Excluding Multiples of {' and '.join(map(str, divisors))} (%)"
+                ])
+                for residue, offset_data in classes.items():
+                    for offset, values in offset_data.items():
+                        writer.writerow([
+                            modulus,
+                            residue,
+                            offset_label(offset, multiplier),
+                            values['total'],
+                            values['successful'],
+                            values['composites'],
+                            f"{values['success_rate']:.4f}",
+                            values['not_multiples'],
+                            f"{values['filtered_success_rate']:.4f}"
+                        ])
+
+        print(f"\nResults successfully saved to {filename}")
+        print(f"File location: {os.path.abspath(filename)}")
+    except IOError as e:
+        print(f"An error occurred while writing the file: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Break the offset statistics down by residue class of p.")
+    parser.add_argument('--primes', type=int, default=1_000_000, help="number of primes to analyze")
+    parser.add_argument('--moduli', type=int, nargs='+', default=[10], help="moduli to group the primes by")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--cache', help="prime cache file to read instead of sieving")
+    parser.add_argument('--start', type=int, default=2, help="analyze the primes from this number on")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='sieve',
+                        help="how candidates are tested for primality (default: sieve)")
+    parser.add_argument('--checkpoint', help="checkpoint file to save progress to, and to resume or extend from")
+    parser.add_argument('--output', default='residue_classes.csv', help="CSV file for the tables")
+    args = parser.parse_args()
+
+    results = analyze_prime_offsets_by_residue(args.primes, args.moduli, workers=args.workers, cache_path=args.cache,
+                                               start=args.start, backend=args.backend,
+                                               checkpoint_path=args.checkpoint)
+    save_to_csv(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
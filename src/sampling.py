@@ -0,0 +1,331 @@
+"""
+Sampled estimation of the offset statistics at magnitudes too large to analyze exactly.
+
+An exact run has to visit every prime from the start on. Here only a sample
+of short windows [lo, lo + window_size) is taken from a range of magnitude,
+either at random or evenly spaced. The primes inside each window are found
+with Miller-Rabin (or a segmented sieve window, for moderate magnitudes), their
+2p + k candidates are tested, and the per-window counts give estimates of
+the per-offset success rates, the exact and cumulative success count
+distributions and the ending-digit breakdown, each with a confidence interval.
+
+The estimates are ratios of totals over the sampled windows, and their
+standard errors come from the spread of the windows: the usual ratio
+estimator for a sample of clusters. With random windows the intervals are
+valid confidence intervals; evenly spaced windows usually make them
+slightly conservative.
+
+    python src/sampling.py --magnitude 1000000000000000000 --windows 200
+"""
+import argparse
+import csv
+import multiprocessing
+import os
+import statistics
+import time
+
+import numpy as np
+
+from metrics import collecting, stage
+from offsets import SEVEN_SISTERS, OffsetBlock, count_by_class, offset_label
+from primality import BACKENDS, get_backend
+from sieve import BasePrimes, PrimeWindow
+
+DEFAULT_WINDOWS = 100
+DEFAULT_WINDOW_SIZE = 1 << 16
+
+# The ending digits reported, as in ending_digit_results.py.
+ENDING_DIGITS = (1, 3, 7, 9)
+
+# Sieving primes for the 'sieve' backend, grown as needed and kept for every window of the process.
+_base_primes = BasePrimes()
+
+
+def window_starts(lo, hi, num_windows, window_size, method='random', seed=None):
+    """
+    Returns the sorted starts of 'num_windows' windows of 'window_size' integers
+    inside [lo, hi): uniformly at random (independently, so windows may
+    overlap) with method='random', or evenly spaced with method='even'.
+    """
+    span = hi - lo - window_size
+    if span < 0:
+        raise ValueError(f"A window of {window_size:,} integers does not fit in [{lo:,}, {hi:,})")
+    if method == 'random':
+        rng = np.random.default_rng(seed)
+        return np.sort(rng.integers(lo, lo + span, num_windows, endpoint=True, dtype=np.int64))
+    if method == 'even':
+        # Python integers keep the spacing exact beyond the precision of floats.
+        return np.array([lo + (2 * i + 1) * span // (2 * num_windows) for i in range(num_windows)], dtype=np.int64)
+    raise ValueError(f"Unknown sampling method '{method}', expected 'random' or 'even'")
+
+
+def _window(lo, hi, backend):
+    # Candidates and primes of a window are tested by the backend, or sieved.
+    if backend is not None:
+        return backend.window(lo, hi)
+    return PrimeWindow(lo, hi, _base_primes.ensure(hi))
+
+
+def window_block(lo, hi, offsets=SEVEN_SISTERS, multiplier=2, backend=None):
+    """
+    Returns the OffsetBlock of the primes in [lo, hi), or None if there are none.
+    'backend' finds the primes and tests their candidates (see primality.py);
+    None sieves both.
+    """
+    if (np.iinfo(np.int64).max - max(offsets)) // multiplier < hi:
+        raise OverflowError(f"Candidates of primes below {hi:,} leave the 64-bit integer range")
+    with stage('sieve', hi - lo):
+        primes = _window(lo, hi, backend).primes()
+    if primes.size == 0:
+        return None
+    window = _window(multiplier * int(primes[0]) + min(offsets), multiplier * int(primes[-1]) + max(offsets) + 1,
+                     backend)
+    return OffsetBlock(primes, window, offsets, multiplier)
+
+
+class SampleCounts:
+    """
+    The counts of every sampled window, one row per window.
+    """
+
+    def __init__(self, offsets=SEVEN_SISTERS):
+        self.offsets = offsets
+        num_offsets = len(offsets)
+        self.window_starts = np.empty(0, dtype=np.int64)
+        self.num_primes = np.empty(0, dtype=np.int64)
+        self.exact_counts = np.empty((0, num_offsets + 1), dtype=np.int64)
+        self.offset_counts = np.empty((0, num_offsets), dtype=np.int64)
+        self.digit_totals = np.empty((0, 10), dtype=np.int64)
+        self.digit_successes = np.empty((0, 10, num_offsets), dtype=np.int64)
+
+    def add_window(self, lo, block):
+        """
+        Adds a row with the counts of the OffsetBlock of the window starting at 'lo'.
+        An empty window (block None) adds a row of zeros.
+        """
+        num_offsets = len(self.offsets)
+        exact = np.zeros(num_offsets + 1, dtype=np.int64)
+        offsets = np.zeros(num_offsets, dtype=np.int64)
+        digit_totals = np.zeros(10, dtype=np.int64)
+        digit_successes = np.zeros((10, num_offsets), dtype=np.int64)
+        if block is not None:
+            exact += np.bincount(block.success.sum(axis=1), minlength=num_offsets + 1)
+            offsets += block.success.sum(axis=0)
+            digits = block.primes % 10
+            digit_totals += np.bincount(digits, minlength=10)
+            digit_successes += count_by_class(digits, block.success, 10)
+
+        self.window_starts = np.append(self.window_starts, lo)
+        self.num_primes = np.append(self.num_primes, exact.sum())
+        self.exact_counts = np.vstack((self.exact_counts, exact))
+        self.offset_counts = np.vstack((self.offset_counts, offsets))
+        self.digit_totals = np.vstack((self.digit_totals, digit_totals))
+        self.digit_successes = np.concatenate((self.digit_successes, digit_successes[None]))
+
+    def merge(self, other):
+        """
+        Appends the windows of another sample.
+        """
+        self.window_starts = np.concatenate((self.window_starts, other.window_starts))
+        self.num_primes = np.concatenate((self.num_primes, other.num_primes))
+        self.exact_counts = np.concatenate((self.exact_counts, other.exact_counts))
+        self.offset_counts = np.concatenate((self.offset_counts, other.offset_counts))
+        self.digit_totals = np.concatenate((self.digit_totals, other.digit_totals))
+        self.digit_successes = np.concatenate((self.digit_successes, other.digit_successes))
+        return self
+
+
+def ratio_estimate(numerators, denominators, confidence=0.95):
+    """
+    Estimates sum(numerators) / sum(denominators) from per-window counts (first
+    axis: windows) and returns (ratio, half-width of its confidence interval).
+    The standard error is that of a ratio estimator over sampled clusters,
+    from the spread of numerator - ratio * denominator between the windows.
+    Arrays of any further shape are estimated element by element.
+    """
+    numerators = np.asarray(numerators, dtype=np.float64)
+    denominators = np.broadcast_to(np.asarray(denominators, dtype=np.float64), numerators.shape)
+    num_windows = numerators.shape[0]
+    total = denominators.sum(axis=0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ratio = np.where(total > 0, numerators.sum(axis=0) / total, 0.0)
+        if num_windows < 2:
+            return ratio, np.full(ratio.shape, np.nan)
+        residuals = numerators - ratio * denominators
+        variance = (residuals ** 2).sum(axis=0) / (num_windows * (num_windows - 1))
+        standard_error = np.where(total > 0, np.sqrt(variance) / (total / num_windows), np.nan)
+    z = statistics.NormalDist().inv_cdf((1 + confidence) / 2)
+    return ratio, z * standard_error
+
+
+def results_from_counts(counts, lo, hi, window_size, method, confidence=0.95, multiplier=2):
+    """
+    Builds the estimate tables saved by save_to_csv from the SampleCounts of a sample.
+    Every estimate is (count in the sample, estimated percentage, lower, upper).
+    """
+    offsets_k = counts.offsets
+    num_primes = counts.num_primes
+
+    def estimates(numerators, denominators):
+        ratio, half_width = ratio_estimate(numerators, denominators, confidence)
+        return ratio * 100, np.clip(ratio - half_width, 0, 1) * 100, np.clip(ratio + half_width, 0, 1) * 100
+
+    def rows(totals, percentages):
+        return [(int(total), *map(float, values)) for total, *values in zip(totals, *percentages)]
+
+    # Cumulative counts: at least i successes, from the exact counts.
+    cumulative = np.cumsum(counts.exact_counts[:, ::-1], axis=1)[:, ::-1]
+    exact_rows = rows(counts.exact_counts.sum(axis=0), estimates(counts.exact_counts, num_primes[:, None]))
+    cumulative_rows = rows(cumulative.sum(axis=0), estimates(cumulative, num_primes[:, None]))
+    offset_rows = rows(counts.offset_counts.sum(axis=0), estimates(counts.offset_counts, num_primes[:, None]))
+
+    digit_rates = estimates(counts.digit_successes, counts.digit_totals[:, :, None])
+    digit_successes = counts.digit_successes.sum(axis=0)
+    ending_digits = {}
+    for d in ENDING_DIGITS:
+        ending_digits[d] = {
+            k: {
+                'total': int(counts.digit_totals[:, d].sum()),
+                'successful': int(digit_successes[d, j]),
+                'success_rate': float(digit_rates[0][d, j]),
+                'lower': float(digit_rates[1][d, j]),
+                'upper': float(digit_rates[2][d, j]),
+            }
+            for j, k in enumerate(offsets_k)
+        }
+
+    return {
+        'Summary': {
+            'Sampled range': f"[{lo}, {hi})",
+            'Sampling method': method,
+            'Windows': len(num_primes),
+            'Window size': window_size,
+            'Primes sampled': int(num_primes.sum()),
+            'Confidence level': f"{confidence * 100:g}%",
+            'Multiplier': multiplier,
+        },
+        'Exact success count distribution': dict(enumerate(exact_rows)),
+        'Cumulative success count distribution': {f'at least {i}': row for i, row in enumerate(cumulative_rows)},
+        'Individual offset success counts': dict(zip(offsets_k, offset_rows)),
+        'Ending digit success rates': ending_digits,
+    }
+
+
+def _sample_window(task):
+    lo, window_size, offsets, multiplier, backend = task
+    counts = SampleCounts(offsets)
+    counts.add_window(lo, window_block(lo, lo + window_size, offsets, multiplier, get_backend(backend)))
+    return counts
+
+
+def sample_offsets(magnitude=10**15, width=None, num_windows=DEFAULT_WINDOWS, window_size=DEFAULT_WINDOW_SIZE,
+                   method='random', seed=None, offsets=SEVEN_SISTERS, multiplier=2, backend='miller-rabin',
+                   workers=1, confidence=0.95, metrics=None):
+    """
+    Estimates the offset statistics of the primes in [magnitude, magnitude + width)
+    (width defaults to the magnitude itself) from 'num_windows' windows of
+    'window_size' integers, sampled by 'method' ('random' or 'even').
+    'seed' makes random windows reproducible. Primes and candidates are tested
+    by 'backend'; 'sieve' only suits magnitudes up to about 10^14.
+    With workers > 1 the windows are processed in parallel.
+    Returns the estimate tables of results_from_counts.
+    """
+    lo = magnitude
+    hi = magnitude + (width if width is not None else magnitude)
+    offsets = tuple(sorted(offsets))
+    starts = window_starts(lo, hi, num_windows, window_size, method, seed)
+
+    print(f"\nSampling {num_windows:,} windows of {window_size:,} integers in [{lo:,}, {hi:,})...")
+    start_time = time.time()
+    counts = SampleCounts(offsets)
+    tasks = [(int(start), window_size, offsets, multiplier, backend) for start in starts]
+    with collecting(metrics):
+        if workers > 1:
+            with multiprocessing.Pool(workers) as pool:
+                for window_counts in pool.imap(_sample_window, tasks):
+                    counts.merge(window_counts)
+        else:
+            for start, *_ in tasks:
+                counts.add_window(start, window_block(start, start + window_size, offsets, multiplier,
+                                                      get_backend(backend)))
+    end_time = time.time()
+    print(f"Sampling complete: {int(counts.num_primes.sum()):,} primes. "
+          f"Time taken: {end_time - start_time:.2f} seconds.")
+    return results_from_counts(counts, lo, hi, window_size, method, confidence, multiplier)
+
+
+def save_to_csv(data, filename):
+    """
+    Saves the estimates to a CSV file, in the tables of exact_and_cumulative_results.py
+    and ending_digit_results.py with the confidence interval of every estimate.
+    """
+    try:
+        with open(filename, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+
+            writer.writerow(['Summary', 'Value'])
+            for key, value in data['Summary'].items():
+                writer.writerow([key, value])
+            writer.writerow([])
+
+            tables = [
+                ('Exact success count distribution', 'Offsets Succeeded', lambda key: key),
+                ('Cumulative success count distribution', 'Offsets Succeeded', lambda key: key),
+                ('Individual offset success counts', 'Offset', lambda key: offset_label(key, multiplier)),
+            ]
+            multiplier = data['Summary']['Multiplier']
+            for title, column, label in tables:
+                writer.writerow([title, '', '', '', ''])
+                writer.writerow([column, 'Count in Sample', 'Estimated Percentage', 'Lower Bound', 'Upper Bound'])
+                for key, (count, percentage, lower, upper) in data[title].items():
+                    writer.writerow([label(key), count, f'{percentage:.4f}%', f'{lower:.4f}%', f'{upper:.4f}%'])
+                writer.writerow([])
+
+            writer.writerow(['Prime Ending', 'Offset', 'Total Primes', 'Successful Primes',
+                             'Estimated Success Rate (%)', 'Lower Bound (%)', 'Upper Bound (%)'])
+            for ending_digit, offset_data in data['Ending digit success rates'].items():
+                for offset, values in offset_data.items():
+                    writer.writerow([
+                        f'ending_{ending_digit}',
+                        offset_label(offset, multiplier),
+                        values['total'],
+                        values['successful'],
+                        f"{values['success_rate']:.4f}",
+                        f"{values['lower']:.4f}",
+                        f"{values['upper']:.4f}"
+                    ])
+
+        print(f"\nResults successfully saved to {filename}")
+        print(f"File location: {os.path.abspath(filename)}")
+    except IOError as e:
+        print(f"An error occurred while writing the file: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Estimate the offset statistics at a large magnitude by sampling.")
+    parser.add_argument('--magnitude', type=int, default=10**15, help="sample the primes from this number on")
+    parser.add_argument('--width', type=int, help="width of the sampled range (default: the magnitude)")
+    parser.add_argument('--windows', type=int, default=DEFAULT_WINDOWS, help="number of windows")
+    parser.add_argument('--window-size', type=int, default=DEFAULT_WINDOW_SIZE, help="integers per window")
+    parser.add_argument('--method', choices=('random', 'even'), default='random', help="window placement")
+    parser.add_argument('--seed', type=int, help="random seed, for reproducible windows")
+    parser.add_argument('--offsets', type=int, nargs='+', default=SEVEN_SISTERS, help="offsets k to test")
+    parser.add_argument('--multiplier', type=int, default=2, help="the multiplier a (default: 2)")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='miller-rabin',
+                        help="how primes and candidates are tested (default: miller-rabin)")
+    parser.add_argument('--confidence', type=float, default=0.95, help="confidence level (default: 0.95)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--output', default='sampled_results.csv', help="CSV file for the estimates")
+    args = parser.parse_args()
+
+    results = sample_offsets(args.magnitude, args.width, args.windows, args.window_size, args.method, args.seed,
+                             args.offsets, args.multiplier, args.backend, args.workers, args.confidence)
+
+    print(f"\n{'Offset':<8} {'Estimate (%)':>13} {'Confidence interval (%)':>26}")
+    for offset, (_, percentage, lower, upper) in results['Individual offset success counts'].items():
+        print(f"{offset_label(offset, args.multiplier):<8} {percentage:>13.4f} {lower:>12.4f} - {upper:<12.4f}")
+    save_to_csv(results, args.output)
+
+
+if __name__ == "__main__":
+    main()
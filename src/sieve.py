@@ -0,0 +1,443 @@
+"""
+Shared prime sieve used by the Seven Sisters analysis scripts.
+
+Primality is stored as a packed bit array over the odd numbers only: bit i is
+set when 2*i + 1 is prime. At the 31,000,000 limit used in the note this takes
+under 2 MB, instead of a Python list of booleans plus a set of prime ints.
+"""
+import math
+
+import numpy as np
+
+from metrics import stage
+from prime_count import nth_prime_estimate, prime_count
+
+# Odd numbers per segment of the segmented sieve. One flag byte per odd number
+# keeps a segment at 256 KB, which fits in a typical L2 cache.
+DEFAULT_SEGMENT_SIZE = 1 << 18
+
+# Odd numbers per segment when PrimeSieve fills its packed array. Larger segments
+# cross off fewer slices per sieving prime, which outweighs the cache misses here.
+PACKED_SEGMENT_SIZE = 1 << 20
+
+
+def _sieve_odd_flags(limit):
+    """
+    Runs the Sieve of Eratosthenes over the odd numbers up to 'limit'.
+    Returns a boolean array where flags[i] is True if 2*i + 1 is prime.
+    Only used for limits within one segment; PrimeSieve sieves larger ones segment by segment.
+    """
+    flags = np.ones((limit + 1) // 2, dtype=bool)
+    if flags.size:
+        flags[0] = False  # 1 is not a prime number.
+
+    # Only odd factors up to the square root of the limit need to be crossed off.
+    for i in range(1, (math.isqrt(limit) - 1) // 2 + 1):
+        if flags[i]:
+            p = 2 * i + 1
+            # Index of p*p is p*p // 2, and consecutive odd multiples of p are p indices apart.
+            flags[p * p // 2::p] = False
+    return flags
+
+
+class PrimeSieve:
+    """
+    Bit-packed, odd-only primality table for every integer up to 'limit'.
+    Supports single lookups (is_prime, or the 'in' operator), vectorized
+    lookups over NumPy arrays, and extracting the primes as an array.
+    """
+
+    def __init__(self, limit):
+        if limit < 0:
+            raise ValueError(f"Sieve limit must be non-negative, got {limit}")
+        self.limit = limit
+        total = (limit + 1) // 2
+        if total <= PACKED_SEGMENT_SIZE:
+            self.bits = np.packbits(_sieve_odd_flags(limit), bitorder='little')
+            return
+        # Sieve one segment of flag bytes at a time straight into the packed array;
+        # segments hold a multiple of 8 odd numbers, so each fills whole bytes.
+        self.bits = np.empty((total + 7) // 8, dtype=np.uint8)
+        base_primes = PrimeSieve(math.isqrt(limit)).primes()
+        for i in range(0, total, PACKED_SEGMENT_SIZE):
+            j = min(i + PACKED_SEGMENT_SIZE, total)
+            # Odd numbers 2*i + 1 .. 2*j - 1.
+            _, flags = _segment_flags(2 * i + 1, 2 * j, base_primes)
+            self.bits[i // 8:(j + 7) // 8] = np.packbits(flags, bitorder='little')
+
+    @classmethod
+    def from_bits(cls, limit, bits):
+        """
+        Wraps an existing packed odd-only bit array, e.g. one memory-mapped from disk.
+        """
+        sieve = cls.__new__(cls)
+        sieve.limit = limit
+        sieve.bits = bits
+        return sieve
+
+    def __contains__(self, n):
+        return self.is_prime(n)
+
+    def is_prime(self, n):
+        """
+        Returns True if n is prime. Raises ValueError for n above the sieve limit.
+        """
+        n = int(n)
+        if n > self.limit:
+            raise ValueError(f"{n:,} is beyond the sieve limit of {self.limit:,}")
+        if n < 3 or n % 2 == 0:
+            return n == 2
+        i = n >> 1
+        return bool((self.bits[i >> 3] >> (i & 7)) & 1)
+
+    def is_prime_array(self, values):
+        """
+        Vectorized is_prime: returns a boolean array with the same shape as 'values'.
+        """
+        values = np.asarray(values, dtype=np.int64)
+        if values.size and values.max() > self.limit:
+            raise ValueError(f"{int(values.max()):,} is beyond the sieve limit of {self.limit:,}")
+
+        result = values == 2
+        odd = (values >= 3) & (values % 2 == 1)
+        i = values[odd] >> 1
+        result[odd] = ((self.bits[i >> 3] >> (i & 7).astype(np.uint8)) & 1).astype(bool)
+        return result
+
+    def window(self, lo, hi, base_primes=None, smallest_factors=None):
+        """
+        Returns a PrimeWindow for [lo, hi) read from the bit array, without sieving.
+        'smallest_factors' optionally supplies a full odd-only factor table to slice.
+        """
+        lo = max(lo, 0)
+        hi = max(hi, lo)
+        if hi - 1 > self.limit:
+            raise ValueError(f"{hi - 1:,} is beyond the sieve limit of {self.limit:,}")
+        first = max(lo, 1) | 1
+        count = max(0, (hi - first + 1) // 2)
+
+        # Unpack only the bytes holding the window's bits, then trim to the exact range.
+        start = first >> 1
+        packed = self.bits[start >> 3:(start + count + 7) >> 3]
+        skip = start & 7
+        flags = np.unpackbits(packed, bitorder='little')[skip:skip + count].astype(bool)
+        if smallest_factors is not None:
+            smallest_factors = smallest_factors[start:start + count]
+        return PrimeWindow(lo, hi, base_primes, flags=flags, smallest_factors=smallest_factors)
+
+    def primes(self):
+        """
+        Returns every prime up to the sieve limit as a sorted int64 array.
+        """
+        flags = np.unpackbits(self.bits, count=(self.limit + 1) // 2, bitorder='little')
+        odd_primes = 2 * np.flatnonzero(flags).astype(np.int64) + 1
+        if self.limit < 2:
+            return odd_primes
+        return np.concatenate((np.array([2], dtype=np.int64), odd_primes))
+
+    def count(self):
+        """
+        Returns the number of primes up to the sieve limit.
+        """
+        flags = np.unpackbits(self.bits, count=(self.limit + 1) // 2, bitorder='little')
+        return int(flags.sum()) + (1 if self.limit >= 2 else 0)
+
+
+class BasePrimes:
+    """
+    Sieving primes for the segmented sieve, grown on demand so that they always
+    reach the square root of the highest segment requested so far.
+    """
+
+    def __init__(self, primes=None):
+        self.limit = 0
+        self.primes = np.empty(0, dtype=np.int64)
+        if primes is not None and len(primes):
+            # Pre-computed sieving primes, e.g. shared between worker processes.
+            self.limit = int(primes[-1])
+            self.primes = primes
+
+    def ensure(self, hi):
+        """
+        Makes sure every prime p with p * p < hi is available.
+        """
+        needed = math.isqrt(max(hi - 1, 0))
+        if needed > self.limit:
+            # Grow geometrically so that a long stream only re-sieves a handful of times.
+            self.limit = max(needed, 2 * self.limit, 1 << 12)
+            self.primes = PrimeSieve(self.limit).primes()
+        return self.primes
+
+
+def _segment_flags(lo, hi, base_primes):
+    """
+    Sieves the odd numbers in [lo, hi). Returns the first odd number 'first' and
+    a boolean array where flags[j] is True if first + 2*j is prime.
+    """
+    first = max(lo, 1) | 1
+    flags = np.ones(max(0, (hi - first + 1) // 2), dtype=bool)
+    if flags.size == 0:
+        return first, flags
+    if first == 1:
+        flags[0] = False  # 1 is not a prime number.
+
+    primes = _sieving_primes(base_primes, hi)
+    # Primes at least as large as the segment have at most one multiple in it,
+    # so those are crossed off together instead of one slice per prime.
+    num_small = np.searchsorted(primes, flags.size)
+    for p in primes[:num_small].tolist():
+        flags[_first_multiple_index(p, first)::p] = False
+    large = primes[num_small:]
+    multiples = np.maximum(large * large, -(-first // large) * large)
+    multiples += large * (multiples % 2 == 0)
+    indices = (multiples - first) // 2
+    flags[indices[indices < flags.size]] = False
+    return first, flags
+
+
+def _sieving_primes(base_primes, hi):
+    """
+    Returns the odd base primes p with p * p < hi as an int64 array.
+    """
+    odd_primes = np.asarray(base_primes[1:], dtype=np.int64)
+    return odd_primes[:np.searchsorted(odd_primes, math.isqrt(max(hi - 1, 0)), side='right')]
+
+
+def _first_multiple_index(p, first):
+    """
+    Returns the flag index of the first odd multiple of p that is at least both
+    p * p and 'first', in a segment whose flags start at the odd number 'first'.
+    """
+    m = max(p * p, -(-first // p) * p)
+    if m % 2 == 0:
+        m += p
+    return (m - first) // 2
+
+
+def _segment_smallest_factors(first, size, hi, base_primes):
+    """
+    Computes the smallest prime factor of the odd numbers first, first + 2, ...
+    in a segment of 'size' numbers ending below 'hi'. Primes and 1 get 0.
+    Every factor is at most the square root of hi, so the array uses the
+    smallest unsigned dtype that holds it.
+    """
+    dtype = np.uint16 if math.isqrt(max(hi - 1, 0)) <= np.iinfo(np.uint16).max else np.uint32
+    factors = np.zeros(size, dtype=dtype)
+    primes = _sieving_primes(base_primes, hi)
+    num_small = np.searchsorted(primes, size)
+    # Mark from the largest small prime down, so the smallest factor is written last.
+    for p in reversed(primes[:num_small].tolist()):
+        factors[_first_multiple_index(p, first)::p] = p
+
+    # Larger primes have at most one multiple in the segment; they are marked
+    # together where no smaller prime did, the smallest of them for each number.
+    large = primes[num_small:]
+    multiples = np.maximum(large * large, -(-first // large) * large)
+    multiples += large * (multiples % 2 == 0)
+    indices = (multiples - first) // 2
+    inside = indices < size
+    indices, first_hits = np.unique(indices[inside], return_index=True)
+    unmarked = factors[indices] == 0
+    factors[indices[unmarked]] = large[inside][first_hits[unmarked]]
+    return factors
+
+
+class PrimeWindow:
+    """
+    Primality of every integer in [lo, hi), produced by one step of the
+    segmented sieve. Offers the same lookups as PrimeSieve for that range.
+    """
+
+    def __init__(self, lo, hi, base_primes, flags=None, smallest_factors=None):
+        self.lo = max(lo, 0)
+        self.hi = max(hi, self.lo)
+        self.base_primes = base_primes
+        if flags is None:
+            self.first, self.flags = _segment_flags(self.lo, self.hi, base_primes)
+        else:
+            # Flags already known, e.g. read from a cached bitmap.
+            self.first, self.flags = max(self.lo, 1) | 1, flags
+        self._smallest_factors = smallest_factors
+
+    def __contains__(self, n):
+        return self.is_prime(n)
+
+    def _check_range(self, lowest, highest):
+        if highest >= self.hi or (lowest < self.lo and highest >= 2):
+            raise ValueError(f"Values outside the sieved window [{self.lo:,}, {self.hi:,})")
+
+    def is_prime(self, n):
+        """
+        Returns True if n is prime. Values below 2 are never prime; any other
+        value must lie inside the window.
+        """
+        n = int(n)
+        if n < 2:
+            return False
+        self._check_range(n, n)
+        if n % 2 == 0:
+            return n == 2
+        return bool(self.flags[(n - self.first) // 2])
+
+    def is_prime_array(self, values):
+        """
+        Vectorized is_prime: returns a boolean array with the same shape as 'values'.
+        """
+        values = np.asarray(values, dtype=np.int64)
+        if values.size:
+            self._check_range(int(values[values >= 2].min(initial=self.hi - 1)), int(values.max()))
+
+        result = values == 2
+        odd = (values >= 3) & (values % 2 == 1)
+        result[odd] = self.flags[(values[odd] - self.first) // 2]
+        return result
+
+    def smallest_factors(self):
+        """
+        Returns the compact smallest-prime-factor table of the window: entry j
+        holds the smallest prime factor of first + 2*j, or 0 if it is prime.
+        Built on first use and kept with the window.
+        """
+        if self._smallest_factors is None:
+            self._smallest_factors = _segment_smallest_factors(
+                self.first, self.flags.size, self.hi, self.base_primes)
+        return self._smallest_factors
+
+    def smallest_prime_factor_array(self, values):
+        """
+        Returns the smallest prime factor of every value, or the value itself
+        for primes. Values below 2 have no prime factor and get 0.
+        """
+        values = np.asarray(values, dtype=np.int64)
+        if values.size:
+            self._check_range(int(values[values >= 2].min(initial=self.hi - 1)), int(values.max()))
+
+        result = np.where(values % 2 == 0, 2, 0).astype(np.int64)
+        result[values < 2] = 0
+        odd = (values >= 3) & (values % 2 == 1)
+        factors = self.smallest_factors()[(values[odd] - self.first) // 2].astype(np.int64)
+        result[odd] = np.where(factors == 0, values[odd], factors)
+        return result
+
+    def primes(self):
+        """
+        Returns every prime in the window as a sorted int64 array.
+        """
+        odd_primes = self.first + 2 * np.flatnonzero(self.flags).astype(np.int64)
+        if self.lo <= 2 < self.hi:
+            return np.concatenate((np.array([2], dtype=np.int64), odd_primes))
+        return odd_primes
+
+
+def sieve_window(lo, hi):
+    """
+    Sieves the integers in [lo, hi) with freshly computed sieving primes.
+    """
+    return PrimeWindow(lo, hi, BasePrimes().ensure(hi))
+
+
+def _make_window(lo, hi, base, source, backend=None):
+    """
+    Returns the window [lo, hi), read from 'source' (e.g. a PrimeCache) when it
+    covers the range, taken from 'backend' (e.g. Miller-Rabin) if one is given,
+    and sieved otherwise.
+    """
+    with stage('sieve', max(hi - lo, 0)):
+        if source is not None and hi - 1 <= source.limit:
+            return source.window(lo, hi)
+        if backend is not None:
+            return backend.window(lo, hi)
+        return PrimeWindow(lo, hi, base.ensure(hi))
+
+
+def iter_primes(start=2, stop=None, segment_size=DEFAULT_SEGMENT_SIZE, base_primes=None, source=None):
+    """
+    Yields the primes in [start, stop) as consecutive sorted int64 arrays, one
+    per sieve segment. With stop=None the stream never ends, and memory stays
+    bounded by the segment size plus the primes up to the square root of the
+    current position. 'base_primes' optionally supplies the sieving primes, and
+    'source' a pre-computed bitmap to read segments from where it reaches.
+    """
+    base = BasePrimes(base_primes)
+    lo = max(start, 0)
+    while stop is None or lo < stop:
+        hi = lo + 2 * segment_size
+        if stop is not None:
+            hi = min(hi, stop)
+        primes = _make_window(lo, hi, base, source).primes()
+        if primes.size:
+            yield primes
+        lo = hi
+
+
+def iter_prime_blocks(num_primes, min_offset, max_offset, multiplier=2, start=2, stop=None,
+                      segment_size=DEFAULT_SEGMENT_SIZE, base_primes=None, source=None, backend=None):
+    """
+    Streams the first 'num_primes' primes in [start, stop) in segment-sized
+    blocks (every prime in the range if num_primes is None). Each block is
+    yielded as (primes, window), where window is a PrimeWindow covering every
+    candidate multiplier * p + k for the block's primes and any offset k
+    between min_offset and max_offset. 'backend' optionally tests the
+    candidates instead of sieving their windows (see primality.py).
+    """
+    if num_primes is not None and num_primes <= 0:
+        return
+    base = BasePrimes(base_primes)
+    remaining = num_primes
+    for primes in iter_primes(start, stop, segment_size=segment_size, base_primes=base_primes, source=source):
+        if remaining is not None:
+            primes = primes[:remaining]
+            remaining -= primes.size
+
+        lo = multiplier * int(primes[0]) + min_offset
+        hi = multiplier * int(primes[-1]) + max_offset + 1
+        yield primes, _make_window(lo, hi, base, source, backend)
+        if remaining == 0:
+            return
+
+
+def nth_prime(n):
+    """
+    Returns the nth prime exactly, for n >= 1. Counts the primes up to an
+    estimate with prime_count, then sieves the short gap to the nth prime.
+    """
+    if n < 1:
+        raise ValueError(f"There is no prime number {n}")
+    x = nth_prime_estimate(n)
+    count = prime_count(x)
+    # Windows wide enough to hold the expected difference in one or two steps.
+    width = max(4096, int(1.5 * abs(n - count) * math.log(x + 2)))
+    if count >= n:
+        # The nth prime is at most x: step back from x.
+        hi = x + 1
+        while True:
+            primes = sieve_window(max(hi - width, 2), hi).primes()
+            if count - primes.size < n:
+                return int(primes[n - (count - primes.size) - 1])
+            count -= primes.size
+            hi -= width
+    lo = x + 1
+    while True:
+        primes = sieve_window(lo, lo + width).primes()
+        if count + primes.size >= n:
+            return int(primes[n - count - 1])
+        count += primes.size
+        lo += width
+
+
+def generate_primes_up_to(n):
+    """
+    Generates all primes up to a given number n using the shared sieve.
+    Returns a sorted int64 NumPy array.
+    """
+    return PrimeSieve(n).primes()
+
+
+def get_first_n_primes(n):
+    """
+    Generates the first n prime numbers as a sorted int64 NumPy array.
+    """
+    if n <= 0:
+        return np.empty(0, dtype=np.int64)
+    # Sieve exactly up to the nth prime.
+    return generate_primes_up_to(nth_prime(n))
@@ -0,0 +1,355 @@
+"""
+Columnar store of the success of every offset for every prime.
+
+A store is a directory with two NumPy arrays of equal length and a small
+description of them:
+
+* 'primes.npy'  - the primes p, sorted, int64
+* 'masks.npy'   - one bitmask per prime: bit i is set if the candidate for
+                  the i-th offset is prime (uint8 for up to eight offsets)
+* 'store.json'  - the offsets (in bit order), the multiplier and the count
+
+The arrays are memory-mapped when opened, so ad-hoc questions over a large
+run are answered with vectorized mask operations, without sieving again.
+
+While a run goes on, the primes and masks of every block are appended to part
+files in the store directory, one pair per contiguous range of primes, and the
+counts only keep the names and lengths of the parts. At the end the parts are
+appended to the two arrays, whose headers leave room for them to grow. So
+neither the run nor its checkpoints hold the primes, and a run extended from
+its checkpoint only appends its new primes.
+"""
+import argparse
+import functools
+import glob
+import json
+import os
+
+import numpy as np
+
+from offsets import SEVEN_SISTERS, offset_label
+
+# Entries copied at a time when the parts are joined into the store's arrays.
+COPY_CHUNK = 1 << 22
+
+# Set bits in every byte value, for counting the successes in a mask.
+_POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint8)
+
+
+def mask_dtype(num_offsets):
+    """
+    Returns the smallest unsigned integer type with a bit for every offset.
+    """
+    for dtype in (np.uint8, np.uint16, np.uint32, np.uint64):
+        if num_offsets <= 8 * np.dtype(dtype).itemsize:
+            return np.dtype(dtype)
+    raise ValueError(f"A success mask holds at most 64 offsets, not {num_offsets}")
+
+
+def success_masks(success):
+    """
+    Packs a boolean (primes x offsets) matrix into one bitmask per prime.
+    """
+    dtype = mask_dtype(success.shape[1])
+    packed = np.packbits(success, axis=1, bitorder='little')
+    padded = np.zeros((success.shape[0], dtype.itemsize), dtype=np.uint8)
+    padded[:, :packed.shape[1]] = packed
+    return padded.view(dtype.newbyteorder('<')).ravel().astype(dtype)
+
+
+class SuccessMaskCounts:
+    """
+    Collects the primes and their success masks for one contiguous range of
+    primes into part files in the store directory 'path'. Ranges are appended
+    in order with merge().
+    """
+
+    def __init__(self, offsets=SEVEN_SISTERS, path=None):
+        if path is None:
+            raise ValueError("A success store needs a directory to write its parts to")
+        self.offsets = offsets
+        self.path = path
+        self.dtype = mask_dtype(len(offsets))
+        # (name, number of primes) of every part, in range order.
+        self.parts = []
+        # Whether the blocks of this object are being appended to the last part.
+        self._appending = False
+
+    @property
+    def settings(self):
+        """
+        The store directory, which a checkpoint can only be resumed with (see checkpoint.py).
+        """
+        return {'path': os.path.abspath(self.path)}
+
+    def _part_files(self, name):
+        return {'primes': os.path.join(self.path, name + '.primes'), 'masks': os.path.join(self.path, name + '.masks')}
+
+    def update(self, block):
+        """
+        Appends one OffsetBlock of primes and the masks of their successes to the current part.
+        """
+        columns = {'primes': block.primes.astype(np.int64), 'masks': success_masks(block.success)}
+        if self._appending and not os.path.exists(self._part_files(self.parts[-1][0])['primes']):
+            # Resumed after the run ended: results_from_counts has joined the part and removed it.
+            self._appending = False
+        if not self._appending:
+            # Parts are named after their first prime, which no other range shares.
+            os.makedirs(self.path, exist_ok=True)
+            self.parts.append((f"part-{int(block.primes[0])}", 0))
+            self._appending = True
+        name, count = self.parts[-1]
+        for column, path in self._part_files(name).items():
+            values = columns[column]
+            if count and os.path.getsize(path) < count * values.itemsize:
+                raise ValueError(f"'{path}' holds fewer than the {count:,} entries saved with the counts")
+            with open(path, 'ab') as f:
+                # A run resumed from a checkpoint drops what was written after it.
+                f.truncate(count * values.itemsize)
+                f.write(values.tobytes())
+        self.parts[-1] = (name, count + block.primes.size)
+
+    def merge(self, other):
+        """
+        Appends the parts of the following range.
+        """
+        self.parts.extend(other.parts)
+        self._appending = False
+        return self
+
+
+def _open_array(path, dtype, count):
+    """
+    Opens the one-dimensional .npy array at 'path' for appending after its
+    first 'count' entries, creating it if count is 0. Returns the file and the
+    offset of the data.
+    """
+    if count == 0:
+        f = open(path, 'w+b')
+        _write_header(f, dtype, 0)
+    else:
+        f = open(path, 'r+b')
+        version = np.lib.format.read_magic(f)
+        read_header = np.lib.format.read_array_header_1_0 if version == (1, 0) else np.lib.format.read_array_header_2_0
+        shape, _, stored_dtype = read_header(f)
+        if stored_dtype != dtype or shape[0] < count:
+            raise ValueError(f"'{path}' does not start with {count:,} entries of {dtype}")
+    offset = f.tell()
+    f.truncate(offset + count * dtype.itemsize)
+    f.seek(0, os.SEEK_END)
+    return f, offset
+
+
+def _write_header(f, dtype, length):
+    # The header is padded for the length to grow, so rewriting it never moves the data.
+    f.seek(0)
+    np.lib.format.write_array_header_1_0(f, {'descr': np.lib.format.dtype_to_descr(dtype), 'fortran_order': False,
+                                             'shape': (length,)})
+
+
+def results_from_counts(counts):
+    """
+    Appends the parts collected by SuccessMaskCounts to the arrays of the store
+    in their directory, a chunk at a time, removes the parts and returns the
+    store, memory-mapped. Parts that are gone were appended by an earlier call,
+    before the run was extended from its checkpoint; the store must hold
+    exactly those.
+    """
+    os.makedirs(counts.path, exist_ok=True)
+    joined = 0
+    first = 0
+    while first < len(counts.parts) and not os.path.exists(counts._part_files(counts.parts[first][0])['primes']):
+        joined += counts.parts[first][1]
+        first += 1
+    if first > 0:
+        with open(os.path.join(counts.path, 'store.json')) as f:
+            stored = json.load(f)['count']
+        if stored != joined:
+            raise ValueError(f"'{counts.path}' holds {stored:,} primes, but the parts already appended hold {joined:,}")
+    total = sum(count for _, count in counts.parts)
+
+    for column, dtype in (('primes', np.dtype(np.int64)), ('masks', counts.dtype)):
+        f, offset = _open_array(os.path.join(counts.path, f'{column}.npy'), dtype, joined)
+        with f:
+            for name, count in counts.parts[first:]:
+                part = np.memmap(counts._part_files(name)[column], dtype=dtype, mode='r', shape=(count,))
+                for i in range(0, count, COPY_CHUNK):
+                    f.write(part[i:i + COPY_CHUNK].tobytes())
+                del part
+            _write_header(f, dtype, total)
+            if f.tell() != offset:
+                raise ValueError(f"The header of '{f.name}' changed size")
+    # The description is written last: until then the store still describes what it held before.
+    _write_description(counts.path, counts.offsets, 2, total)
+
+    # Parts written after the last checkpoint of an interrupted run are not listed, so remove them all.
+    for path in glob.glob(os.path.join(counts.path, 'part-*')):
+        os.remove(path)
+    return SuccessStore.open(counts.path)
+
+
+def store_report(path):
+    """
+    Returns the counts factory for a success store written to 'path', e.g. for the engine.
+    """
+    return functools.partial(SuccessMaskCounts, path=path)
+
+
+def _write_description(path, offsets, multiplier, count):
+    with open(os.path.join(path, 'store.json'), 'w') as f:
+        json.dump({'offsets': [int(k) for k in offsets], 'multiplier': multiplier, 'count': int(count)}, f, indent=2)
+
+
+def save_store(store, path):
+    """
+    Writes a SuccessStore to the directory 'path'.
+    """
+    os.makedirs(path, exist_ok=True)
+    np.save(os.path.join(path, 'primes.npy'), store.primes)
+    np.save(os.path.join(path, 'masks.npy'), store.masks)
+    _write_description(path, store.offsets, store.multiplier, store.primes.size)
+    print(f"\nSuccess store with {store.primes.size:,} primes saved to {os.path.abspath(path)}")
+
+
+class SuccessStore:
+    """
+    The primes of a run with the success mask of each, and queries over them.
+    Every selection returns another SuccessStore over the matching primes.
+    """
+
+    def __init__(self, primes, masks, offsets=SEVEN_SISTERS, multiplier=2):
+        self.primes = primes
+        self.masks = masks
+        self.offsets = tuple(offsets)
+        self.multiplier = multiplier
+
+    @classmethod
+    def open(cls, path):
+        """
+        Memory-maps the store saved in the directory 'path'.
+        """
+        with open(os.path.join(path, 'store.json')) as f:
+            description = json.load(f)
+        primes = np.load(os.path.join(path, 'primes.npy'), mmap_mode='r')
+        masks = np.load(os.path.join(path, 'masks.npy'), mmap_mode='r')
+        return cls(primes, masks, description['offsets'], description['multiplier'])
+
+    def __len__(self):
+        return self.primes.size
+
+    def bits(self, *offsets):
+        """
+        Returns the mask with the bits of the given offsets set.
+        """
+        mask = 0
+        for k in offsets:
+            if k not in self.offsets:
+                raise ValueError(f"Offset {k} is not in the store, which holds {list(self.offsets)}")
+            mask |= 1 << self.offsets.index(k)
+        return self.masks.dtype.type(mask)
+
+    def select(self, ending_digit=None, min_prime=None, max_prime=None, modulus=None, residue=None,
+               all_of=(), none_of=()):
+        """
+        Returns the primes p with min_prime <= p <= max_prime, ending in 'ending_digit',
+        with p % modulus == residue, whose candidates are prime for every offset
+        in 'all_of' and for none in 'none_of'. Unset criteria are ignored.
+        """
+        # The primes are sorted, so a value range is a slice of the arrays.
+        lo = 0 if min_prime is None else np.searchsorted(self.primes, min_prime, side='left')
+        hi = len(self) if max_prime is None else np.searchsorted(self.primes, max_prime, side='right')
+        primes = self.primes[lo:hi]
+        masks = self.masks[lo:hi]
+
+        keep = None
+        if ending_digit is not None:
+            keep = primes % 10 == ending_digit
+        if modulus is not None:
+            keep = _both(keep, primes % modulus == residue)
+        if all_of:
+            required = self.bits(*all_of)
+            keep = _both(keep, masks & required == required)
+        if none_of:
+            keep = _both(keep, masks & self.bits(*none_of) == 0)
+        if keep is not None:
+            primes, masks = primes[keep], masks[keep]
+        return SuccessStore(primes, masks, self.offsets, self.multiplier)
+
+    def count(self, all_of=(), any_of=()):
+        """
+        Counts the primes whose candidates are prime for every offset in
+        'all_of' and for at least one in 'any_of'.
+        """
+        keep = np.ones(len(self), dtype=bool)
+        if all_of:
+            required = self.bits(*all_of)
+            keep &= self.masks & required == required
+        if any_of:
+            keep &= self.masks & self.bits(*any_of) != 0
+        return int(np.count_nonzero(keep))
+
+    def success_counts(self):
+        """
+        Returns {offset: number of primes whose candidate for it is prime}.
+        """
+        return {k: int(np.count_nonzero(self.masks & self.bits(k))) for k in self.offsets}
+
+    def num_successes(self):
+        """
+        Returns the number of successful offsets of every prime.
+        """
+        size = self.masks.dtype.itemsize
+        as_bytes = np.ascontiguousarray(self.masks).view(np.uint8).reshape(-1, size)
+        return _POPCOUNT[as_bytes].sum(axis=1, dtype=np.int64)
+
+    def success_histogram(self):
+        """
+        Returns an array whose entry n counts the primes with exactly n successful offsets.
+        """
+        return np.bincount(self.num_successes(), minlength=len(self.offsets) + 1)
+
+    def joint_counts(self):
+        """
+        Returns the (offsets x offsets) matrix counting the primes whose candidates
+        for both offsets are prime; the diagonal holds the success counts.
+        """
+        bits = np.stack([self.masks & self.bits(k) != 0 for k in self.offsets], axis=1).astype(np.int64)
+        return bits.T @ bits
+
+    def pattern_counts(self):
+        """
+        Returns {mask: number of primes} for every success pattern that occurs.
+        """
+        patterns, counts = np.unique(self.masks, return_counts=True)
+        return {int(pattern): int(count) for pattern, count in zip(patterns, counts)}
+
+    def describe(self, mask):
+        """
+        Returns the labels of the offsets whose bits are set in 'mask'.
+        """
+        return [offset_label(k, self.multiplier) for i, k in enumerate(self.offsets) if mask >> i & 1]
+
+
+def _both(keep, condition):
+    return condition if keep is None else keep & condition
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query a success store written by the engine.")
+    parser.add_argument('path', help="store directory")
+    parser.add_argument('--ending-digit', type=int, help="only primes ending in this digit")
+    parser.add_argument('--min-prime', type=int, help="only primes from this value")
+    parser.add_argument('--max-prime', type=int, help="only primes up to this value")
+    parser.add_argument('--all-of', type=int, nargs='+', default=(), help="count primes where all these offsets succeed")
+    args = parser.parse_args()
+
+    store = SuccessStore.open(args.path).select(args.ending_digit, args.min_prime, args.max_prime)
+    print(f"{len(store):,} primes selected")
+    for k, count in store.success_counts().items():
+        print(f"{offset_label(k, store.multiplier)}: {count:,}")
+    if args.all_of:
+        print(f"All of {list(args.all_of)}: {store.count(all_of=args.all_of):,}")
+
+
+if __name__ == "__main__":
+    main()
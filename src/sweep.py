@@ -0,0 +1,171 @@
+"""
+Offset sweep: tests a whole range of offsets k, for candidates a * p + k, in one pass.
+
+All offsets share the stream of primes, the candidate generation and the
+primality lookups, so sweeping a hundred offsets costs about as much as a
+single run. The result is one row of statistics per offset, which shows
+whether the Seven Sisters offsets stand out from their neighbours.
+"""
+import argparse
+import csv
+import functools
+import os
+import time
+
+import numpy as np
+
+from offsets import SEVEN_SISTERS, offset_label
+from parallel import run_sharded
+from primality import BACKENDS
+
+
+def offset_range(k_min, k_max, step=2):
+    """
+    Returns the offsets k_min, k_min + step, ... up to k_max as a tuple.
+    With the default step, an odd k_min gives every odd offset in the range.
+    """
+    return tuple(range(k_min, k_max + 1, step))
+
+
+class SweepCounts:
+    """
+    Mergeable per-offset counters for a sweep over one contiguous range of primes.
+    """
+
+    def __init__(self, offsets):
+        self.offsets = offsets
+        self.num_primes = 0
+        self.successes = np.zeros(len(offsets), dtype=np.int64)
+        self.multiples_of_3 = np.zeros(len(offsets), dtype=np.int64)
+        self.multiples_of_5 = np.zeros(len(offsets), dtype=np.int64)
+        self.not_multiples_of_3_or_5 = np.zeros(len(offsets), dtype=np.int64)
+
+    def update(self, block):
+        """
+        Adds one OffsetBlock of primes and the primality of their candidates.
+        """
+        candidates = block.candidates
+        is_multiple_of_3 = (candidates % 3 == 0) & (candidates != 3)
+        is_multiple_of_5 = (candidates % 5 == 0) & (candidates != 5)
+
+        self.num_primes += block.primes.size
+        self.successes += block.success.sum(axis=0)
+        self.multiples_of_3 += is_multiple_of_3.sum(axis=0)
+        self.multiples_of_5 += is_multiple_of_5.sum(axis=0)
+        self.not_multiples_of_3_or_5 += (~is_multiple_of_3 & ~is_multiple_of_5).sum(axis=0)
+
+    def merge(self, other):
+        """
+        Adds the counts of another range.
+        """
+        self.num_primes += other.num_primes
+        self.successes += other.successes
+        self.multiples_of_3 += other.multiples_of_3
+        self.multiples_of_5 += other.multiples_of_5
+        self.not_multiples_of_3_or_5 += other.not_multiples_of_3_or_5
+        return self
+
+
+def results_from_counts(counts, multiplier=2):
+    """
+    Returns one dictionary of statistics per offset, in offset order.
+    """
+    rows = []
+    for j, k in enumerate(counts.offsets):
+        successes = int(counts.successes[j])
+        not_multiples = int(counts.not_multiples_of_3_or_5[j])
+        rows.append({
+            'offset': k,
+            'label': offset_label(k, multiplier),
+            'seven_sister': multiplier == 2 and k in SEVEN_SISTERS,
+            'primes': counts.num_primes,
+            'successes': successes,
+            'success_rate': successes / counts.num_primes * 100 if counts.num_primes else 0.0,
+            'multiples_of_3': int(counts.multiples_of_3[j]),
+            'multiples_of_5': int(counts.multiples_of_5[j]),
+            'not_multiples_of_3_or_5': not_multiples,
+            'filtered_success_rate': successes / not_multiples * 100 if not_multiples else 0.0,
+        })
+    return rows
+
+
+def run_sweep(num_primes_to_check=1_000_000, offsets=offset_range(-99, 99), multiplier=2, workers=1,
+              cache_path=None, start=2, backend='sieve'):
+    """
+    Tests every offset k on the candidates multiplier * p + k for the first
+    'num_primes_to_check' primes from 'start', in a single pass.
+    Returns the per-offset rows of results_from_counts.
+    """
+    offsets = tuple(sorted(offsets))
+    print(f"\nSweeping {len(offsets)} offsets of {multiplier}p + k over {num_primes_to_check:,} primes...")
+    start_time = time.time()
+    counts = run_sharded(functools.partial(SweepCounts, offsets), num_primes_to_check, workers, cache_path,
+                         start, backend, multiplier)
+    end_time = time.time()
+    print(f"Sweep complete. Time taken: {end_time - start_time:.2f} seconds.")
+    return results_from_counts(counts, multiplier)
+
+
+def save_to_csv(rows, filename):
+    """
+    Saves the sweep as a table with one row per offset.
+    """
+    try:
+        with open(filename, 'w', newline='') as csvfile:
+            writer = csv.writer(csvfile)
+            writer.writerow([
+                'Offset',
+                'Candidate',
+                'Seven Sister',
+                'Total Primes',
+                'Successful Primes',
+                'Success Rate (%)',
+                'Multiples of 3',
+                'Multiples of 5',
+                'Not a Multiple of 3 and/or 5',
+                'Success Rate Excluding Multiples of 3 and 5 (%)'
+            ])
+            for row in rows:
+                writer.writerow([
+                    row['offset'],
+                    row['label'],
+                    'yes' if row['seven_sister'] else 'no',
+                    row['primes'],
+                    row['successes'],
+                    f"{row['success_rate']:.4f}",
+                    row['multiples_of_3'],
+                    row['multiples_of_5'],
+                    row['not_multiples_of_3_or_5'],
+                    f"{row['filtered_success_rate']:.4f}"
+                ])
+
+        print(f"\nResults successfully saved to {filename}")
+        print(f"File location: {os.path.abspath(filename)}")
+    except IOError as e:
+        print(f"An error occurred while writing the file: {e}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Test a whole range of offsets k of a * p + k in one pass.")
+    parser.add_argument('--primes', type=int, default=1_000_000, help="number of primes to analyze")
+    parser.add_argument('--k-min', type=int, default=-99, help="smallest offset (default: -99)")
+    parser.add_argument('--k-max', type=int, default=99, help="largest offset (default: 99)")
+    parser.add_argument('--k-step', type=int, default=2, help="step between offsets (default: 2)")
+    parser.add_argument('--offsets', type=int, nargs='+', help="explicit offsets, instead of a range")
+    parser.add_argument('--multiplier', type=int, default=2, help="the multiplier a (default: 2)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--cache', help="prime cache file to read instead of sieving")
+    parser.add_argument('--start', type=int, default=2, help="analyze the primes from this number on")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='sieve',
+                        help="how candidates are tested for primality (default: sieve)")
+    parser.add_argument('--output', default='offset_sweep.csv', help="CSV file for the table")
+    args = parser.parse_args()
+
+    offsets = args.offsets or offset_range(args.k_min, args.k_max, args.k_step)
+    rows = run_sweep(args.primes, offsets, args.multiplier, workers=args.workers, cache_path=args.cache,
+                     start=args.start, backend=args.backend)
+    save_to_csv(rows, args.output)
+
+
+if __name__ == "__main__":
+    main()
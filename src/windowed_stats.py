@@ -0,0 +1,393 @@
+"""
+Windowed streaming statistics: how the success rates change with the size of p.
+
+Instead of one table over the whole run, the primes are split into windows,
+either of a fixed number of primes counted from the first prime of the run, or
+logarithmic bins of p, and each window
+gets its own counts: for every offset and ending digit of p, the primes, the
+successful candidates and the candidates that are not multiples of 3 or 5.
+Finished windows are appended to a CSV time series as the run progresses and
+dropped from memory, so memory use does not grow with the range analyzed. In a
+parallel run with windows of a fixed number of primes, every shard also keeps
+its blocks, at about 3 bytes per prime, until it is merged; shards are capped at
+MAX_SHARD_PRIMES primes for that.
+
+    python src/windowed_stats.py --primes 10000000 --window-primes 100000
+    python src/windowed_stats.py --start 1000000 --primes 10000000 --bins-per-decade 20
+"""
+import argparse
+import csv
+import functools
+import math
+import os
+import time
+
+import numpy as np
+
+from metrics import collecting, stage
+from offsets import SEVEN_SISTERS, count_by_class, offset_label, residue_divisibility
+from parallel import run_sharded
+from primality import BACKENDS
+
+DEFAULT_WINDOW_PRIMES = 100_000
+
+# Primes per shard of a parallel run with windows of a fixed number of primes.
+# A shard keeps its blocks, at about 3 bytes per prime, until it is merged.
+MAX_SHARD_PRIMES = 10_000_000
+
+# Divisibility of 2p + k by 3 and 5, and the last digit of p, only depend on p mod 30.
+RESIDUE_MODULUS = 30
+
+# Primes are classed by their last digit; class 10 holds the primes 2 and 5.
+NUM_CLASSES = 11
+
+# The class of p for each residue mod 30. Residues 2 and 5 only hold the primes 2 and 5.
+DIGIT_OF_RESIDUE = np.where(np.isin(np.arange(RESIDUE_MODULUS), (2, 5)), 10, np.arange(RESIDUE_MODULUS) % 10)
+
+# The ending digits with a row of their own in every window, after the row over all primes.
+ENDING_DIGITS = (1, 3, 7, 9)
+
+HEADER = [
+    'Window',
+    'First Prime',
+    'Last Prime',
+    'Prime Ending',
+    'Offset',
+    'Total Primes',
+    'Successful Primes',
+    'Success Rate (%)',
+    'Not a Multiple of 3 and/or 5',
+    'Success Rate Excluding Multiples of 3 and 5 (%)'
+]
+
+
+def log_window_start(index, bins_per_decade):
+    """
+    Returns the smallest integer in logarithmic window 'index', which covers
+    the integers from 10^(index / bins_per_decade) up to the next window.
+    """
+    return math.ceil(10 ** (index / bins_per_decade))
+
+
+def log_window(n, bins_per_decade):
+    """
+    Returns the index of the logarithmic window holding the integer n.
+    """
+    index = math.floor(bins_per_decade * math.log10(n))
+    # Correct for rounding in the logarithm.
+    while log_window_start(index + 1, bins_per_decade) <= n:
+        index += 1
+    while log_window_start(index, bins_per_decade) > n:
+        index -= 1
+    return index
+
+
+class WindowStats:
+    """
+    The counts of one window, indexed by class of p (its last digit) and offset.
+    """
+
+    def __init__(self, num_offsets):
+        self.first_prime = None
+        self.last_prime = None
+        self.totals = np.zeros(NUM_CLASSES, dtype=np.int64)
+        self.successes = np.zeros((NUM_CLASSES, num_offsets), dtype=np.int64)
+        self.not_multiples_of_3_or_5 = np.zeros((NUM_CLASSES, num_offsets), dtype=np.int64)
+
+    def merge(self, other):
+        """
+        Adds the counts of the following part of the window.
+        """
+        if self.first_prime is None:
+            self.first_prime = other.first_prime
+        if other.last_prime is not None:
+            self.last_prime = other.last_prime
+        self.totals += other.totals
+        self.successes += other.successes
+        self.not_multiples_of_3_or_5 += other.not_multiples_of_3_or_5
+        return self
+
+
+class WindowedCounts:
+    """
+    Mergeable per-window counts for one contiguous range of primes. Windows
+    hold 'window_primes' primes each, counted from the first prime of the run,
+    or with 'bins_per_decade' are logarithmic bins of p. Exactly one of the two
+    must be given.
+
+    A range does not know how many primes of the run come before it, so with
+    windows of a fixed number of primes its blocks are kept compactly until it
+    is placed: the first range of a run is placed at prime 0 when it is merged
+    into or written out (see place), and every following range is merged into it.
+    Parallel runs then hold shards of at most MAX_SHARD_PRIMES primes.
+    """
+
+    def __init__(self, offsets=SEVEN_SISTERS, window_primes=None, bins_per_decade=None, multiplier=2):
+        if (window_primes is None) == (bins_per_decade is None):
+            raise ValueError("Give either window_primes or bins_per_decade")
+        self.offsets = offsets
+        self.multiplier = multiplier
+        self.windowing = ('primes', window_primes) if window_primes is not None else ('log10', bins_per_decade)
+        self.settings = {'windowing': list(self.windowing)}
+        self.max_shard_primes = MAX_SHARD_PRIMES if window_primes is not None else None
+        # Window index -> WindowStats, in window order. Windows are removed once written out.
+        self.windows = {}
+        # The last window written out and removed, if any.
+        self.written = None
+        # For windows of a fixed number of primes: the number of primes of the run
+        # before the next prime, once the range is placed.
+        self.next_index = None
+        # Blocks waiting to be placed, as (first prime, gaps to the following primes,
+        # successes packed into bits, successes that are the primes 3 and 5 themselves).
+        self.pending = []
+
+        # Which candidates are multiples of 3 or 5 only depends on p mod 30, and a
+        # (residue x class) matrix sums residue counts into ending-digit classes.
+        is_multiple = (residue_divisibility(RESIDUE_MODULUS, 3, offsets, multiplier)
+                       | residue_divisibility(RESIDUE_MODULUS, 5, offsets, multiplier))
+        self._not_multiple_table = (~is_multiple).astype(np.int64)
+        self._class_matrix = (DIGIT_OF_RESIDUE[:, None] == np.arange(NUM_CLASSES)[None, :]).astype(np.int64)
+
+    def _window_ids(self, primes):
+        kind, size = self.windowing
+        if kind == 'primes':
+            ids = (self.next_index + np.arange(primes.size, dtype=np.int64)) // size
+            self.next_index += primes.size
+            return ids
+        first = log_window(int(primes[0]), size)
+        last = log_window(int(primes[-1]), size)
+        starts = np.array([log_window_start(i, size) for i in range(first + 1, last + 1)], dtype=np.int64)
+        return first + np.searchsorted(starts, primes, side='right')
+
+    def update(self, block):
+        """
+        Adds one OffsetBlock of primes and the primality of their candidates.
+        """
+        # The candidates 3 and 5 themselves are prime, not multiples; only the
+        # smallest primes can produce them.
+        num_small = np.searchsorted(block.primes, (5 - min(self.offsets)) // self.multiplier, side='right')
+        small = block.candidates[:num_small]
+        small_primes = (small == 3) | (small == 5)
+
+        if self.windowing[0] == 'primes' and self.next_index is None:
+            # Prime gaps stay far below 2^16 wherever an int64 reaches.
+            self.pending.append((int(block.primes[0]), np.diff(block.primes).astype(np.uint16),
+                                 np.packbits(block.success, axis=1), small_primes))
+        else:
+            self._count(block.primes, block.success, small_primes)
+
+    def place(self):
+        """
+        Places a range that starts the run at prime 0, counting the blocks it holds.
+        """
+        if self.windowing[0] != 'primes' or self.next_index is not None:
+            return
+        self.next_index = 0
+        self._count_pending(self.pending)
+        self.pending = []
+
+    def _count_pending(self, pending):
+        for first_prime, gaps, packed, small_primes in pending:
+            primes = first_prime + np.concatenate(([0], np.cumsum(gaps, dtype=np.int64)))
+            success = np.unpackbits(packed, axis=1, count=len(self.offsets)).astype(bool)
+            self._count(primes, success, small_primes)
+
+    def _count(self, primes, success, small_primes):
+        num_offsets = len(self.offsets)
+        ids = self._window_ids(primes)
+        first = int(ids[0])
+        local = ids - first
+        num_windows = int(local[-1]) + 1
+
+        # Count every window of the block at once, with (window, class) as the class id.
+        residues = primes % RESIDUE_MODULUS
+        classes = local * NUM_CLASSES + DIGIT_OF_RESIDUE[residues]
+        totals = np.bincount(classes, minlength=num_windows * NUM_CLASSES).reshape(num_windows, NUM_CLASSES)
+        successes = count_by_class(classes, success, num_windows * NUM_CLASSES)
+        successes = successes.reshape(num_windows, NUM_CLASSES, num_offsets)
+
+        residue_counts = np.bincount(local * RESIDUE_MODULUS + residues, minlength=num_windows * RESIDUE_MODULUS)
+        residue_counts = residue_counts.reshape(num_windows, RESIDUE_MODULUS)
+        not_multiples = self._class_matrix.T @ (residue_counts[:, :, None] * self._not_multiple_table)
+        if small_primes.size:
+            fix = count_by_class(classes[:small_primes.shape[0]], small_primes, num_windows * NUM_CLASSES)
+            not_multiples += fix.reshape(num_windows, NUM_CLASSES, num_offsets)
+
+        ends = np.searchsorted(local, np.arange(num_windows), side='right')
+        begin = 0
+        for w in range(num_windows):
+            end = ends[w]
+            if end == begin:
+                continue
+            stats = self.windows.get(first + w)
+            if stats is None:
+                stats = self.windows[first + w] = WindowStats(num_offsets)
+                stats.first_prime = int(primes[begin])
+            stats.last_prime = int(primes[end - 1])
+            stats.totals += totals[w]
+            stats.successes += successes[w]
+            stats.not_multiples_of_3_or_5 += not_multiples[w]
+            begin = end
+
+    def merge(self, other):
+        """
+        Adds the windows of the following range; a window split between the two
+        ranges is joined. With windows of a fixed number of primes, this range
+        is placed first if it is not yet, and the blocks of the other are counted
+        in after its primes.
+        """
+        self.place()
+        self._count_pending(other.pending)
+        for index, stats in other.windows.items():
+            if index in self.windows:
+                self.windows[index].merge(stats)
+            else:
+                self.windows[index] = stats
+        return self
+
+    def pop_finished(self):
+        """
+        Removes and returns (index, WindowStats) for every finished window: all
+        but the last one, which later primes may still fall into. Places the range first (see place).
+        """
+        self.place()
+        if not self.windows:
+            return []
+        last = max(self.windows)
+        finished = [(index, self.windows.pop(index)) for index in list(self.windows) if index < last]
+        if finished:
+            self.written = finished[-1][0]
+        return finished
+
+
+def window_rows(index, stats, offsets, multiplier=2):
+    """
+    Returns the CSV rows of one window: over all primes, then per ending digit, for every offset.
+    """
+    groups = [('all', stats.totals.sum(), stats.successes.sum(axis=0), stats.not_multiples_of_3_or_5.sum(axis=0))]
+    for digit in ENDING_DIGITS:
+        groups.append((f'ending_{digit}', stats.totals[digit], stats.successes[digit],
+                       stats.not_multiples_of_3_or_5[digit]))
+
+    rows = []
+    for ending, total, successes, not_multiples in groups:
+        for j, k in enumerate(offsets):
+            successful = int(successes[j])
+            eligible = int(not_multiples[j])
+            rows.append([
+                index,
+                stats.first_prime,
+                stats.last_prime,
+                ending,
+                offset_label(k, multiplier),
+                int(total),
+                successful,
+                f"{successful / total * 100 if total else 0.0:.4f}",
+                eligible,
+                f"{successful / eligible * 100 if eligible else 0.0:.4f}"
+            ])
+    return rows
+
+
+class TimeSeriesWriter:
+    """
+    Appends the finished windows of a WindowedCounts to a CSV file as a run progresses.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.num_windows = 0
+        self._started = False
+
+    def _start(self, counts):
+        # A resumed run keeps the rows of the windows written before its checkpoint.
+        # Later rows belong to windows the checkpoint still holds, and are written again.
+        rows = []
+        if counts.written is not None and os.path.exists(self.path):
+            with open(self.path, newline='') as f:
+                rows = [row for row in list(csv.reader(f))[1:] if int(row[0]) <= counts.written]
+        with open(self.path, 'w', newline='') as f:
+            writer = csv.writer(f)
+            writer.writerow(HEADER)
+            writer.writerows(rows)
+        self._started = True
+
+    def _append(self, counts, windows):
+        if not windows:
+            return
+        with stage('timeseries_write', len(windows)):
+            with open(self.path, 'a', newline='') as f:
+                writer = csv.writer(f)
+                for index, stats in windows:
+                    writer.writerows(window_rows(index, stats, counts.offsets, counts.multiplier))
+        self.num_windows += len(windows)
+
+    def write_finished(self, counts):
+        """
+        Writes the finished windows and removes them from the counts.
+        """
+        if not self._started:
+            self._start(counts)
+        self._append(counts, counts.pop_finished())
+
+    def write_rest(self, counts):
+        """
+        Writes the windows still held at the end of a run. They stay in the
+        counts, so that a checkpointed run can be extended into them.
+        """
+        counts.place()
+        if not self._started:
+            self._start(counts)
+        self._append(counts, list(counts.windows.items()))
+
+
+def run_windowed(num_primes_to_check=1_000_000, output='windowed_stats.csv', window_primes=None,
+                 bins_per_decade=None, offsets=SEVEN_SISTERS, multiplier=2, workers=1, cache_path=None, start=2,
+                 backend='sieve', checkpoint_path=None, metrics=None):
+    """
+    Streams the first 'num_primes_to_check' primes from 'start' and writes the
+    counts of every window to the CSV file 'output' as soon as it is finished.
+    Windows hold 'window_primes' primes (100,000 if neither size is given) or
+    are 'bins_per_decade' logarithmic bins of p per power of ten.
+    The other arguments are those of the analyses. Returns the number of windows written.
+    """
+    if window_primes is None and bins_per_decade is None:
+        window_primes = DEFAULT_WINDOW_PRIMES
+    print(f"\nWriting windowed statistics of {num_primes_to_check:,} primes to {output}...")
+    start_time = time.time()
+    writer = TimeSeriesWriter(output)
+    make_counts = functools.partial(WindowedCounts, tuple(offsets), window_primes, bins_per_decade, multiplier)
+    with collecting(metrics):
+        counts = run_sharded(make_counts, num_primes_to_check, workers, cache_path, start, backend, multiplier,
+                             checkpoint_path=checkpoint_path, on_progress=writer.write_finished)
+        writer.write_rest(counts)
+    end_time = time.time()
+    print(f"{writer.num_windows:,} windows written. Time taken: {end_time - start_time:.2f} seconds.")
+    print(f"File location: {os.path.abspath(output)}")
+    return writer.num_windows
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write per-window success rates as a CSV time series.")
+    parser.add_argument('--primes', type=int, default=1_000_000, help="number of primes to analyze")
+    windows = parser.add_mutually_exclusive_group()
+    windows.add_argument('--window-primes', type=int, help="primes per window (default: 100,000)")
+    windows.add_argument('--bins-per-decade', type=int, help="logarithmic windows of p, this many per power of ten")
+    parser.add_argument('--offsets', type=int, nargs='+', default=SEVEN_SISTERS, help="offsets k to test")
+    parser.add_argument('--multiplier', type=int, default=2, help="the multiplier a (default: 2)")
+    parser.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes")
+    parser.add_argument('--cache', help="prime cache file to read instead of sieving")
+    parser.add_argument('--start', type=int, default=2, help="analyze the primes from this number on")
+    parser.add_argument('--backend', choices=sorted(BACKENDS), default='sieve',
+                        help="how candidates are tested for primality (default: sieve)")
+    parser.add_argument('--checkpoint', help="checkpoint file to save progress to, and to resume or extend from")
+    parser.add_argument('--output', default='windowed_stats.csv', help="CSV file for the time series")
+    args = parser.parse_args()
+
+    run_windowed(args.primes, args.output, args.window_primes, args.bins_per_decade, sorted(args.offsets),
+                 args.multiplier, workers=args.workers, cache_path=args.cache, start=args.start,
+                 backend=args.backend, checkpoint_path=args.checkpoint)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,339 @@
+"""
+Work units for spreading one engine analysis over several machines.
+
+An analysis of the first N primes from 'start' is planned as work units, each
+a range [lo, hi) of values holding together at most N primes (see
+parallel.plan_shards), followed by a tail unit from the end of the last range
+that takes the primes still missing. Every unit carries the whole analysis
+(offsets, reports, moduli, backend and format version), so a worker needs
+nothing but the unit file. A worker processes a unit like engine.py would and
+writes a partial-result file holding the mergeable counts and the number of
+primes they cover, counted as the unit is processed; the tail is processed
+once every range unit is done, from their counts. The merge step checks that
+the partials belong to the same analysis and cover its range exactly, without
+gaps or overlaps, and merges them in range order into the same tables as a
+single-node run.
+
+A directory shared by the machines serves as the queue: units wait in
+pending/, a worker claims one by moving it to running/ (an atomic rename),
+writes its partial to partials/ and then moves the unit to done/.
+
+    python src/work_units.py plan queue --primes 1000000000 --units 200
+    python src/work_units.py work queue --workers 8 --cache primes.cache
+    python src/work_units.py status queue
+    python src/work_units.py merge queue --output-dir results
+"""
+import argparse
+import functools
+import glob
+import json
+import os
+import pickle
+import time
+
+from checkpoint import checkpoint_key
+from engine import CombinedCounts, OPTIONAL_REPORTS, REPORTS, save_results, select_reports
+from metrics import stage
+from offsets import SEVEN_SISTERS
+from parallel import plan_shards, prime_span, run_sharded
+from prime_cache import build_cache
+from primality import BACKENDS
+
+FORMAT_VERSION = 2
+
+QUEUE_DIRS = ('pending', 'running', 'done', 'partials')
+
+
+def make_analysis(num_primes, start=2, offsets=SEVEN_SISTERS, reports=None, moduli=None, backend='sieve'):
+    """
+    Describes an engine analysis of the first 'num_primes' primes from 'start'.
+    """
+    return {
+        'version': FORMAT_VERSION,
+        'num_primes': num_primes,
+        'start': start,
+        'offsets': [int(k) for k in offsets],
+        'reports': sorted(REPORTS) if reports is None else sorted(reports),
+        'moduli': list(moduli or ()),
+        'backend': backend,
+    }
+
+
+def plan_units(analysis, num_units):
+    """
+    Splits the analysis into 'num_units' units of equal value ranges, and a
+    tail unit from the end of the last one with 'hi' None. The primes of the
+    ranges are only counted as they are processed.
+    """
+    shards = plan_shards(analysis['num_primes'], num_units, analysis['start'])
+    units = [{'unit': i, 'lo': lo, 'hi': hi, 'analysis': analysis} for i, (lo, hi) in enumerate(shards)]
+    tail = shards[-1][1] if shards else analysis['start']
+    units.append({'unit': len(shards), 'lo': tail, 'hi': None, 'analysis': analysis})
+    return units
+
+
+def _make_counts(analysis):
+    reports = select_reports(analysis['reports'], analysis['moduli'])
+    return functools.partial(CombinedCounts, reports, tuple(analysis['offsets']))
+
+
+def process_unit(unit, workers=1, cache_path=None, checkpoint_path=None, num_primes=None):
+    """
+    Runs the analysis over the primes of one unit; for the tail unit, over the
+    first 'num_primes' primes from its lower end. Returns the partial result:
+    the unit, the analysis key of its counts (see checkpoint.py), the number
+    of primes and the counts.
+    """
+    analysis = unit['analysis']
+    if analysis['version'] != FORMAT_VERSION:
+        raise ValueError(f"Unit {unit['unit']} has format version {analysis['version']}, expected {FORMAT_VERSION}")
+    if (unit['hi'] is None) == (num_primes is None):
+        raise ValueError(f"Unit {unit['unit']} takes a number of primes if and only if it is the tail unit")
+    counts = run_sharded(_make_counts(analysis), num_primes, workers, cache_path, unit['lo'], analysis['backend'],
+                         checkpoint_path=checkpoint_path, stop=unit['hi'])
+    return {
+        'version': FORMAT_VERSION,
+        'unit': unit,
+        'key': checkpoint_key(counts, analysis['start']),
+        'num_primes': counts.num_primes,
+        'counts': counts,
+    }
+
+
+def save_partial(partial, path):
+    """
+    Writes a partial result; the file is replaced atomically, so a crash never leaves it half written.
+    """
+    temporary = path + '.tmp'
+    with open(temporary, 'wb') as f:
+        pickle.dump(partial, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporary, path)
+
+
+def load_partial(path):
+    with open(path, 'rb') as f:
+        partial = pickle.load(f)
+    if partial.get('version') != FORMAT_VERSION:
+        raise ValueError(f"'{path}' has partial-result version {partial.get('version')}, expected {FORMAT_VERSION}")
+    return partial
+
+
+def check_coverage(partials):
+    """
+    Checks that the partials belong to one analysis and cover its range exactly
+    once. Returns them sorted by range; raises ValueError describing the first
+    gap, overlap or mismatch otherwise.
+    """
+    if not partials:
+        raise ValueError("No partial results to merge")
+    # The tail unit, with no upper end, sorts after a range starting where it does.
+    partials = sorted(partials, key=lambda partial: (partial['unit']['lo'], partial['unit']['hi'] is None,
+                                                     partial['unit']['hi'] or 0))
+    analysis = partials[0]['unit']['analysis']
+    key = partials[0]['key']
+
+    position = analysis['start']
+    num_primes = 0
+    for partial in partials:
+        unit = partial['unit']
+        if unit['analysis'] != analysis or partial['key'] != key:
+            raise ValueError(f"Unit {unit['unit']} belongs to a different analysis: {unit['analysis']}")
+        if position is None:
+            raise ValueError(f"Unit {unit['unit']} [{unit['lo']:,}, ...) follows the tail unit")
+        if unit['lo'] > position:
+            raise ValueError(f"No partial result covers [{position:,}, {unit['lo']:,})")
+        if unit['lo'] < position:
+            raise ValueError(f"Unit {unit['unit']} [{unit['lo']:,}, ...) overlaps the range before {position:,}")
+        position = unit['hi']
+        num_primes += partial['num_primes']
+    if position is not None:
+        raise ValueError(f"No tail unit covers the primes from {position:,}")
+    if num_primes != analysis['num_primes']:
+        raise ValueError(f"The partial results cover {num_primes:,} primes, "
+                         f"but the analysis has {analysis['num_primes']:,}")
+    return partials
+
+
+def merge_partials(partials):
+    """
+    Merges partial results covering one analysis. Returns (analysis, merged counts).
+    """
+    partials = check_coverage(partials)
+    counts = partials[0]['counts']
+    for partial in partials[1:]:
+        with stage('merge', partial['num_primes']):
+            counts.merge(partial['counts'])
+    return partials[0]['unit']['analysis'], counts
+
+
+def _unit_name(unit):
+    return f"unit-{unit['unit']:06d}"
+
+
+def plan_queue(queue_dir, analysis, num_units):
+    """
+    Creates the queue directories and a pending unit file for every unit.
+    """
+    if glob.glob(os.path.join(queue_dir, '*', 'unit-*')):
+        raise ValueError(f"'{queue_dir}' already holds a queue")
+    for name in QUEUE_DIRS:
+        os.makedirs(os.path.join(queue_dir, name), exist_ok=True)
+    units = plan_units(analysis, num_units)
+    for unit in units:
+        with open(os.path.join(queue_dir, 'pending', _unit_name(unit) + '.json'), 'w') as f:
+            json.dump(unit, f, indent=2)
+    return units
+
+
+def _others_done(queue_dir):
+    return (len(glob.glob(os.path.join(queue_dir, 'pending', 'unit-*.json'))) == 1
+            and not glob.glob(os.path.join(queue_dir, 'running', 'unit-*.json')))
+
+
+def claim_unit(queue_dir):
+    """
+    Moves the first pending unit to running/ and returns (unit, path), or None
+    when no unit can be claimed. The rename succeeds for only one of several
+    workers claiming the same unit. The tail unit, the last one, is only
+    claimed once every other unit is done.
+    """
+    for path in sorted(glob.glob(os.path.join(queue_dir, 'pending', 'unit-*.json'))):
+        running = os.path.join(queue_dir, 'running', os.path.basename(path))
+        try:
+            with open(path) as f:
+                if json.load(f)['hi'] is None and not _others_done(queue_dir):
+                    return None
+            os.rename(path, running)
+        except FileNotFoundError:
+            continue
+        with open(running) as f:
+            return json.load(f), running
+    return None
+
+
+def work_queue(queue_dir, workers=1, cache_path=None, max_units=None):
+    """
+    Processes pending units until none are left (or 'max_units' are done).
+    Returns the number of units processed.
+    """
+    done = 0
+    while max_units is None or done < max_units:
+        claimed = claim_unit(queue_dir)
+        if claimed is None:
+            break
+        unit, running = claimed
+        name = _unit_name(unit)
+        num_primes = None
+        if unit['hi'] is None:
+            # The tail takes the primes that the range units, all done by now, left missing.
+            paths = glob.glob(os.path.join(queue_dir, 'partials', 'unit-*.pkl'))
+            num_primes = unit['analysis']['num_primes'] - sum(load_partial(path)['num_primes'] for path in paths)
+            if num_primes < 0:
+                raise ValueError(f"The units before {name} hold {-num_primes:,} primes more than the analysis")
+            print(f"\nProcessing {name}: {num_primes:,} primes from {unit['lo']:,}")
+        else:
+            print(f"\nProcessing {name}: the primes in [{unit['lo']:,}, {unit['hi']:,})")
+        start_time = time.time()
+
+        if cache_path is not None and num_primes != 0:
+            # Make sure the cache reaches the largest candidate of the unit.
+            hi = unit['hi'] if num_primes is None else unit['lo'] + prime_span(unit['lo'], num_primes)
+            limit = 2 * (hi - 1) + max(unit['analysis']['offsets'])
+            build_cache(cache_path, limit, spf='new_failed_results_by_multiple' in unit['analysis']['reports'])
+        # An interrupted unit resumes from its checkpoint when it is claimed again.
+        checkpoint_path = os.path.join(queue_dir, 'partials', name + '.ckpt')
+        partial = process_unit(unit, workers, cache_path, checkpoint_path, num_primes)
+        save_partial(partial, os.path.join(queue_dir, 'partials', name + '.pkl'))
+        os.remove(checkpoint_path)
+        os.replace(running, os.path.join(queue_dir, 'done', os.path.basename(running)))
+
+        print(f"Finished {name}. Time taken: {time.time() - start_time:.2f} seconds.")
+        done += 1
+    return done
+
+
+def requeue(queue_dir):
+    """
+    Moves the units left in running/ by workers that stopped back to pending/.
+    Only to be used while no worker is running. Returns the number of units moved.
+    """
+    paths = glob.glob(os.path.join(queue_dir, 'running', 'unit-*.json'))
+    for path in paths:
+        os.replace(path, os.path.join(queue_dir, 'pending', os.path.basename(path)))
+    return len(paths)
+
+
+def queue_status(queue_dir):
+    """
+    Returns the number of units in each state of the queue.
+    """
+    return {name: len(glob.glob(os.path.join(queue_dir, name, 'unit-*.json')))
+            for name in ('pending', 'running', 'done')}
+
+
+def merge_queue(queue_dir, output_dir):
+    """
+    Merges the partial results of a queue (or of any directory of partial
+    result files) and writes the report CSV files to output_dir.
+    """
+    paths = glob.glob(os.path.join(queue_dir, 'partials', '*.pkl')) or glob.glob(os.path.join(queue_dir, '*.pkl'))
+    analysis, counts = merge_partials([load_partial(path) for path in paths])
+    print(f"\nMerged {len(paths)} partial results covering the first {analysis['num_primes']:,} primes "
+          f"from {analysis['start']:,}")
+    with stage('results'):
+        results = counts.results()
+    save_results(results, output_dir, select_reports(analysis['reports'], analysis['moduli']))
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Spread an engine analysis over several machines through a "
+                                                 "shared queue directory.")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    plan = commands.add_parser('plan', help="split an analysis into pending work units")
+    plan.add_argument('queue', help="queue directory")
+    plan.add_argument('--primes', type=int, default=1_000_000, help="number of primes to analyze")
+    plan.add_argument('--units', type=int, required=True, help="number of work units")
+    plan.add_argument('--start', type=int, default=2, help="analyze the primes from this number on")
+    plan.add_argument('--reports', nargs='+', choices=sorted(REPORTS) + sorted(OPTIONAL_REPORTS),
+                      default=sorted(REPORTS), help="reports to produce (default: the four of the note)")
+    plan.add_argument('--moduli', type=int, nargs='+', help="also break the statistics down by residue class of p")
+    plan.add_argument('--backend', choices=sorted(BACKENDS), default='sieve',
+                      help="how candidates are tested for primality (default: sieve)")
+
+    work = commands.add_parser('work', help="process pending units until none are left")
+    work.add_argument('queue', help="queue directory")
+    work.add_argument('--workers', type=int, default=os.cpu_count(), help="worker processes on this machine")
+    work.add_argument('--cache', help="prime cache file on this machine, built or extended as needed")
+    work.add_argument('--max-units', type=int, help="stop after this many units")
+
+    status = commands.add_parser('status', help="count the units in each state")
+    status.add_argument('queue', help="queue directory")
+
+    requeue_parser = commands.add_parser('requeue', help="return the units of stopped workers to the queue")
+    requeue_parser.add_argument('queue', help="queue directory")
+
+    merge = commands.add_parser('merge', help="merge the partial results into the report CSV files")
+    merge.add_argument('queue', help="queue directory, or a directory of partial result files")
+    merge.add_argument('--output-dir', default='.', help="directory for the CSV files")
+    args = parser.parse_args()
+
+    if args.command == 'plan':
+        analysis = make_analysis(args.primes, args.start, reports=args.reports, moduli=args.moduli,
+                                 backend=args.backend)
+        units = plan_queue(args.queue, analysis, args.units)
+        print(f"Planned {len(units)} units from {units[0]['lo']:,} in {args.queue}")
+    elif args.command == 'work':
+        done = work_queue(args.queue, args.workers, args.cache, args.max_units)
+        print(f"\nProcessed {done} units")
+    elif args.command == 'status':
+        print(', '.join(f"{name}: {count}" for name, count in queue_status(args.queue).items()))
+    elif args.command == 'requeue':
+        print(f"Moved {requeue(args.queue)} units back to pending")
+    else:
+        merge_queue(args.queue, args.output_dir)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,19 @@
+import pytest
+
+from parallel import estimate_span, plan_shards
+from prime_count import prime_count
+
+
+def test_exact_shards_hold_the_primes():
+    shards = plan_shards(100_000, 7, start=1_000)
+    assert shards[0][0] == 1_000
+    assert all(a[1] == b[0] for a, b in zip(shards, shards[1:]))
+    assert prime_count(shards[-1][1] - 1) - prime_count(999) == 100_000
+
+
+@pytest.mark.parametrize('start', [10 ** 7, 10 ** 9])
+def test_estimated_span_is_close(start):
+    num_primes = 200_000
+    span = estimate_span(start, num_primes)
+    count = prime_count(start + span - 1) - prime_count(start - 1)
+    assert abs(count - num_primes) < 5 * num_primes ** 0.5
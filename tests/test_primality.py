@@ -0,0 +1,43 @@
+import numpy as np
+import pytest
+
+from primality import VECTOR_LIMIT, MillerRabinWindow, is_prime, is_prime_batch
+from sieve import sieve_window
+
+
+@pytest.mark.parametrize('lo', [0, 1_000_000, 20_000_000_000_000])
+def test_smallest_prime_factors_match_sieve(lo):
+    hi = lo + 2_000_000
+    values = np.random.default_rng(lo).integers(max(lo, 2), hi, 20_000)
+    if lo == 0:
+        values = np.concatenate((values, [0, 1, 2, 3, 4, 997, 1009 * 1013, 1013 * 1013]))
+    expected = sieve_window(lo, hi).smallest_prime_factor_array(values)
+    assert np.array_equal(MillerRabinWindow(lo, hi).smallest_prime_factor_array(values), expected)
+
+
+@pytest.mark.parametrize('center', [4_759_123_141, 1_122_004_669_633, VECTOR_LIMIT])
+def test_is_prime_batch_matches_sieve_around_tier_boundaries(center):
+    lo, hi = center - 20_000, center + 20_000
+    values = np.arange(lo, hi, dtype=np.int64)
+    expected = np.zeros(values.size, dtype=bool)
+    expected[sieve_window(lo, hi).primes() - lo] = True
+    assert np.array_equal(is_prime_batch(values), expected)
+    assert [is_prime(n) for n in range(center - 200, center + 200)] == expected[19_800:20_200].tolist()
+
+
+def test_is_prime_batch_rejects_strong_pseudoprimes():
+    # Strong pseudoprimes to the bases 2, 3, 5, 7; to the witnesses of the two smaller
+    # tiers; and to every prime base up to 23.
+    pseudoprimes = [3_215_031_751, 4_759_123_141, 1_122_004_669_633, 3_825_123_056_546_413_051]
+    assert not is_prime_batch(np.array(pseudoprimes, dtype=np.int64)).any()
+    assert not any(is_prime(n) for n in pseudoprimes)
+
+
+def test_is_prime_beyond_64_bits():
+    # psi_12, a strong pseudoprime to every prime base up to 37.
+    assert not is_prime(318_665_857_834_031_151_167_461)
+    # Two Mersenne primes.
+    assert is_prime((1 << 61) - 1) and is_prime((1 << 13) - 1)
+    assert not is_prime(((1 << 61) - 1) * ((1 << 13) - 1))
+    with pytest.raises(ValueError):
+        is_prime(3_317_044_064_679_887_385_961_981)
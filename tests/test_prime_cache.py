@@ -0,0 +1,51 @@
+import math
+
+import numpy as np
+
+import prime_cache
+from prime_cache import PrimeCache, build_cache, read_header
+from sieve import sieve_window
+
+
+def _narrow_below(monkeypatch, root):
+    # Switch to 32-bit factors above root^2 instead of 2^32, so the tables stay small.
+    monkeypatch.setattr(prime_cache, '_spf_layout',
+                        lambda limit: 'odd-spf16' if math.isqrt(limit) <= root else 'odd-spf32')
+
+
+def test_smaller_spf_limit_keeps_larger_table(tmp_path, monkeypatch):
+    _narrow_below(monkeypatch, 1000)
+    path = str(tmp_path / 'primes.cache')
+    build_cache(path, 2_000_000, spf=True)
+    before = read_header(path + '.spf')
+    assert before['layout'] == 'odd-spf32'
+
+    build_cache(path, 100_000, spf=True)
+    after = read_header(path + '.spf')
+    assert after == before
+
+
+def test_spf_table_widened_when_extended(tmp_path, monkeypatch):
+    _narrow_below(monkeypatch, 1000)
+    path = str(tmp_path / 'primes.cache')
+    build_cache(path, 100_000, spf=True)
+    assert read_header(path + '.spf')['layout'] == 'odd-spf16'
+    build_cache(path, 2_000_000, spf=True)
+    header = read_header(path + '.spf')
+    assert header['layout'] == 'odd-spf32' and header['limit'] == 2_000_000
+
+    fresh = str(tmp_path / 'fresh.cache')
+    build_cache(fresh, 2_000_000, spf=True)
+    assert np.array_equal(PrimeCache(path, verify=True).smallest_factors,
+                          PrimeCache(fresh, verify=True).smallest_factors)
+
+
+def test_spf_limit_below_bitmap_limit(tmp_path):
+    path = str(tmp_path / 'primes.cache')
+    cache = build_cache(path, 1_000_000, spf=True, spf_limit=50_000)
+    assert cache.limit == 1_000_000
+    assert cache.spf_limit == 50_000
+    for lo, hi in ((40_000, 50_000), (900_000, 910_000)):
+        values = np.arange(lo, hi)
+        assert np.array_equal(cache.window(lo, hi).smallest_prime_factor_array(values),
+                              sieve_window(lo, hi).smallest_prime_factor_array(values))
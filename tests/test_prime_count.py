@@ -0,0 +1,48 @@
+import numpy as np
+import pytest
+
+from prime_count import prime_count
+from sieve import PrimeSieve, nth_prime
+
+LIMIT = 3_000_000
+
+
+@pytest.fixture(scope='module')
+def primes():
+    # Brute force: a plain Sieve of Eratosthenes over every integer up to LIMIT.
+    flags = np.ones(LIMIT + 1, dtype=bool)
+    flags[:2] = False
+    flags[4::2] = False
+    for d in range(3, int(LIMIT ** 0.5) + 1, 2):
+        flags[d * d::2 * d] = False
+    return np.flatnonzero(flags)
+
+
+def test_prime_count_matches_brute_force(primes):
+    rng = np.random.default_rng(16)
+    points = np.concatenate((np.arange(0, 200), primes[:50], primes[-50:], primes[-50:] - 1,
+                             rng.integers(0, LIMIT, 300), [LIMIT]))
+    for x in points.tolist():
+        assert prime_count(x) == np.searchsorted(primes, x, side='right'), x
+
+
+def test_nth_prime_matches_brute_force(primes):
+    rng = np.random.default_rng(61)
+    for n in np.concatenate((np.arange(1, 100), rng.integers(1, primes.size + 1, 200), [primes.size])).tolist():
+        assert nth_prime(n) == primes[n - 1], n
+
+
+def test_nth_prime_rejects_non_positive():
+    with pytest.raises(ValueError):
+        nth_prime(0)
+
+
+@pytest.mark.parametrize('x, count', [(10 ** 8, 5_761_455), (10 ** 9, 50_847_534)])
+def test_prime_count_known_values(x, count):
+    assert prime_count(x) == count
+
+
+def test_prime_count_matches_sieve_near_larger_values():
+    sieved = PrimeSieve(40_000_000).primes()
+    for x in (39_999_999, 40_000_000, 12_345_677, 20_000_003):
+        assert prime_count(x) == np.searchsorted(sieved, x, side='right')
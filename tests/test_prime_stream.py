@@ -0,0 +1,21 @@
+import itertools
+
+import numpy as np
+import pytest
+
+from primality import is_prime_batch
+from prime_stream import SparseBitmap, produce_primes
+
+
+def test_produced_primes_are_new_primes():
+    seeds = np.array([11, 13, 17, 19, 23], dtype=np.int64)
+    batches = list(itertools.islice(produce_primes([seeds], max_value=10 ** 6, seen=SparseBitmap()), 5))
+    primes = np.concatenate(batches)
+    assert primes.size and is_prime_batch(primes).all()
+    assert np.unique(primes).size == primes.size
+    assert not np.isin(primes, seeds).any()
+
+
+def test_seeds_above_the_largest_parent():
+    with pytest.raises(ValueError, match="Every seed is above"):
+        next(produce_primes([np.array([1_000_003], dtype=np.int64)], max_value=10 ** 6))
@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+
+import sieve
+from sieve import PrimeSieve
+
+
+def brute_force_primes(limit):
+    flags = np.ones(limit + 1, dtype=bool)
+    flags[:2] = False
+    for p in range(2, int(limit ** 0.5) + 1):
+        if flags[p]:
+            flags[p * p::p] = False
+    return np.flatnonzero(flags)
+
+
+@pytest.mark.parametrize('limit', [0, 1, 2, 3, 10, 97, 1000, 4095, 4096, 4097, 100_003])
+def test_prime_sieve_matches_brute_force(limit, monkeypatch):
+    # Small segments so that every limit but the tiniest is sieved segment by segment.
+    monkeypatch.setattr(sieve, 'PACKED_SEGMENT_SIZE', 64)
+    sieve_ = PrimeSieve(limit)
+    expected = brute_force_primes(limit)
+    assert np.array_equal(sieve_.primes(), expected)
+    assert sieve_.count() == expected.size
+    assert sieve_.is_prime_array(np.arange(limit + 1)).sum() == expected.size
+
+
+def test_segmented_sieve_matches_single_segment(monkeypatch):
+    whole = PrimeSieve(1_000_001).bits
+    monkeypatch.setattr(sieve, 'PACKED_SEGMENT_SIZE', 1 << 12)
+    assert np.array_equal(PrimeSieve(1_000_001).bits, whole)
@@ -0,0 +1,22 @@
+import numpy as np
+import pytest
+
+from engine import run_analysis
+from success_store import SuccessStore
+
+
+def _store_run(tmp_path, name, num_primes, workers=1, checkpoint=None):
+    store_path = str(tmp_path / name)
+    run_analysis(num_primes, reports={}, workers=workers, store_path=store_path,
+                 checkpoint_path=None if checkpoint is None else str(tmp_path / checkpoint))
+    return SuccessStore.open(store_path)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_store_extended_from_checkpoint(tmp_path, workers):
+    expected = _store_run(tmp_path, 'whole', 2_500)
+    _store_run(tmp_path, 'extended', 1_000, workers, checkpoint='run.ckpt')
+    extended = _store_run(tmp_path, 'extended', 2_500, workers, checkpoint='run.ckpt')
+    assert np.array_equal(extended.primes, expected.primes)
+    assert np.array_equal(extended.masks, expected.masks)
+    assert not list((tmp_path / 'extended').glob('part-*'))
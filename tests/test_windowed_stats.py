@@ -0,0 +1,19 @@
+import pytest
+
+import windowed_stats
+from windowed_stats import run_windowed
+
+
+@pytest.mark.parametrize('windows', [{'window_primes': 3_000}, {'bins_per_decade': 5}])
+def test_parallel_run_writes_the_serial_series(tmp_path, monkeypatch, windows):
+    # Shards of a few blocks, so that windows are split across many of them.
+    monkeypatch.setattr(windowed_stats, 'MAX_SHARD_PRIMES', 500)
+    serial, parallel = tmp_path / 'serial.csv', tmp_path / 'parallel.csv'
+    assert run_windowed(20_000, str(serial), workers=1, **windows) == run_windowed(
+        20_000, str(parallel), workers=3, **windows)
+    assert serial.read_text() == parallel.read_text()
+
+
+def test_windows_counted_from_start(tmp_path):
+    output = tmp_path / 'windows.csv'
+    assert run_windowed(10_000, str(output), window_primes=2_500, start=10 ** 9, workers=2) == 4
@@ -0,0 +1,55 @@
+import pytest
+
+from work_units import check_coverage, make_analysis, merge_partials, plan_units, process_unit
+
+ANALYSIS = make_analysis(20_000, start=1_000)
+
+
+def _partial(unit, lo, hi, num_primes, key='key'):
+    return {'unit': {'unit': unit, 'lo': lo, 'hi': hi, 'analysis': ANALYSIS}, 'key': key,
+            'num_primes': num_primes, 'counts': None}
+
+
+def test_coverage_in_range_order():
+    partials = [_partial(2, 3_000, None, 5_000), _partial(0, 1_000, 2_000, 10_000), _partial(1, 2_000, 3_000, 5_000)]
+    assert [partial['unit']['unit'] for partial in check_coverage(partials)] == [0, 1, 2]
+
+
+def test_coverage_gap():
+    partials = [_partial(0, 1_000, 2_000, 10_000), _partial(2, 2_500, None, 10_000)]
+    with pytest.raises(ValueError, match=r"No partial result covers \[2,000, 2,500\)"):
+        check_coverage(partials)
+
+
+def test_coverage_overlap():
+    partials = [_partial(0, 1_000, 2_000, 10_000), _partial(1, 1_500, 3_000, 5_000), _partial(2, 3_000, None, 5_000)]
+    with pytest.raises(ValueError, match="overlaps the range before 2,000"):
+        check_coverage(partials)
+
+
+def test_coverage_missing_tail():
+    with pytest.raises(ValueError, match="No tail unit"):
+        check_coverage([_partial(0, 1_000, 2_000, 20_000)])
+
+
+def test_coverage_wrong_prime_count():
+    with pytest.raises(ValueError, match="cover 19,999 primes"):
+        check_coverage([_partial(0, 1_000, 2_000, 9_999), _partial(1, 2_000, None, 10_000)])
+
+
+def test_coverage_different_analysis():
+    with pytest.raises(ValueError, match="different analysis"):
+        check_coverage([_partial(0, 1_000, 2_000, 10_000), _partial(1, 2_000, None, 10_000, key='other')])
+
+
+def test_units_merge_like_one_run():
+    analysis = make_analysis(5_000, start=1_000, reports=['exact_and_cumulative_results'])
+    units = plan_units(analysis, 3)
+    range_partials = [process_unit(unit) for unit in units[:-1]]
+    missing = analysis['num_primes'] - sum(partial['num_primes'] for partial in range_partials)
+    tail = process_unit(units[-1], num_primes=missing)
+    _, counts = merge_partials(range_partials + [tail])
+
+    whole = process_unit({'unit': 0, 'lo': 1_000, 'hi': None, 'analysis': analysis}, num_primes=5_000)['counts']
+    assert counts.num_primes == 5_000
+    assert counts.results() == whole.results()